@@ -0,0 +1,83 @@
+import argparse
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import synthetic
+
+root = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(root))
+
+from core import capabilities, deadline  # noqa: E402
+
+# calibrate measures how fast this host encodes with each installed encoder
+# and preset, and stores the result as the throughput table that jobs with a
+# deadline use to pick their presets (see core.deadline):
+#
+#   python benchmarks/calibrate.py
+#
+# Speeds are stored as pixels per second, so they can be scaled to any
+# source size. Run it again after changing the host's hardware or ffmpeg.
+
+
+def encode_time(command: list) -> float:
+    time_start = time.perf_counter()
+    result = subprocess.run(command, capture_output=True, text=True)
+    elapsed = time.perf_counter() - time_start
+    if result.returncode != 0:
+        raise RuntimeError("ffmpeg failed:\n{}".format(result.stderr.strip()))
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Measure this host's encoding speed for deadline planning."
+    )
+    parser.add_argument("--resolution", default="1280x720")
+    parser.add_argument("--duration", type=float, default=4, help="in seconds")
+    parser.add_argument("--rate", type=float, default=30, help="frames per second")
+    parser.add_argument(
+        "--encoders",
+        default=",".join(deadline.presets),
+        help="a comma separated list of ffmpeg encoders",
+    )
+    options = parser.parse_args()
+
+    width, height = (int(v) for v in options.resolution.split("x"))
+    pixels = width * height * options.duration * options.rate
+    inputs = ["ffmpeg", "-hide_banner", "-loglevel", "error", "-y"]
+    inputs += synthetic.lavfi_inputs(width, height, options.rate, options.duration)
+
+    # Generating the source is part of every encode's time, so it is
+    # measured on its own and taken off.
+    generate = encode_time(inputs + ["-f", "null", "-"])
+
+    table = {}
+    with tempfile.TemporaryDirectory() as directory:
+        output = str(Path(directory) / "calibrate.mp4")
+        for encoder in options.encoders.split(","):
+            if not capabilities.has_encoder(encoder):
+                print("Skipping {}: not supported by ffmpeg".format(encoder))
+                continue
+            table[encoder] = {}
+            for preset in deadline.presets[encoder]:
+                option = "cpu-used" if encoder == "libaom-av1" else "preset"
+                command = inputs + ["-c:v", encoder, "-" + option, preset]
+                if encoder == "libaom-av1":
+                    command += ["-row-mt", "1"]
+                elapsed = max(encode_time(command + [output]) - generate, 0.001)
+                table[encoder][preset] = round(pixels / elapsed)
+                print(
+                    "{:<12} {:<10} {:>8.1f} fps".format(
+                        encoder, preset, options.duration * options.rate / elapsed
+                    )
+                )
+
+    deadline.save_throughput(table)
+    print("Saved to {}".format(deadline.throughput_file))
+
+
+if __name__ == "__main__":
+    main()
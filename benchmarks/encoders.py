@@ -0,0 +1,119 @@
+import argparse
+import json
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import synthetic
+
+root = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(root))
+
+from core import capabilities, encoders  # noqa: E402
+
+# encoders measures how fast each AV1 encoder and preset runs on this
+# machine, and how large its output is, so archive settings can be chosen
+# from measured throughput rather than guessed. Each encode reads a
+# synthetic testsrc2 clip directly from lavfi, with the same options the
+# video plugin would use:
+#
+#   python benchmarks/encoders.py --encoders svt,aom --presets 4,8,12
+#
+# The "source" rows time generating the clip alone, which is included in
+# every encode's time. Encoders ffmpeg wasn't built with are skipped.
+
+libraries = {"svt": "libsvtav1", "aom": "libaom-av1"}
+
+
+def run(command: list) -> float:
+    """Run an ffmpeg command, and return how long it took."""
+
+    time_start = time.perf_counter()
+    result = subprocess.run(command, capture_output=True, text=True)
+    elapsed = time.perf_counter() - time_start
+    if result.returncode != 0:
+        raise RuntimeError("ffmpeg failed:\n{}".format(result.stderr.strip()))
+    return elapsed
+
+
+def measure(resolution: str, encoder: str, preset: int, options, directory) -> dict:
+    width, height = (int(v) for v in resolution.split("x"))
+    command = ["ffmpeg", "-hide_banner", "-loglevel", "error", "-y"]
+    command += synthetic.lavfi_inputs(width, height, options.rate, options.duration)
+    frames = int(options.duration * options.rate)
+
+    if encoder == "source":
+        elapsed = run(command + ["-f", "null", "-"])
+        return {"fps": frames / elapsed, "seconds": elapsed, "size": 0}
+
+    av1 = encoders.StirlingVideoEncoderAV1(
+        encoder_fps=options.rate,
+        encoder_quality_level=options.crf,
+        encoder_quality_profile=str(preset),
+        encoder_threads=options.threads,
+    )
+    output = Path(directory) / "{}_{}_{}.mp4".format(resolution, encoder, preset)
+    for key, value in av1.get(encoder).items():
+        command += ["-" + key, str(value)]
+    elapsed = run(command + [str(output)])
+    return {
+        "fps": frames / elapsed,
+        "seconds": elapsed,
+        "size": output.stat().st_size,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure AV1 encoder speed.")
+    parser.add_argument("--encoders", default="svt,aom")
+    parser.add_argument("--presets", default="4,8,12")
+    parser.add_argument("--resolutions", default="640x360,1280x720,1920x1080")
+    parser.add_argument("--duration", type=float, default=5, help="in seconds")
+    parser.add_argument("--rate", type=float, default=30, help="frames per second")
+    parser.add_argument("--crf", type=int, default=30)
+    parser.add_argument("--threads", type=int, default=0, help="0 uses every core")
+    parser.add_argument("--output", help="also write the results to a JSON file")
+    options = parser.parse_args()
+
+    runs = []
+    for encoder in options.encoders.split(","):
+        if not capabilities.has_encoder(libraries[encoder]):
+            print("Skipping {}: ffmpeg has no {}".format(encoder, libraries[encoder]))
+            continue
+        # aom's cpu-used stops at 8.
+        for preset in [int(p) for p in options.presets.split(",")]:
+            runs.append((encoder, min(preset, 8) if encoder == "aom" else preset))
+
+    results = []
+    print(
+        "{:<10} {:<8} {:>6} {:>9} {:>9} {:>11}".format(
+            "size", "encoder", "preset", "fps", "seconds", "kilobytes"
+        )
+    )
+    with tempfile.TemporaryDirectory() as directory:
+        for resolution in options.resolutions.split(","):
+            for encoder, preset in [("source", 0)] + list(dict.fromkeys(runs)):
+                result = {"resolution": resolution, "encoder": encoder}
+                result["preset"] = preset
+                result |= measure(resolution, encoder, preset, options, directory)
+                results.append(result)
+                print(
+                    "{:<10} {:<8} {:>6} {:>9.1f} {:>9.2f} {:>11.1f}".format(
+                        resolution,
+                        encoder,
+                        preset if encoder != "source" else "",
+                        result["fps"],
+                        result["seconds"],
+                        result["size"] / 1000,
+                    )
+                )
+
+    if options.output:
+        with open(options.output, "w") as f:
+            json.dump(results, f, indent=4)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+import argparse
+import os
+import shutil
+import tempfile
+import time
+from pathlib import Path
+
+# hls_layout compares the two ways the HLS plugin can lay out a rendition on
+# disk: one file per segment (the default), or a single file per rendition
+# addressed by byte ranges (hls_single_file). It writes the same number of
+# bytes both ways, then times writing, listing and uploading them:
+#
+#   python benchmarks/hls_layout.py --duration 10800 --renditions 4
+#
+# Uploads are measured as a copy to a destination folder, one file at a time,
+# as object stores take one request per file. Pass --destination to copy to a
+# mounted bucket or network share instead of a local temporary folder.
+
+
+def write(directory: Path, files: int, file_size: int, block: bytes):
+    """Write files of `file_size` bytes, and flush them to disk."""
+
+    for i in range(files):
+        with open(directory / "{:09d}".format(i), "wb") as f:
+            for _ in range(file_size // len(block)):
+                f.write(block)
+            f.write(block[: file_size % len(block)])
+            f.flush()
+            os.fsync(f.fileno())
+
+
+def list_files(directory: Path) -> int:
+    count = 0
+    for root, _, files in os.walk(directory):
+        count += len(files)
+    return count
+
+
+def upload(directory: Path, destination: Path):
+    for root, _, files in os.walk(directory):
+        target = destination / Path(root).relative_to(directory)
+        target.mkdir(parents=True, exist_ok=True)
+        for name in files:
+            shutil.copyfile(Path(root) / name, target / name)
+
+
+def measure(layout: str, options, segments: int, segment_size: int) -> dict:
+    """Write, list and upload every rendition in one layout, and time each."""
+
+    block = os.urandom(1024 * 1024)
+    if layout == "single file":
+        files, file_size = 1, segments * segment_size
+    else:
+        files, file_size = segments, segment_size
+
+    with tempfile.TemporaryDirectory(dir=options.directory) as source:
+        source = Path(source)
+        timings = {"files": files * options.renditions}
+
+        time_start = time.perf_counter()
+        for rendition in range(options.renditions):
+            directory = source / "{}".format(rendition)
+            directory.mkdir()
+            write(directory, files, file_size, block)
+        timings["write"] = time.perf_counter() - time_start
+
+        time_start = time.perf_counter()
+        list_files(source)
+        timings["list"] = time.perf_counter() - time_start
+
+        with tempfile.TemporaryDirectory(dir=options.destination) as destination:
+            time_start = time.perf_counter()
+            upload(source, Path(destination))
+            timings["upload"] = time.perf_counter() - time_start
+
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compare per-segment and single file HLS layouts."
+    )
+    parser.add_argument(
+        "--duration", type=int, default=3600, help="source length in seconds"
+    )
+    parser.add_argument(
+        "--segment-duration", type=int, default=2, help="segment length in seconds"
+    )
+    parser.add_argument(
+        "--bitrate", type=int, default=400, help="rendition bitrate in kilobits"
+    )
+    parser.add_argument("--renditions", type=int, default=3)
+    parser.add_argument("--directory", help="where to write the renditions")
+    parser.add_argument("--destination", help="where to upload the renditions")
+    options = parser.parse_args()
+
+    segments = -(-options.duration // options.segment_duration)
+    segment_size = options.bitrate * 1000 // 8 * options.segment_duration
+    print(
+        "{} renditions of {} segments, {:.1f}MB each".format(
+            options.renditions, segments, segments * segment_size / 1e6
+        )
+    )
+
+    print(
+        "{:<12} {:>8} {:>10} {:>10} {:>10}".format(
+            "layout", "files", "write", "list", "upload"
+        )
+    )
+    for layout in ["segments", "single file"]:
+        timings = measure(layout, options, segments, segment_size)
+        print(
+            "{:<12} {:>8} {:>9.3f}s {:>9.3f}s {:>9.3f}s".format(
+                layout,
+                timings["files"],
+                timings["write"],
+                timings["list"],
+                timings["upload"],
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
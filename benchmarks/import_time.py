@@ -0,0 +1,103 @@
+import argparse
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+# import_time checks that starting the engine stays fast. Each check runs a
+# statement in a fresh interpreter, takes the best of several runs, and
+# subtracts the time to start an empty interpreter, so what's left is the
+# cost of our imports. Any check over its budget fails the benchmark, and
+# the slowest imports behind it are printed:
+#
+#   python benchmarks/import_time.py
+#
+# Budgets are in seconds, and are deliberately loose so they hold on slower
+# machines; they exist to catch a heavy dependency (PyTorch, NumPy, networkx)
+# creeping back into the startup path.
+
+root = Path(__file__).resolve().parent.parent
+
+budgets = {
+    "main.py --help": 0.1,
+    "import plugins": 0.05,
+    "import core.jobs": 0.15,
+    "import core.video, core.audio": 0.15,
+    "import core.pytorch": 0.05,
+}
+
+
+def run(statement: str, importtime: bool = False) -> subprocess.CompletedProcess:
+    if statement.endswith(".py --help"):
+        command = [sys.executable, statement.split()[0], "--help"]
+    else:
+        command = [sys.executable, "-c", statement]
+    if importtime:
+        command.insert(1, "-Ximporttime")
+    return subprocess.run(command, cwd=root, capture_output=True, text=True)
+
+
+def measure(statement: str, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        time_start = time.perf_counter()
+        result = run(statement)
+        best = min(best, time.perf_counter() - time_start)
+        if result.returncode != 0:
+            raise RuntimeError(
+                "{} failed:\n{}".format(statement, result.stderr.strip())
+            )
+    return best
+
+
+def slowest_imports(statement: str, count: int = 10) -> list:
+    """Get the top-level imports that took the longest, from -X importtime."""
+
+    imports = []
+    for line in run(statement, importtime=True).stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line.split("|")
+        if not name.startswith("  "):
+            imports.append((int(cumulative), name.strip()))
+    return sorted(imports, reverse=True)[:count]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check the engine's import time.")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument(
+        "--scale",
+        type=float,
+        default=1.0,
+        help="multiply every budget, e.g. for a slow CI machine",
+    )
+    options = parser.parse_args()
+
+    baseline = measure("pass", options.repeat)
+    print("Interpreter startup: {:.3f}s".format(baseline))
+
+    failed = []
+    for statement, budget in budgets.items():
+        cost = measure(statement, options.repeat) - baseline
+        budget *= options.scale
+        over = cost > budget
+        print(
+            "{:<32} {:.3f}s (budget {:.3f}s){}".format(
+                statement, cost, budget, "  OVER BUDGET" if over else ""
+            )
+        )
+        if over:
+            failed.append(statement)
+
+    for statement in failed:
+        print("\nSlowest imports for {}:".format(statement))
+        for cumulative, name in slowest_imports(statement):
+            print("  {:>8.3f}s {}".format(cumulative / 1e6, name))
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,311 @@
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from pathlib import Path
+
+import synthetic
+
+root = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(root))
+
+from core import cache  # noqa: E402
+
+# suite runs whole jobs, the way the engine runs them in production, on
+# synthetic sources (see synthetic), and records where their time goes:
+#
+#   python benchmarks/suite.py --output results.json
+#   python benchmarks/suite.py --baseline results.json
+#
+# Every source is run with every combination of plugins, each job in a fresh
+# process so its peak memory is its own. For each job, the results file
+# records:
+#
+#   - the time of each phase (getting the source, probing, parsing the
+#     plugins, writing the job file), from the job's trace;
+#   - the time of each plugin's cmd() call;
+#   - each command's wall time, CPU time and peak memory, from job.usage;
+#   - the peak memory of the engine and of its commands;
+#   - the size of each plugin's outputs.
+#
+# With --baseline, the results are compared to an earlier results file, and
+# anything that got slower, larger or used more memory than the threshold
+# allows is printed, and fails the run. Compare results from the same host.
+
+# The synthetic sources, as (duration, width, height, frame rate, audio
+# channels).
+sources = {
+    "360p": (10, 640, 360, 30, 2),
+    "720p": (10, 1280, 720, 30, 2),
+    "1080p60": (10, 1920, 1080, 60, 2),
+    "720p-surround": (10, 1280, 720, 25, 6),
+    "720p-silent": (10, 1280, 720, 30, 0),
+    "360p-long": (120, 640, 360, 30, 2),
+}
+
+# The plugin combinations to run on each source.
+combinations = {
+    "proxy": ["proxy"],
+    "archive": ["video", "audio"],
+    "streaming": ["hls"],
+    "analysis": ["peaks", "frames"],
+    "default": ["proxy", "video", "audio", "peaks", "frames", "hls"],
+}
+
+# The smallest increases reported as regressions, so noise in very short
+# measurements isn't: seconds, bytes of memory and bytes of output.
+minimums = {"time": 0.1, "memory": 8 * 1024 * 1024, "size": 1024}
+
+
+def get_source(name: str) -> Path:
+    """Get a synthetic source, generating it the first time it is used."""
+
+    duration, width, height, rate, channels = sources[name]
+    path = (
+        cache.cache_root
+        / "benchmarks"
+        / "{}x{}_{}fps_{}s_{}ch.mp4".format(width, height, rate, duration, channels)
+    )
+    return synthetic.generate(path, duration, width, height, rate, channels)
+
+
+def get_size(path: Path) -> int:
+    """Get the size of a file, or of every file in a directory."""
+
+    path = Path(path)
+    if path.is_file():
+        return path.stat().st_size
+    if path.is_dir():
+        return sum(p.stat().st_size for p in path.rglob("*") if p.is_file())
+    return 0
+
+
+def run_job(source: str, plugin_names: list, directory: str) -> dict:
+    """Run a job, and measure it. Runs in its own process (see run_case)."""
+
+    import plugins
+    from core import jobs
+
+    time_start = time.perf_counter()
+    job = jobs.StirlingJob(
+        source=source,
+        output_directory=Path(directory),
+        debug=False,
+        trace=True,
+    )
+    job.add_plugins(*[plugins.get_plugin(name) for name in plugin_names])
+    job.run()
+    job.close()
+    total = time.perf_counter() - time_start
+
+    # Phase and cmd() times from the job's trace, in seconds.
+    with open(job.job_file.with_name("trace.json")) as f:
+        events = [e for e in json.load(f)["traceEvents"] if e["ph"] == "X"]
+    phases, plugin_times = {}, {}
+    for event in events:
+        seconds = event["dur"] / 1000000
+        if event["cat"] == "job":
+            phases[event["name"]] = phases.get(event["name"], 0) + seconds
+        elif event["cat"] == "plugin":
+            plugin_times[event["name"]] = plugin_times.get(event["name"], 0) + seconds
+    phases["commands"] = sum(c["time"] for c in job.usage.get("commands", []))
+
+    outputs = {}
+    for cmd in job.commands:
+        if cmd.expected_output:
+            outputs.setdefault(cmd.plugin, {})[str(cmd.expected_output)] = get_size(
+                cmd.expected_output
+            )
+
+    commands = job.usage.get("commands", [])
+    # ru_maxrss is in kilobytes on Linux, and bytes on macOS.
+    scale = 1 if sys.platform == "darwin" else 1024
+    return {
+        "total": total,
+        "phases": phases,
+        "plugins": plugin_times,
+        "commands": commands,
+        "failed": [c["name"] for c in commands if c["status"] != "SUCCESS"],
+        "peak_memory": {
+            "engine": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale,
+            "commands": max([c.get("max_rss", 0) for c in commands] or [0]),
+        },
+        "outputs": {name: sum(sizes.values()) for name, sizes in outputs.items()},
+    }
+
+
+def run_case(source: Path, plugin_names: list, repeat: int) -> dict:
+    """Run a job `repeat` times, each in a fresh process, and keep the
+    fastest run."""
+
+    runs = []
+    context = multiprocessing.get_context("spawn")
+    for _ in range(repeat):
+        with tempfile.TemporaryDirectory(prefix="stirling-suite-") as directory:
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                runs.append(
+                    executor.submit(
+                        run_job, str(source), plugin_names, directory
+                    ).result()
+                )
+    return min(runs, key=lambda r: r["total"])
+
+
+def get_metrics(case: dict) -> dict:
+    """Flatten a case's results into {name: (kind, value)}, for comparing."""
+
+    metrics = {"total": ("time", case["total"])}
+    for name, seconds in case["phases"].items():
+        metrics["phase {}".format(name)] = ("time", seconds)
+    for name, seconds in case["plugins"].items():
+        metrics["cmd() {}".format(name)] = ("time", seconds)
+    for command in case["commands"]:
+        metrics["command {}".format(command["name"])] = ("time", command["time"])
+    for name, size in case["peak_memory"].items():
+        metrics["peak memory {}".format(name)] = ("memory", size)
+    for name, size in case["outputs"].items():
+        metrics["output {}".format(name)] = ("size", size)
+    return metrics
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list:
+    """Compare results to a baseline.
+
+    Returns:
+        list[str]: A description of each regression: a measurement more than
+            `threshold` (a fraction) and its minimum above the baseline, or a
+            command that failed which succeeded in the baseline.
+    """
+
+    baseline_cases = {(c["source"], c["combination"]): c for c in baseline["cases"]}
+    regressions = []
+    for case in results["cases"]:
+        key = (case["source"], case["combination"])
+        if key not in baseline_cases:
+            continue
+        label = "{} {}".format(*key)
+        before = get_metrics(baseline_cases[key])
+        for name, (kind, value) in get_metrics(case).items():
+            if name not in before:
+                continue
+            old = before[name][1]
+            if value > old * (1 + threshold) and value - old > minimums[kind]:
+                regressions.append(
+                    "{}: {} {} -> {} ({:+.0%})".format(
+                        label,
+                        name,
+                        format_value(kind, old),
+                        format_value(kind, value),
+                        value / old - 1 if old else 1,
+                    )
+                )
+        for name in set(case["failed"]) - set(baseline_cases[key]["failed"]):
+            regressions.append("{}: command {} failed".format(label, name))
+    return regressions
+
+
+def format_value(kind: str, value: float) -> str:
+    if kind == "time":
+        return "{:.2f}s".format(value)
+    return "{:.1f}MB".format(value / 1000000)
+
+
+def get_host() -> dict:
+    """Describe the host, so results from different hosts aren't mixed up."""
+
+    ffmpeg = subprocess.run(["ffmpeg", "-version"], capture_output=True, text=True)
+    return {
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "python": platform.python_version(),
+        "ffmpeg": ffmpeg.stdout.split("\n")[0],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Run jobs on synthetic media, and measure them."
+    )
+    parser.add_argument(
+        "--sources",
+        default=",".join(sources),
+        help="a comma separated list of sources, from: {}".format(", ".join(sources)),
+    )
+    parser.add_argument(
+        "--combinations",
+        default=",".join(combinations),
+        help="a comma separated list of plugin combinations, from: {}".format(
+            ", ".join(combinations)
+        ),
+    )
+    parser.add_argument(
+        "--repeat", type=int, default=1, help="keep the fastest of this many runs"
+    )
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--baseline", help="compare to this results file")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.2,
+        help="the increase over the baseline reported as a regression, as a "
+        "fraction",
+    )
+    options = parser.parse_args()
+
+    results = {
+        "created": datetime.now().isoformat(),
+        "host": get_host(),
+        "cases": [],
+    }
+    print(
+        "{:<14} {:<10} {:>9} {:>9} {:>9} {:>11} {:>11}".format(
+            "source", "plugins", "total", "parse", "commands", "memory MB", "output MB"
+        )
+    )
+    for source_name in options.sources.split(","):
+        source = get_source(source_name)
+        for combination in options.combinations.split(","):
+            case = {"source": source_name, "combination": combination}
+            case |= run_case(source, combinations[combination], options.repeat)
+            results["cases"].append(case)
+            print(
+                "{:<14} {:<10} {:>9.2f} {:>9.2f} {:>9.2f} {:>11.1f} {:>11.1f}".format(
+                    source_name,
+                    combination,
+                    case["total"],
+                    case["phases"].get("parse", 0),
+                    case["phases"]["commands"],
+                    max(case["peak_memory"].values()) / 1000000,
+                    sum(case["outputs"].values()) / 1000000,
+                )
+            )
+            for name in case["failed"]:
+                print("  command {} failed".format(name))
+
+    if options.output:
+        with open(options.output, "w") as f:
+            json.dump(results, f, indent=4)
+
+    if options.baseline:
+        with open(options.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get("host") != results["host"]:
+            print("The baseline is from a different host or ffmpeg build.")
+        regressions = compare(results, baseline, options.threshold)
+        if regressions:
+            print("Regressions against {}:".format(options.baseline))
+            print("\n".join("  " + r for r in regressions))
+            raise SystemExit(1)
+        print("No regressions against {}.".format(options.baseline))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+import subprocess
+from pathlib import Path
+
+# synthetic makes deterministic test media with ffmpeg's lavfi sources, so
+# benchmarks run on the same input on every machine without shipping any
+# media files. Video is the testsrc2 pattern (moving, with detail and
+# colour), and each audio channel is a sine wave at its own frequency.
+
+
+def video_source(width: int, height: int, rate: float, duration: float) -> str:
+    """Get a lavfi video source description."""
+
+    return "testsrc2=size={}x{}:rate={}:duration={}".format(
+        width, height, rate, duration
+    )
+
+
+def audio_source(channels: int, duration: float, sample_rate: int = 48000) -> str:
+    """Get a lavfi audio source description, with one tone per channel."""
+
+    tones = "|".join(
+        "sin({}*2*PI*t)".format(440 + 110 * channel) for channel in range(channels)
+    )
+    return "aevalsrc={}:s={}:d={}".format(tones, sample_rate, duration)
+
+
+def lavfi_inputs(
+    width: int, height: int, rate: float, duration: float, channels: int = 0
+) -> list:
+    """Get the ffmpeg arguments that read a synthetic source directly, so it
+    is generated as it is encoded."""
+
+    inputs = ["-f", "lavfi", "-i", video_source(width, height, rate, duration)]
+    if channels > 0:
+        inputs += ["-f", "lavfi", "-i", audio_source(channels, duration)]
+    return inputs
+
+
+def generate(
+    path: Path,
+    duration: float = 10,
+    width: int = 1280,
+    height: int = 720,
+    rate: float = 30,
+    channels: int = 2,
+) -> Path:
+    """Write a synthetic source file, as H.264 and AAC, unless it already
+    exists. The same arguments always give the same file, so it can be
+    reused between runs.
+
+    Raises:
+        RuntimeError: If ffmpeg fails.
+    """
+
+    path = Path(path)
+    if path.is_file():
+        return path
+    path.parent.mkdir(parents=True, exist_ok=True)
+
+    command = ["ffmpeg", "-hide_banner", "-loglevel", "error", "-y"]
+    command += lavfi_inputs(width, height, rate, duration, channels)
+    command += ["-c:v", "libx264", "-preset", "veryfast", "-crf", "18"]
+    command += ["-pix_fmt", "yuv420p", "-bitexact"]
+    if channels > 0:
+        command += ["-c:a", "aac", "-b:a", "{}k".format(64 * channels)]
+    # Write to a temporary name, so an interrupted run doesn't leave a
+    # partial file that looks finished.
+    partial = path.with_name(path.stem + ".partial" + path.suffix)
+    result = subprocess.run(command + [str(partial)], capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError("ffmpeg failed:\n{}".format(result.stderr.strip()))
+    partial.replace(path)
+    return path
@@ -0,0 +1,194 @@
+import argparse
+import json
+from pathlib import Path
+
+import numpy
+
+# annotations holds the columnar, time-indexed annotation format. An
+# annotation store is a folder of NumPy arrays, one per column, sorted by start
+# time:
+#
+#   start.npy         float64  start time of each annotation, in seconds
+#   end.npy           float64  end time of each annotation, in seconds
+#   end_max.npy       float64  the running maximum of end, used as the index
+#   label.npy         int32    index of each annotation's label
+#   score.npy         float32  confidence, or NaN
+#   bbox.npy          float32  (N, 4) [x, y, w, h] box, or NaN
+#   labels.bin                 every distinct label, UTF-8, back to back
+#   label_offsets.npy int64    where each label starts in labels.bin
+#
+# Arrays are memory-mapped when a store is opened, so a query only reads the
+# pages it needs rather than the whole store. Finding the annotations that
+# overlap a time window is two binary searches: start is sorted, and end_max
+# (the largest end time so far) is sorted too, which bounds where the first
+# annotation still running at the start of the window can be.
+
+columns_suffix = ".columns"
+
+
+def write(
+    directory: Path,
+    start,
+    end,
+    labels: list,
+    scores=None,
+    bboxes=None,
+):
+    """Write a set of annotations to a columnar store.
+
+    Args:
+        directory (pathlib.Path): The folder to create the store in.
+        start (array-like): The start time of each annotation, in seconds.
+        end (array-like): The end time of each annotation, in seconds.
+        labels (list[str]): The label (or text) of each annotation.
+        scores (array-like): The confidence of each annotation. Optional.
+        bboxes (array-like): The [x, y, w, h] box of each annotation.
+            Optional.
+    """
+
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+
+    start = numpy.asarray(start, dtype=numpy.float64)
+    end = numpy.asarray(end, dtype=numpy.float64)
+    count = len(start)
+
+    scores = (
+        numpy.full(count, numpy.nan, dtype=numpy.float32)
+        if scores is None
+        else numpy.asarray(scores, dtype=numpy.float32)
+    )
+    bboxes = (
+        numpy.full((count, 4), numpy.nan, dtype=numpy.float32)
+        if bboxes is None
+        else numpy.asarray(bboxes, dtype=numpy.float32).reshape(count, 4)
+    )
+
+    vocabulary, label_index = numpy.unique(
+        numpy.asarray(labels, dtype=object).astype(str), return_inverse=True
+    )
+    encoded = [label.encode() for label in vocabulary]
+    offsets = numpy.zeros(len(encoded) + 1, dtype=numpy.int64)
+    offsets[1:] = numpy.cumsum([len(e) for e in encoded])
+
+    order = numpy.argsort(start, kind="stable")
+    end = end[order]
+
+    numpy.save(directory / "start.npy", start[order])
+    numpy.save(directory / "end.npy", end)
+    numpy.save(
+        directory / "end_max.npy",
+        numpy.maximum.accumulate(end) if count > 0 else end,
+    )
+    numpy.save(directory / "label.npy", label_index[order].astype(numpy.int32))
+    numpy.save(directory / "score.npy", scores[order])
+    numpy.save(directory / "bbox.npy", bboxes[order])
+    numpy.save(directory / "label_offsets.npy", offsets)
+    with open(directory / "labels.bin", "wb") as labels_file:
+        labels_file.write(b"".join(encoded))
+
+
+def get_columns_path(annotation_file: Path) -> Path:
+    """Get the path of the columnar store that sits next to a JSON annotation
+    file, e.g. annotations/transcript.columns for transcript.json."""
+
+    return Path(annotation_file).with_suffix(columns_suffix)
+
+
+def write_records(directory: Path, records: list):
+    """Write a list of dicts, each with `start`, `end` and `label` and
+    optionally `score` and `bbox`, to a columnar store."""
+
+    write(
+        directory,
+        [r["start"] for r in records],
+        [r["end"] for r in records],
+        [r["label"] for r in records],
+        [r.get("score", numpy.nan) for r in records],
+        [r.get("bbox") or [numpy.nan] * 4 for r in records],
+    )
+
+
+class StirlingAnnotationStore(object):
+    """A read-only, memory-mapped view of a columnar annotation store."""
+
+    def __init__(self, directory: Path):
+        self.directory = Path(directory)
+        self.start = self.__load("start")
+        self.end = self.__load("end")
+        self.end_max = self.__load("end_max")
+        self.label = self.__load("label")
+        self.score = self.__load("score")
+        self.bbox = self.__load("bbox")
+        self.label_offsets = self.__load("label_offsets")
+        # An empty file can't be memory-mapped.
+        labels = self.directory / "labels.bin"
+        self.labels = (
+            numpy.memmap(labels, mode="r")
+            if labels.stat().st_size > 0
+            else numpy.empty(0, dtype=numpy.uint8)
+        )
+
+    def __len__(self) -> int:
+        return len(self.start)
+
+    def __load(self, column: str) -> numpy.ndarray:
+        return numpy.load(self.directory / (column + ".npy"), mmap_mode="r")
+
+    def get_label(self, index: int) -> str:
+        begin, end = self.label_offsets[index], self.label_offsets[index + 1]
+        return bytes(self.labels[begin:end]).decode()
+
+    def query_indices(self, start: float, end: float) -> numpy.ndarray:
+        """Get the positions of the annotations that overlap the window from
+        `start` to `end` (in seconds)."""
+
+        # Annotations after `hi` start after the window ends. Before `lo`,
+        # every annotation has already ended before the window starts.
+        hi = numpy.searchsorted(self.start, end, side="right")
+        lo = numpy.searchsorted(self.end_max, start, side="left")
+        if lo >= hi:
+            return numpy.empty(0, dtype=numpy.int64)
+        return lo + numpy.flatnonzero(self.end[lo:hi] >= start)
+
+    def query(self, start: float, end: float) -> list:
+        """Get the annotations that overlap the window from `start` to `end`
+        (in seconds), as dicts."""
+
+        annotations = []
+        for i in self.query_indices(start, end):
+            annotation = {
+                "start": float(self.start[i]),
+                "end": float(self.end[i]),
+                "label": self.get_label(int(self.label[i])),
+            }
+            if not numpy.isnan(self.score[i]):
+                annotation["score"] = float(self.score[i])
+            if not numpy.isnan(self.bbox[i]).any():
+                annotation["bbox"] = [float(v) for v in self.bbox[i]]
+            annotations.append(annotation)
+        return annotations
+
+
+def parse_time(value: str) -> float:
+    """Parse a time as seconds, or as [hh:]mm:ss[.fff]."""
+
+    seconds = 0.0
+    for part in value.split(":"):
+        seconds = seconds * 60 + float(part)
+    return seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Query an annotation store.")
+    parser.add_argument("directory")
+    parser.add_argument("--start", type=parse_time, required=True)
+    parser.add_argument("--end", type=parse_time, required=True)
+    options = parser.parse_args()
+
+    store = StirlingAnnotationStore(options.directory)
+    print(json.dumps(store.query(options.start, options.end), indent=4))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,23 @@
 from dataclasses import dataclass, field
+from pathlib import Path
 from typing import List
 
 from core import args, definitions, helpers, jobs
 
 required_binaries = ["ffmpeg"]
 
+# Subtitle codecs that are stored as images rather than text. These can't be
+# converted to WebVTT, so they are skipped when extracting all streams.
+bitmap_subtitle_codecs = [
+    "dvb_subtitle",
+    "dvd_subtitle",
+    "hdmv_pgs_subtitle",
+    "xsub",
+]
+
 
 @dataclass
-class StirlingPluginAudio(definitions.StirlingClass):
+class StirlingPluginAudio(definitions.StirlingPlugin):
     """StirlingPluginAudio are for using a source audio-only file or for
     extracting audio from a video file. This file is intended as a long-term
     archival version."""
@@ -26,6 +36,11 @@ class StirlingPluginAudio(definitions.StirlingClass):
     # The format to output the audio to, as a tuple. The first value is the
     # encoder format, the file extension is the second value.
     audio_output_format: tuple = ("wav", "wav")
+    # Extract every audio stream and every text subtitle stream in the source,
+    # instead of only the preferred audio stream. All of the streams are
+    # written by a single ffmpeg command, so the source is only demuxed once.
+    # Subtitles are converted to WebVTT.
+    audio_all_streams: bool = False
 
     # Contains outputs from the plugin for use in other plugins.
     assets: List[definitions.StirlingPluginAssets] = field(default_factory=list)
@@ -42,41 +57,139 @@ class StirlingPluginAudio(definitions.StirlingClass):
     def cmd(self, job: jobs.StirlingJob):
         if not self.audio_disable:
             if self.audio_source_stream != -1:
-                # If a specific video stream was requested, use that.
-                job.media_info.preferred["audio"] = self.video_source_stream
+                # If a specific audio stream was requested, use that.
+                job.media_info.preferred["audio"] = self.audio_source_stream
 
             # Set the options to extract audio from the source file.
             options = {
                 "hide_banner": True,
                 "y": True,
                 "i": job.media_info.source,
-                "f": self.audio_output_format[0],
-                "map": "0:a:{}".format(
-                    job.media_info.preferred["audio"]
-                    - len(job.media_info.video_streams)
-                ),
             }
 
             output_directory = job.output_directory / self.name
             output_directory.mkdir(parents=True, exist_ok=True)
-            output_file = output_directory / (
-                "source.{}".format(self.audio_output_format[1])
-            )
 
-            self.assets.append(
-                definitions.StirlingPluginAssets(
-                    name="normalized_audio", path=output_file
-                )
-            )
+            if self.audio_all_streams:
+                outputs = self.__all_streams_outputs(job, output_directory)
+            else:
+                outputs = self.__preferred_stream_outputs(job, output_directory)
+
+            if len(outputs) == 0:
+                job.log("No audio or subtitle streams found to extract.")
+                return
 
             job.commands.append(
                 definitions.StirlingCmd(
                     name=self.name,
                     command="ffmpeg {} {}".format(
-                        args.ffmpeg_unparser.unparse(**options), output_file
+                        args.ffmpeg_unparser.unparse(**options),
+                        " ".join(
+                            args.ffmpeg_unparser.unparse(str(output_file), **output)
+                            for output_file, output in outputs
+                        ),
                     ),
                     priority=self.priority,
-                    expected_output=str(output_file),
+                    expected_output=str(outputs[0][0]),
                     depends_on=self.depends_on,
                 )
             )
+
+    def __preferred_stream_outputs(
+        self, job: jobs.StirlingJob, output_directory: Path
+    ) -> list:
+        output_file = output_directory / (
+            "source.{}".format(self.audio_output_format[1])
+        )
+
+        self.assets.append(
+            definitions.StirlingPluginAssets(name="normalized_audio", path=output_file)
+        )
+
+        return [
+            (
+                output_file,
+                {
+                    "f": self.audio_output_format[0],
+                    "map": "0:a:{}".format(
+                        job.media_info.preferred["audio"]
+                        - len(job.media_info.video_streams)
+                    ),
+                },
+            )
+        ]
+
+    def __all_streams_outputs(
+        self, job: jobs.StirlingJob, output_directory: Path
+    ) -> list:
+        # Each output is mapped by its absolute stream index, so that every
+        # output file shares the same demuxed input.
+        outputs = []
+
+        for stream in job.media_info.audio_streams:
+            output_file = output_directory / (
+                "source_{}_{}.{}".format(
+                    stream.stream, stream.language, self.audio_output_format[1]
+                )
+            )
+            outputs.append(
+                (
+                    output_file,
+                    {
+                        "f": self.audio_output_format[0],
+                        "map": "0:{}".format(stream.stream),
+                    },
+                )
+            )
+
+            # The preferred stream is still published as the normalized audio,
+            # so that the plugins depending on it work the same in both modes.
+            if stream.stream == job.media_info.preferred["audio"]:
+                self.assets.append(
+                    definitions.StirlingPluginAssets(
+                        name="normalized_audio",
+                        path=output_file,
+                        language=stream.language,
+                    )
+                )
+
+            self.assets.append(
+                definitions.StirlingPluginAssets(
+                    name="audio_{}".format(stream.stream),
+                    path=output_file,
+                    language=stream.language,
+                )
+            )
+
+        for stream in job.media_info.text_streams:
+            if stream.codec in bitmap_subtitle_codecs:
+                job.log(
+                    "Skipping subtitle stream {}, {} can't be converted to WebVTT.".format(
+                        stream.stream, stream.codec
+                    )
+                )
+                continue
+
+            output_file = output_directory / (
+                "subtitle_{}_{}.vtt".format(stream.stream, stream.language)
+            )
+            outputs.append(
+                (
+                    output_file,
+                    {
+                        "f": "webvtt",
+                        "map": "0:{}".format(stream.stream),
+                        "c:s": "webvtt",
+                    },
+                )
+            )
+
+            self.assets.append(
+                definitions.StirlingPluginAssets(
+                    name="subtitle_{}".format(stream.stream),
+                    path=output_file,
+                    language=stream.language,
+                )
+            )
+
+        return outputs
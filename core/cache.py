@@ -0,0 +1,113 @@
+import hashlib
+import json
+import os
+import tempfile
+from dataclasses import dataclass
+from pathlib import Path
+
+from core import definitions
+
+# The root folder for caches shared between jobs. Follows the XDG base
+# directory spec, so it can be moved with XDG_CACHE_HOME.
+cache_root = Path(os.environ.get("XDG_CACHE_HOME", Path.home() / ".cache")) / (
+    "stirling"
+)
+
+
+@dataclass
+class StirlingCache(definitions.StirlingClass):
+    """A local store of JSON documents, keyed by a content hash.
+
+    Each entry is written to its own file, so the cache can be shared by
+    concurrent jobs and worker processes. Reading an entry updates its
+    modification time, and when the cache grows over `size_max` the least
+    recently used entries are removed until it is back under its limit.
+
+    Attributes:
+        directory (pathlib.Path): The folder to store the entries in.
+        size_max (int): The maximum size of the cache, in bytes.
+    """
+
+    directory: Path
+    size_max: int = 1024 * 1024 * 1024
+    _size: int = -1
+
+    def __post_init__(self):
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    @staticmethod
+    def key(*parts) -> str:
+        """Create a key from any mix of bytes and JSON-serializable values."""
+
+        digest = hashlib.sha256()
+        for part in parts:
+            if not isinstance(part, (bytes, bytearray, memoryview)):
+                part = json.dumps(part, sort_keys=True).encode()
+            digest.update(part)
+        return digest.hexdigest()
+
+    def get(self, key: str):
+        """Get an entry from the cache, or None if it isn't cached."""
+
+        path = self.__path(key)
+        try:
+            with open(path) as entry:
+                value = json.load(entry)
+            os.utime(path)
+        except (OSError, ValueError):
+            return None
+        return value
+
+    def put(self, key: str, value):
+        """Add an entry to the cache, evicting old entries if necessary."""
+
+        path = self.__path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+
+        # Write to a temporary file first, so a reader never sees a partial
+        # entry.
+        handle, temp = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+        with os.fdopen(handle, "w") as entry:
+            json.dump(value, entry)
+        os.replace(temp, path)
+
+        if self._size == -1:
+            self._size = sum(p.stat().st_size for p in self.__entries())
+        else:
+            self._size += path.stat().st_size
+
+        if self._size > self.size_max:
+            self.evict()
+
+    def evict(self):
+        """Remove the least recently used entries until the cache is below 90%
+        of its maximum size."""
+
+        entries = []
+        for path in self.__entries():
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                # Another process evicted it first.
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        entries.sort()
+
+        size = sum(entry[1] for entry in entries)
+        for _, entry_size, path in entries:
+            if size <= self.size_max * 0.9:
+                break
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+            size -= entry_size
+
+        self._size = size
+
+    def __path(self, key: str) -> Path:
+        # Shard the entries into subfolders, so no one folder grows too large.
+        return self.directory / key[:2] / (key + ".json")
+
+    def __entries(self):
+        return self.directory.glob("*/*.json")
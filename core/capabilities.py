@@ -0,0 +1,153 @@
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+from functools import lru_cache
+
+from core import cache
+
+# capabilities records which external binaries are installed, and which
+# encoders, filters and formats the local ffmpeg was built with. Each binary
+# is only looked up once per process. Probing ffmpeg's features takes a few
+# external calls, so the result is also stored in the cache folder, keyed by
+# the binary's path and modification time, and reused until ffmpeg is
+# replaced or upgraded.
+
+capabilities_file = cache.cache_root / "capabilities.json"
+
+# The encoders to use for each format, fastest first. Plugins ask for a
+# format, and get the first encoder on the list that ffmpeg supports.
+encoder_preferences = {
+    "av1": ["libsvtav1", "libaom-av1", "librav1e"],
+    "h264": ["libx264", "libopenh264"],
+    "hevc": ["libx265"],
+    "vp9": ["libvpx-vp9"],
+    "aac": ["libfdk_aac", "aac"],
+    "opus": ["libopus", "opus"],
+    "webvtt": ["webvtt"],
+}
+
+
+@lru_cache(maxsize=None)
+def which(binary: str) -> str:
+    """Get the full path to a binary, or None if it isn't installed."""
+
+    return shutil.which(binary)
+
+
+def parse_encoders(output: str) -> dict:
+    """Parse `ffmpeg -encoders` into a dict of encoder name to type (V, A or
+    S)."""
+
+    encoders = {}
+    listing = False
+    for line in output.splitlines():
+        if line.strip().startswith("---"):
+            listing = True
+        elif listing and len(line.split()) >= 2:
+            flags, name = line.split()[:2]
+            encoders[name] = flags[0]
+    return encoders
+
+
+def parse_filters(output: str) -> list:
+    """Parse `ffmpeg -filters` into a list of filter names."""
+
+    filters = []
+    for line in output.splitlines():
+        # Each filter is listed as: flags, name, inputs->outputs, description.
+        parts = line.split()
+        if len(parts) >= 3 and "->" in parts[2]:
+            filters.append(parts[1])
+    return filters
+
+
+def parse_formats(output: str) -> dict:
+    """Parse `ffmpeg -formats` into lists of the formats ffmpeg can demux
+    (read) and mux (write)."""
+
+    formats = {"demuxers": [], "muxers": []}
+    listing = False
+    for line in output.splitlines():
+        if line.strip().startswith("---"):
+            listing = True
+        elif listing and len(line) > 4 and line[4:].strip():
+            flags, names = line[1:3], line[4:].split()[0].split(",")
+            if flags[0] == "D":
+                formats["demuxers"].extend(names)
+            if flags[1] == "E":
+                formats["muxers"].extend(names)
+    return formats
+
+
+def probe_ffmpeg(path: str) -> dict:
+    """Get the encoders, filters and formats supported by an ffmpeg binary."""
+
+    def run(option: str) -> str:
+        return subprocess.run(
+            [path, "-hide_banner", option], capture_output=True, text=True
+        ).stdout
+
+    return {
+        "encoders": parse_encoders(run("-encoders")),
+        "filters": parse_filters(run("-filters")),
+        "formats": parse_formats(run("-formats")),
+    }
+
+
+@lru_cache(maxsize=None)
+def get_ffmpeg_capabilities(binary: str = "ffmpeg") -> dict:
+    """Get the features of an ffmpeg binary, from the cache file if it holds
+    them for this exact binary, or by probing it.
+
+    Raises:
+        FileNotFoundError: If the binary isn't installed.
+    """
+
+    path = which(binary)
+    if path is None:
+        raise FileNotFoundError("missing binary dependency: {}".format(binary))
+    path = os.path.realpath(path)
+    key = "{}:{}".format(path, os.stat(path).st_mtime_ns)
+
+    try:
+        with open(capabilities_file) as f:
+            stored = json.load(f)
+    except (OSError, ValueError):
+        stored = {}
+
+    if key not in stored:
+        # Drop entries for older builds of the same binary.
+        stored = {k: v for k, v in stored.items() if not k.startswith(path + ":")}
+        stored[key] = probe_ffmpeg(path)
+
+        capabilities_file.parent.mkdir(parents=True, exist_ok=True)
+        handle, temp = tempfile.mkstemp(dir=capabilities_file.parent, suffix=".tmp")
+        with os.fdopen(handle, "w") as f:
+            json.dump(stored, f)
+        os.replace(temp, capabilities_file)
+
+    return stored[key]
+
+
+def has_encoder(encoder: str, binary: str = "ffmpeg") -> bool:
+    return encoder in get_ffmpeg_capabilities(binary)["encoders"]
+
+
+def has_filter(name: str, binary: str = "ffmpeg") -> bool:
+    return name in get_ffmpeg_capabilities(binary)["filters"]
+
+
+def has_muxer(name: str, binary: str = "ffmpeg") -> bool:
+    return name in get_ffmpeg_capabilities(binary)["formats"]["muxers"]
+
+
+def best_encoder(format: str, binary: str = "ffmpeg") -> str:
+    """Get the fastest encoder ffmpeg supports for a format (e.g. "av1"), or
+    None if it doesn't support any."""
+
+    for encoder in encoder_preferences.get(format, [format]):
+        if has_encoder(encoder, binary):
+            return encoder
+    return None
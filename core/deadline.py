@@ -0,0 +1,201 @@
+import json
+import os
+import tempfile
+from datetime import datetime
+
+from core import cache, capabilities
+
+# deadline picks encoder presets so a job with a deadline finishes in time.
+# Each host's encoding speed is measured once by a calibration benchmark
+# (benchmarks/calibrate.py), as pixels per second for each encoder and
+# preset, and stored in the cache folder. When a job is planned, the work in
+# each encode (frames times pixels, summed over the renditions) is divided
+# by those speeds to predict how long it takes, and each encode gets the
+# slowest (best quality) preset that fits its share of the time left.
+#
+# The predicted times are recorded in the job's plugin metadata, next to the
+# actual times once the commands have run.
+
+throughput_file = cache.cache_root / "throughput.json"
+
+# Each encoder's presets, from slowest to fastest.
+presets = {
+    "libx264": [
+        "veryslow",
+        "slower",
+        "slow",
+        "medium",
+        "fast",
+        "faster",
+        "veryfast",
+        "superfast",
+        "ultrafast",
+    ],
+    "libsvtav1": ["2", "4", "6", "8", "10", "12"],
+    "libaom-av1": ["4", "5", "6", "7", "8"],
+}
+
+# Predictions are made against this share of the time left, to leave room
+# for decoding, muxing and the other plugins.
+safety = 0.8
+
+
+def load_throughput() -> dict:
+    """Get this host's throughput table, as {encoder: {preset: pixels per
+    second}}. Empty if the host hasn't been calibrated."""
+
+    try:
+        with open(throughput_file) as f:
+            return json.load(f)["encoders"]
+    except (OSError, ValueError, KeyError):
+        return {}
+
+
+def save_throughput(table: dict):
+    """Store a throughput table from a calibration run."""
+
+    throughput_file.parent.mkdir(parents=True, exist_ok=True)
+    handle, temp = tempfile.mkstemp(dir=throughput_file.parent, suffix=".tmp")
+    with os.fdopen(handle, "w") as f:
+        json.dump(
+            {
+                "measured": datetime.now().isoformat(),
+                "cpus": os.cpu_count(),
+                "encoders": table,
+            },
+            f,
+            indent=4,
+        )
+    os.replace(temp, throughput_file)
+
+
+def predict(table: dict, encoder: str, preset: str, pixels: float) -> float:
+    """Predict how long an encode takes, in seconds, or None if the encoder
+    and preset haven't been measured."""
+
+    speed = table.get(encoder, {}).get(str(preset))
+    if not speed:
+        return None
+    return pixels / speed
+
+
+def choose_preset(table: dict, encoder: str, pixels: float, budget: float) -> tuple:
+    """Choose the slowest measured preset that encodes `pixels` within the
+    budget (in seconds), or the fastest measured one if none do.
+
+    Returns:
+        tuple: (preset, predicted seconds), or (None, None) if the encoder
+            hasn't been measured.
+    """
+
+    measured = [p for p in presets.get(encoder, []) if str(p) in table.get(encoder, {})]
+    if len(measured) == 0:
+        return None, None
+    for preset in measured:
+        predicted = predict(table, encoder, preset, pixels)
+        if predicted <= budget:
+            return preset, predicted
+    return measured[-1], predict(table, encoder, measured[-1], pixels)
+
+
+def get_work(job) -> dict:
+    """Get the encodes in a job, as {plugin name: (plugin, encoder, pixels)}.
+
+    Pixels are the source's frames times the pixels of each output, summed
+    over an HLS package's renditions.
+    """
+
+    from plugins import hls
+
+    stream = job.media_info.get_preferred_stream("video")
+    frames = float(stream.duration) * float(stream.frame_rate)
+
+    work = {}
+    for plugin in job.plugins:
+        match plugin.name:
+            case "video" if not plugin.video_disable:
+                if plugin.video_codec_format == "av1":
+                    encoder = {"svt": "libsvtav1", "aom": "libaom-av1"}.get(
+                        plugin.video_av1_encoder
+                    ) or capabilities.best_encoder("av1")
+                else:
+                    encoder = capabilities.best_encoder(plugin.video_codec_format)
+                pixels = frames * int(stream.width) * int(stream.height)
+                work[plugin.name] = (plugin, encoder, pixels)
+            case "hls" if not plugin.hls_disable:
+                ladder, _ = hls.resolve_ladder(plugin.hls_encoder_profiles, stream)
+                pixels = frames * sum(r["width"] * r["height"] for r in ladder)
+                encoder = capabilities.best_encoder(plugin.hls_video_codec)
+                work[plugin.name] = (plugin, encoder, pixels)
+            case "proxy" if not plugin.proxy_disable:
+                pixels = frames * int(stream.width) * int(stream.height)
+                work[plugin.name] = (plugin, "libx264", pixels)
+    return work
+
+
+def plan(job):
+    """Set the presets and threads of a job's encodes so it finishes before
+    its deadline, and record the predictions in its plugin metadata."""
+
+    table = load_throughput()
+    budget = job.deadline - (datetime.now() - job.time_start).total_seconds()
+    record = {"deadline": job.deadline, "budget": round(budget, 1)}
+    job.plugin_metadata["deadline"] = record
+
+    if len(table) == 0:
+        job.log(
+            "No throughput table for this host, so presets can't be fitted to "
+            "the deadline. Run benchmarks/calibrate.py to create one."
+        )
+        return
+
+    work = get_work(job)
+    budget *= safety
+
+    # The proxy's preset is fixed, so its time comes off the top.
+    predicted = {}
+    if "proxy" in work:
+        plugin, encoder, pixels = work.pop("proxy")
+        predicted["proxy"] = predict(table, encoder, plugin.proxy_preset, pixels) or 0
+        budget -= predicted["proxy"]
+
+    # Share the rest between the encodes by how long each takes at its
+    # fastest preset.
+    fastest = {
+        name: choose_preset(table, encoder, pixels, 0)[1] or 0
+        for name, (plugin, encoder, pixels) in work.items()
+    }
+    total = sum(fastest.values()) or 1
+
+    chosen = {}
+    for name, (plugin, encoder, pixels) in work.items():
+        share = max(budget, 0) * fastest[name] / total
+        preset, predicted[name] = choose_preset(table, encoder, pixels, share)
+        if preset is None:
+            job.log("No throughput measured for {}, for {}.".format(encoder, name))
+            continue
+        chosen[name] = {"encoder": encoder, "preset": preset}
+
+        # Encodes run one at a time, so each can use every core. (There is no
+        # chunked encoding, so the encoder's threads are the parallelism.)
+        match name:
+            case "video":
+                if encoder == "libx264":
+                    plugin.video_preset = preset
+                else:
+                    plugin.video_av1_preset = int(preset)
+                plugin.video_threads = os.cpu_count()
+            case "hls":
+                plugin.hls_preset = preset
+                plugin.hls_threads = os.cpu_count()
+
+    record["presets"] = chosen
+    record["predicted"] = {k: round(v, 1) for k, v in predicted.items() if v}
+    record["predicted_total"] = round(sum(v for v in predicted.values() if v), 1)
+    job.log(
+        "Presets for the {}s deadline: {} (predicted {}s)".format(
+            job.deadline,
+            ", ".join("{} {}".format(k, v["preset"]) for k, v in chosen.items()),
+            record["predicted_total"],
+        )
+    )
@@ -83,6 +83,9 @@ class StirlingPluginAssets(StirlingClass):
 
     name: str = ""
     path: Path = None
+    # The language tag of the asset, for assets extracted from a specific
+    # audio or subtitle stream. This is optional.
+    language: str = None
 
 
 # StirlingPlugin is the base class for all plugins. Any plugin class definition should use this as its parent class.
@@ -94,6 +97,12 @@ class StirlingPlugin(StirlingClass):
     priority: int = 0
     assets: List[StirlingPluginAssets] = field(default_factory=list)
 
+    def done(self, job, cmd):
+        """Called by the job after one of the plugin's commands succeeds, to
+        log or record its results. Does nothing by default."""
+
+        pass
+
 
 # StirlingCmdStatus is the status of a current command.
 class StirlingCmdStatus(str, Enum):
@@ -104,6 +113,25 @@ class StirlingCmdStatus(str, Enum):
     SUCCESS = "SUCCESS"
 
 
+# StirlingCmdUsage is the resources a command used while it ran. Times are
+# in seconds, and sizes in bytes. CPU time and memory include every process
+# the command started.
+@dataclass
+class StirlingCmdUsage(StirlingClass):
+    # The wall clock time the command took.
+    time: float = 0.0
+    # The CPU time spent in the command's own code.
+    cpu_user: float = 0.0
+    # The CPU time spent in the kernel on the command's behalf.
+    cpu_system: float = 0.0
+    # The peak resident memory of the largest process.
+    max_rss: int = 0
+    # The bytes read from and written to storage (from /proc/<pid>/io, so
+    # only on Linux). Reads served from the page cache aren't counted.
+    read_bytes: int = 0
+    write_bytes: int = 0
+
+
 # StirlingCmd objects are structures that hold the final command to run for
 # a specific step in a job. A StirlingCmd must include the command to run
 # in cli style, and the raw output from the command.
@@ -117,8 +145,9 @@ class StirlingCmd(StirlingClass):
     # The command to run, this is required
     command: str
     # The priority of the command, this is optional. After commands are sorted
-    # based on their dependencies, they will be sorted by priority. The default
-    # is 0, which is the highest priority.
+    # based on their dependencies, they will be sorted by priority, lowest
+    # first. The default is 0; a negative priority (like the editor proxy's)
+    # runs ahead of the other plugins.
     priority: int = 0
     # The directory (filename or full path) or glob pattern that we expect to
     # be created when this command is run. This is optional.
@@ -126,10 +155,22 @@ class StirlingCmd(StirlingClass):
     # A list of plugins that this plugin depends on before
     # it can run. This is optional, and the default is an empty list.
     depends_on: list = field(default_factory=list)
+    # The names of other commands that finish writing the expected output,
+    # e.g. by adding to it. The output isn't ready until they have succeeded
+    # too. This is optional.
+    ready_after: list = field(default_factory=list)
     # The status of the command, this is optional. The default is QUEUED.
     status: StirlingCmdStatus = StirlingCmdStatus.QUEUED
     # The log output from the command.
     log: str = None
+    # The name of the plugin that created the command. Set when the job's
+    # commands are parsed.
+    plugin: str = None
+    # The resources the command used, once it has run.
+    usage: StirlingCmdUsage = None
+    # When the command was planned, as a Unix timestamp, to measure how long
+    # it waited to run.
+    time_queued: float = 0
 
 
 
@@ -169,6 +210,7 @@ class StreamAudio(Stream):
     sample_rate: int
     channels: int
     channel_layout: str
+    language: str = "und"  # undetermined
 
     content_type: str = "audio"
 
@@ -0,0 +1,651 @@
+import argparse
+import collections
+import json
+import queue
+import threading
+import time
+from concurrent import futures
+from pathlib import Path
+
+import cv2
+import numpy
+import torch
+from facenet_pytorch import MTCNN, InceptionResnetV1
+
+from core import annotations, pytorch
+from core.embeddings import StirlingEmbeddingIndex
+
+# detection holds the batched face detection pipeline used by the objects
+# plugin. Frames are decoded ahead of time on background threads and stacked
+# into batches, the detector runs on whole batches on the best available
+# device, and face crops are written on their own I/O thread, so decoding,
+# inference and writing all overlap. The pipeline is run as its own command by
+# the objects plugin:
+#
+#   python -m core.detection --output faces.json --interval 1 frames/
+
+
+def list_frames(directory: Path) -> list:
+    """List the frame images in a directory, in frame order. The frames
+    plugin names each file after its presentation timestamp."""
+
+    frames = [
+        f
+        for f in Path(directory).iterdir()
+        if f.suffix in (".jpg", ".png") and f.stem.isdigit()
+    ]
+    return sorted(frames, key=lambda f: int(f.stem))
+
+
+def load_detector(device: torch.device = None) -> MTCNN:
+    if device is None:
+        device = pytorch.pytorch_get_device()
+    return MTCNN(keep_all=True, device=device)
+
+
+def load_embedder(device: torch.device = None) -> InceptionResnetV1:
+    if device is None:
+        device = pytorch.pytorch_get_device()
+    return InceptionResnetV1(pretrained="vggface2", device=device).eval()
+
+
+def embed_faces(embedder: InceptionResnetV1, crops: list) -> numpy.ndarray:
+    """Get a 512-dimensional embedding for each RGB face crop."""
+
+    batch = torch.stack(
+        [
+            torch.from_numpy(cv2.resize(crop, (160, 160))).permute(2, 0, 1)
+            for crop in crops
+        ]
+    ).float()
+    batch = (batch - 127.5) / 128.0
+    with torch.no_grad():
+        return embedder(batch.to(embedder.device)).cpu().numpy()
+
+
+def read_frame(path: Path) -> numpy.ndarray:
+    image = cv2.imread(str(path))
+    if image is None:
+        raise ValueError("unable to decode frame {}".format(path))
+    # OpenCV decodes to BGR, the detector expects RGB.
+    return cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+
+
+def prefetch_batches(
+    frames: list, batch_size: int, prefetch: int, decode_threads: int
+) -> queue.Queue:
+    """Decode frames into batches on background threads.
+
+    Returns a queue that yields (paths, batch) tuples, where batch is a
+    uint8 tensor of shape (N, H, W, 3), followed by None once every frame has
+    been decoded. If decoding fails, the exception is put on the queue before
+    the None. At most `prefetch` batches are held in memory at once.
+    """
+
+    batches = queue.Queue(maxsize=prefetch)
+
+    def produce():
+        try:
+            with futures.ThreadPoolExecutor(max_workers=decode_threads) as pool:
+                for i in range(0, len(frames), batch_size):
+                    paths = frames[i : i + batch_size]
+                    images = list(pool.map(read_frame, paths))
+
+                    # Frames from one video share a size, but split the batch
+                    # if they don't, as the detector needs a rectangular
+                    # tensor.
+                    shape = images[0].shape
+                    if all(image.shape == shape for image in images):
+                        batches.put((paths, torch.from_numpy(numpy.stack(images))))
+                    else:
+                        for path, image in zip(paths, images):
+                            batches.put(([path], torch.from_numpy(image[None])))
+        except Exception as e:
+            batches.put(e)
+        finally:
+            batches.put(None)
+
+    threading.Thread(target=produce, daemon=True).start()
+    return batches
+
+
+def start_writer(crops: queue.Queue) -> threading.Thread:
+    """Write face crops from a queue of (path, image) tuples, until a None is
+    received."""
+
+    def write():
+        while True:
+            item = crops.get()
+            if item is None:
+                return
+            path, image = item
+            cv2.imwrite(str(path), cv2.cvtColor(image, cv2.COLOR_RGB2BGR))
+
+    writer = threading.Thread(target=write, daemon=True)
+    writer.start()
+    return writer
+
+
+def detect(
+    frames_directory: Path,
+    interval: float = 1.0,
+    crops_directory: Path = None,
+    batch_size: int = 32,
+    prefetch: int = 4,
+    decode_threads: int = 4,
+    min_confidence: float = 0.9,
+    detector=None,
+    frames: list = None,
+    embedder=None,
+) -> list:
+    """Detect faces in every frame in a directory.
+
+    Args:
+        frames_directory (pathlib.Path): The frames to scan, as written by
+            the frames plugin.
+        interval (float): The number of frames per second the frames were
+            captured at, used to convert frame numbers to timestamps.
+        crops_directory (pathlib.Path): Where to write an image of each face.
+            If None, no crops are written.
+        batch_size (int): The number of frames to run the detector on at
+            once.
+        prefetch (int): The number of batches to decode ahead of the
+            detector.
+        decode_threads (int): The number of threads decoding frames.
+        min_confidence (float): Faces below this confidence are discarded.
+        detector: A detector with the MTCNN `detect()` interface. Defaults
+            to a new MTCNN on the best available device.
+        frames (list): Only scan these frames, rather than every frame in
+            the directory.
+        embedder: A face embedding model (see load_embedder). When given,
+            each face gets an `embedding` for matching against other faces.
+
+    Returns:
+        list[dict]: One entry per frame, with the faces found in it.
+    """
+
+    if detector is None:
+        detector = load_detector()
+
+    if frames is None:
+        frames = list_frames(frames_directory)
+    batches = prefetch_batches(frames, batch_size, prefetch, decode_threads)
+
+    crops = queue.Queue(maxsize=batch_size * prefetch)
+    writer = None
+    if crops_directory is not None:
+        Path(crops_directory).mkdir(parents=True, exist_ok=True)
+        writer = start_writer(crops)
+
+    scan = []
+    frame_count = 0
+    time_start = time.perf_counter()
+
+    while (item := batches.get()) is not None:
+        if isinstance(item, Exception):
+            raise item
+        paths, batch = item
+        with torch.no_grad():
+            boxes, probs = detector.detect(batch)
+        batch_faces = []
+
+        for i, path in enumerate(paths):
+            holder = {
+                "filename": path.name,
+                "time": int(path.stem) / interval,
+                "faces": [],
+            }
+            if boxes[i] is not None:
+                image = batch[i].numpy()
+                height, width = image.shape[:2]
+                for j, (box, prob) in enumerate(zip(boxes[i], probs[i])):
+                    if prob < min_confidence:
+                        continue
+                    x1, y1 = max(int(box[0]), 0), max(int(box[1]), 0)
+                    x2, y2 = min(int(box[2]), width), min(int(box[3]), height)
+                    face = {
+                        "box": [x1, y1, x2 - x1, y2 - y1],
+                        "confidence": float(prob),
+                    }
+                    if x2 > x1 and y2 > y1:
+                        crop_image = image[y1:y2, x1:x2].copy()
+                        batch_faces.append((face, crop_image))
+                        if writer is not None:
+                            crop = Path(crops_directory) / "{}_{}.jpg".format(
+                                path.stem, j
+                            )
+                            crops.put((crop, crop_image))
+                            face["crop"] = crop.name
+                    holder["faces"].append(face)
+            scan.append(holder)
+
+        if embedder is not None and len(batch_faces) > 0:
+            embeddings = embed_faces(embedder, [crop for _, crop in batch_faces])
+            for (face, _), embedding in zip(batch_faces, embeddings):
+                face["embedding"] = embedding
+
+        frame_count += len(paths)
+
+    if writer is not None:
+        crops.put(None)
+        writer.join()
+
+    duration = time.perf_counter() - time_start
+    print(
+        "Scanned {} frames in {:.2f}s ({:.1f} frames/sec) with batches of {}.".format(
+            frame_count, duration, frame_count / max(duration, 1e-9), batch_size
+        )
+    )
+
+    return scan
+
+
+def read_small_frame(path: Path) -> numpy.ndarray:
+    # Let the JPEG decoder downscale while decoding, which is much cheaper
+    # than decoding the full frame and resizing it.
+    image = cv2.imread(str(path), cv2.IMREAD_REDUCED_GRAYSCALE_4)
+    if image is None:
+        raise ValueError("unable to decode frame {}".format(path))
+    return image
+
+
+def read_small_frames(frames: list, decode_threads: int):
+    """Decode downscaled grayscale frames in order, on background threads.
+    Only a few frames per thread are decoded ahead, so memory stays flat
+    however long the source is.
+
+    Yields:
+        numpy.ndarray: Each frame, in order.
+    """
+
+    with futures.ThreadPoolExecutor(max_workers=decode_threads) as pool:
+        pending = collections.deque()
+        for path in frames:
+            pending.append(pool.submit(read_small_frame, path))
+            if len(pending) > decode_threads * 2:
+                yield pending.popleft().result()
+        while len(pending) > 0:
+            yield pending.popleft().result()
+
+
+def find_keyframes(
+    small, count: int, keyframe_interval: int, scene_threshold: float
+) -> numpy.ndarray:
+    """Choose the frames to run the detector on: every Nth frame, plus the
+    first frame of each new scene. A scene cut is a frame whose luma
+    histogram differs from the previous frame's by more than
+    `scene_threshold` (0.0-1.0, half the L1 distance of the normalized
+    histograms).
+
+    Args:
+        small (iterable[numpy.ndarray]): The downscaled grayscale frames, in
+            order. Only one is held at a time.
+        count (int): The number of frames.
+    """
+
+    bins = 32
+    keyframes = numpy.zeros(count, dtype=bool)
+    keyframes[::keyframe_interval] = True
+    previous = None
+    for i, frame in enumerate(small):
+        hist = numpy.bincount(frame.ravel() >> 3, minlength=bins) / frame.size
+        if previous is not None and numpy.abs(hist - previous).sum() / 2 > (
+            scene_threshold
+        ):
+            keyframes[i] = True
+        previous = hist
+    return keyframes
+
+
+def box_iou(a: numpy.ndarray, b: numpy.ndarray) -> numpy.ndarray:
+    """Get the intersection over union of every pair of [x, y, w, h] boxes in
+    a (N, 4) and b (M, 4), as an (N, M) matrix."""
+
+    a = a[:, None, :]
+    b = b[None, :, :]
+    w = numpy.minimum(a[..., 0] + a[..., 2], b[..., 0] + b[..., 2]) - numpy.maximum(
+        a[..., 0], b[..., 0]
+    )
+    h = numpy.minimum(a[..., 1] + a[..., 3], b[..., 1] + b[..., 3]) - numpy.maximum(
+        a[..., 1], b[..., 1]
+    )
+    intersection = numpy.clip(w, 0, None) * numpy.clip(h, 0, None)
+    union = a[..., 2] * a[..., 3] + b[..., 2] * b[..., 3] - intersection
+    return intersection / numpy.maximum(union, 1e-9)
+
+
+def flow_box(previous: numpy.ndarray, current: numpy.ndarray, box: list, scale: float):
+    """Move a full-resolution [x, y, w, h] box from one downscaled frame to
+    the next, by the median optical flow of a grid of points inside it.
+    Returns None when the box can't be followed."""
+
+    x, y, w, h = [v / scale for v in box]
+    grid = numpy.stack(
+        numpy.meshgrid(
+            numpy.linspace(x + w * 0.2, x + w * 0.8, 5),
+            numpy.linspace(y + h * 0.2, y + h * 0.8, 5),
+        ),
+        axis=-1,
+    )
+    points = grid.reshape(-1, 1, 2).astype(numpy.float32)
+    moved, status, _ = cv2.calcOpticalFlowPyrLK(
+        previous, current, points, None, winSize=(15, 15), maxLevel=2
+    )
+
+    good = status.ravel() == 1
+    if good.sum() < 3:
+        return None
+
+    dx, dy = numpy.median((moved - points)[good].reshape(-1, 2), axis=0) * scale
+    return [box[0] + float(dx), box[1] + float(dy), box[2], box[3]]
+
+
+def detect_tracked(
+    frames_directory: Path,
+    interval: float = 1.0,
+    keyframe_interval: int = 10,
+    scene_threshold: float = 0.4,
+    iou_threshold: float = 0.3,
+    decode_threads: int = 4,
+    **kwargs,
+) -> list:
+    """Detect faces on a sparse set of keyframes, and track them in between.
+
+    The detector only runs on every `keyframe_interval`th frame and on scene
+    cuts. Between keyframes, each face's box is carried forward by optical
+    flow on downscaled grayscale frames. At each keyframe, detections are
+    matched to the open tracks by IoU; unmatched detections start new tracks,
+    and tracks without a match end.
+
+    Other keyword arguments are passed to detect() for the keyframes.
+
+    Returns:
+        list[dict]: One entry per track, with its time range and boxes.
+    """
+
+    frames = list_frames(frames_directory)
+    if len(frames) == 0:
+        return []
+
+    # The frames are decoded twice, small and streamed, rather than held:
+    # once to find the keyframes, and once to track between them.
+    scale = read_frame(frames[0]).shape[1] / read_small_frame(frames[0]).shape[1]
+    keyframes = find_keyframes(
+        read_small_frames(frames, decode_threads),
+        len(frames),
+        keyframe_interval,
+        scene_threshold,
+    )
+    keyframe_paths = [f for f, k in zip(frames, keyframes) if k]
+    scan = detect(
+        frames_directory,
+        interval=interval,
+        decode_threads=decode_threads,
+        frames=keyframe_paths,
+        **kwargs,
+    )
+    detections = {holder["filename"]: holder["faces"] for holder in scan}
+
+    print(
+        "Ran the detector on {} of {} frames ({:.1f}%).".format(
+            len(keyframe_paths), len(frames), 100 * len(keyframe_paths) / len(frames)
+        )
+    )
+
+    tracks = []
+    active = []
+    previous = current = None
+    small = read_small_frames(frames, decode_threads)
+    for i, (path, frame) in enumerate(zip(frames, small)):
+        timestamp = int(path.stem) / interval
+        previous, current = current, frame
+
+        if not keyframes[i]:
+            # Carry each open track forward to this frame.
+            continuing = []
+            for track in active:
+                box = flow_box(previous, current, track["boxes"][-1]["box"], scale)
+                if box is not None:
+                    track["boxes"].append(
+                        {"time": timestamp, "detected": False, "box": box}
+                    )
+                    track["end"] = timestamp
+                    continuing.append(track)
+            active = continuing
+            continue
+
+        faces = detections[path.name]
+        matched_tracks, matched_faces = set(), set()
+        if len(active) > 0 and len(faces) > 0:
+            iou = box_iou(
+                numpy.array([track["boxes"][-1]["box"] for track in active]),
+                numpy.array([face["box"] for face in faces]),
+            )
+            # Greedily match the best overlapping pairs first.
+            order = numpy.unravel_index(numpy.argsort(-iou, axis=None), iou.shape)
+            for t, f in zip(*order):
+                if iou[t, f] < iou_threshold:
+                    break
+                if t in matched_tracks or f in matched_faces:
+                    continue
+                matched_tracks.add(t)
+                matched_faces.add(f)
+                track = active[t]
+                track["boxes"].append({"time": timestamp, "detected": True, **faces[f]})
+                track["end"] = timestamp
+                track["confidence"] = max(track["confidence"], faces[f]["confidence"])
+
+        active = [track for t, track in enumerate(active) if t in matched_tracks]
+        for f, face in enumerate(faces):
+            if f not in matched_faces:
+                track = {
+                    "track": len(tracks),
+                    "start": timestamp,
+                    "end": timestamp,
+                    "confidence": face["confidence"],
+                    "boxes": [{"time": timestamp, "detected": True, **face}],
+                }
+                tracks.append(track)
+                active.append(track)
+
+    return tracks
+
+
+def match_faces(
+    faces: list,
+    known: StirlingEmbeddingIndex = None,
+    known_threshold: float = 0.7,
+    index: StirlingEmbeddingIndex = None,
+):
+    """Match detected faces against the known faces, and add them to an
+    embedding index.
+
+    Args:
+        faces (list[tuple]): (face, metadata) tuples, where each face is a
+            dict from detect(). Its `embedding` is removed.
+        known (StirlingEmbeddingIndex): Known faces, with a `name` in each
+            embedding's metadata. A face that matches one with at least
+            `known_threshold` cosine similarity is given its `identity`.
+        index (StirlingEmbeddingIndex): An index to add every face to, with
+            its metadata.
+    """
+
+    faces = [(face, metadata) for face, metadata in faces if "embedding" in face]
+    if len(faces) == 0:
+        return
+
+    matrix = numpy.stack([face.pop("embedding") for face, _ in faces])
+
+    if known is not None and len(known) > 0:
+        scores, indices = known.query(matrix, k=1)
+        names = known.get_metadata(indices[:, 0])
+        for (face, _), score, name in zip(faces, scores[:, 0], names):
+            if score >= known_threshold:
+                face["identity"] = name.get("name")
+                face["identity_score"] = float(score)
+
+    if index is not None:
+        index.add(
+            matrix, [{**metadata, "box": face["box"]} for face, metadata in faces]
+        )
+
+
+def enroll(
+    directory: Path, name: str, known: StirlingEmbeddingIndex, detector, embedder
+):
+    """Add the most confident face in each image in a directory to the known
+    faces, under `name`."""
+
+    count = 0
+    for path in sorted(Path(directory).iterdir()):
+        if path.suffix not in (".jpg", ".png"):
+            continue
+        image = read_frame(path)
+        with torch.no_grad():
+            boxes, probs = detector.detect(torch.from_numpy(image[None]))
+        if boxes[0] is None:
+            continue
+        box = boxes[0][numpy.argmax(probs[0])]
+        x1, y1, x2, y2 = [max(int(v), 0) for v in box]
+        known.add(
+            embed_faces(embedder, [image[y1:y2, x1:x2]]),
+            [{"name": name, "source": path.name}],
+        )
+        count += 1
+
+    print("Enrolled {} images of {}.".format(count, name))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Batched face detection.")
+    parser.add_argument("frames_directory")
+    parser.add_argument("--output", required=True)
+    parser.add_argument("--crops-directory")
+    parser.add_argument("--interval", type=float, default=1.0)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--prefetch", type=int, default=4)
+    parser.add_argument("--decode-threads", type=int, default=4)
+    parser.add_argument("--min-confidence", type=float, default=0.9)
+    parser.add_argument("--keyframe-interval", type=int, default=0)
+    parser.add_argument("--scene-threshold", type=float, default=0.4)
+    parser.add_argument("--iou-threshold", type=float, default=0.3)
+    parser.add_argument("--inference-socket")
+    parser.add_argument("--embeddings-index")
+    parser.add_argument("--known-faces")
+    parser.add_argument("--known-threshold", type=float, default=0.7)
+    parser.add_argument("--job", default="")
+    parser.add_argument(
+        "--enroll",
+        metavar="NAME",
+        help="add the faces in frames_directory to --known-faces as NAME",
+    )
+    options = parser.parse_args()
+
+    # Imported here, as the inference worker imports this module.
+    from core import inference
+
+    detect_options = {
+        "interval": options.interval,
+        "crops_directory": options.crops_directory,
+        "batch_size": options.batch_size,
+        "prefetch": options.prefetch,
+        "decode_threads": options.decode_threads,
+        "min_confidence": options.min_confidence,
+        "detector": inference.get_detector(options.inference_socket),
+    }
+
+    known = index = None
+    if options.known_faces:
+        known = StirlingEmbeddingIndex(options.known_faces)
+    if options.embeddings_index:
+        index = StirlingEmbeddingIndex(options.embeddings_index)
+    if known is not None or index is not None:
+        detect_options["embedder"] = load_embedder()
+
+    if options.enroll:
+        if known is None:
+            parser.error("--enroll needs --known-faces")
+        enroll(
+            options.frames_directory,
+            options.enroll,
+            known,
+            detect_options["detector"],
+            detect_options["embedder"],
+        )
+        return
+
+    # Each frame stands for the time until the next frame.
+    frame_duration = 1 / options.interval
+
+    if options.keyframe_interval > 0:
+        scan = detect_tracked(
+            options.frames_directory,
+            keyframe_interval=options.keyframe_interval,
+            scene_threshold=options.scene_threshold,
+            iou_threshold=options.iou_threshold,
+            **detect_options,
+        )
+        match_faces(
+            [
+                (box, {"job": options.job, "time": box["time"], "track": t["track"]})
+                for t in scan
+                for box in t["boxes"]
+                if box["detected"]
+            ],
+            known,
+            options.known_threshold,
+            index,
+        )
+
+        records = []
+        for track in scan:
+            detected = [box for box in track["boxes"] if box["detected"]]
+            best = max(detected, key=lambda box: box["confidence"])
+            # A track takes the identity of its best match.
+            identified = [box for box in detected if "identity" in box]
+            if len(identified) > 0:
+                track["identity"] = max(
+                    identified, key=lambda box: box["identity_score"]
+                )["identity"]
+            records.append(
+                {
+                    "start": track["start"],
+                    "end": track["end"] + frame_duration,
+                    "label": track.get("identity", "face"),
+                    "score": track["confidence"],
+                    "bbox": best["box"],
+                }
+            )
+    else:
+        scan = detect(options.frames_directory, **detect_options)
+        match_faces(
+            [
+                (face, {"job": options.job, "time": holder["time"]})
+                for holder in scan
+                for face in holder["faces"]
+            ],
+            known,
+            options.known_threshold,
+            index,
+        )
+
+        records = [
+            {
+                "start": holder["time"],
+                "end": holder["time"] + frame_duration,
+                "label": face.get("identity", "face"),
+                "score": face["confidence"],
+                "bbox": face["box"],
+            }
+            for holder in scan
+            for face in holder["faces"]
+        ]
+
+    annotations.write_records(annotations.get_columns_path(options.output), records)
+
+    with open(options.output, "w") as output_file:
+        json.dump(scan, output_file)
+
+
+if __name__ == "__main__":
+    main()
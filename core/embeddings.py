@@ -0,0 +1,337 @@
+import argparse
+import fcntl
+import json
+import os
+from pathlib import Path
+
+import numpy
+
+# embeddings holds an appendable index of face embeddings for matching faces
+# across jobs. An index is a folder:
+#
+#   index.json       the embedding size, row count and partition settings
+#   embeddings.f32   every embedding, L2-normalized, as a float32 (N, dim) matrix
+#   metadata.jsonl   a JSON document per embedding (job, frame, name, ...)
+#   metadata.idx     the byte offset of each metadata line, as int64
+#   centroids.npy    the partition centroids, once the index is partitioned
+#   partitions.i32   the partition of each embedding, as int32
+#
+# The embeddings are memory-mapped, and a batch of queries is scored against
+# the whole gallery with a single matrix multiply per block of rows. Once the
+# gallery passes `partition_threshold` rows, it is split into partitions with
+# k-means (an IVF index) and each query only scores the rows in its `nprobe`
+# closest partitions. The partitions are retrained each time the gallery grows
+# to `repartition_growth` times the size they were trained on, so they keep
+# fitting the faces added since.
+
+
+def normalize(embeddings: numpy.ndarray) -> numpy.ndarray:
+    embeddings = numpy.asarray(embeddings, dtype=numpy.float32)
+    if embeddings.ndim == 1:
+        embeddings = embeddings[None]
+    norms = numpy.linalg.norm(embeddings, axis=1, keepdims=True)
+    return embeddings / numpy.maximum(norms, 1e-12)
+
+
+def merge_top_k(
+    scores: numpy.ndarray,
+    indices: numpy.ndarray,
+    new_scores: numpy.ndarray,
+    new_indices: numpy.ndarray,
+    k: int,
+):
+    """Merge a block of candidate scores into the running top-k of each
+    query."""
+
+    scores = numpy.concatenate([scores, new_scores], axis=1)
+    indices = numpy.concatenate([indices, new_indices], axis=1)
+    if scores.shape[1] > k:
+        top = numpy.argpartition(-scores, k - 1, axis=1)[:, :k]
+        scores = numpy.take_along_axis(scores, top, axis=1)
+        indices = numpy.take_along_axis(indices, top, axis=1)
+    return scores, indices
+
+
+class StirlingEmbeddingIndex(object):
+    """StirlingEmbeddingIndex stores embeddings for top-k cosine similarity
+    search.
+
+    Attributes:
+        directory (pathlib.Path): The folder holding the index.
+        dim (int): The size of each embedding. Only needed when creating a
+            new index.
+        partition_threshold (int): Partition the index once it holds this
+            many embeddings. 0 disables partitioning.
+        repartition_growth (float): Retrain the partitions once the index
+            holds this many times the embeddings they were trained on. 0
+            never retrains them.
+        nprobe (int): The number of partitions each query searches.
+        block_size (int): The number of gallery rows scored at once.
+    """
+
+    def __init__(
+        self,
+        directory: Path,
+        dim: int = 512,
+        partition_threshold: int = 100000,
+        repartition_growth: float = 2.0,
+        nprobe: int = 8,
+        block_size: int = 65536,
+    ):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.nprobe = nprobe
+        self.block_size = block_size
+
+        self.settings = {
+            "dim": dim,
+            "count": 0,
+            "partition_threshold": partition_threshold,
+            "repartition_growth": repartition_growth,
+            "partitions": 0,
+            # The number of embeddings the partitions were trained on.
+            "partitioned_count": 0,
+        }
+        self.__read_settings()
+
+    @property
+    def dim(self) -> int:
+        return self.settings["dim"]
+
+    def __len__(self) -> int:
+        return self.settings["count"]
+
+    def __path(self, name: str) -> Path:
+        return self.directory / name
+
+    def __lock(self):
+        # Serialize writers from other jobs and processes.
+        lock = open(self.__path(".lock"), "w")
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        return lock
+
+    def __read_settings(self):
+        # Another process may have changed the index since we read it.
+        if (self.directory / "index.json").exists():
+            with open(self.directory / "index.json") as index_file:
+                self.settings.update(json.load(index_file))
+
+    def __write_settings(self):
+        temp = self.__path("index.json.tmp")
+        with open(temp, "w") as index_file:
+            json.dump(self.settings, index_file)
+        os.replace(temp, self.__path("index.json"))
+
+    def matrix(self) -> numpy.ndarray:
+        if len(self) == 0:
+            return numpy.empty((0, self.dim), dtype=numpy.float32)
+        return numpy.memmap(
+            self.__path("embeddings.f32"),
+            dtype=numpy.float32,
+            mode="r",
+            shape=(len(self), self.dim),
+        )
+
+    def add(self, embeddings: numpy.ndarray, metadata: list = None):
+        """Append embeddings (and a metadata dict for each) to the index."""
+
+        embeddings = normalize(embeddings)
+        if embeddings.shape[1] != self.dim:
+            raise ValueError(
+                "expected embeddings of size {}, got {}".format(
+                    self.dim, embeddings.shape[1]
+                )
+            )
+        if metadata is None:
+            metadata = [{}] * len(embeddings)
+
+        with self.__lock():
+            self.__read_settings()
+
+            with open(self.__path("embeddings.f32"), "ab") as f:
+                f.write(embeddings.tobytes())
+
+            with open(self.__path("metadata.jsonl"), "ab") as f:
+                offsets = []
+                for item in metadata:
+                    offsets.append(f.tell())
+                    f.write(json.dumps(item).encode() + b"\n")
+            with open(self.__path("metadata.idx"), "ab") as f:
+                f.write(numpy.asarray(offsets, dtype=numpy.int64).tobytes())
+
+            if self.settings["partitions"] > 0:
+                with open(self.__path("partitions.i32"), "ab") as f:
+                    f.write(self.__assign(embeddings).tobytes())
+
+            self.settings["count"] += len(embeddings)
+            self.__write_settings()
+
+        threshold = self.settings["partition_threshold"]
+        growth = self.settings["repartition_growth"]
+        if self.settings["partitions"] == 0:
+            if 0 < threshold <= len(self):
+                self.build_partitions()
+        elif 0 < growth and self.settings["partitioned_count"] * growth <= len(self):
+            self.build_partitions()
+
+    def get_metadata(self, indices) -> list:
+        offsets = numpy.fromfile(self.__path("metadata.idx"), dtype=numpy.int64)
+        metadata = []
+        with open(self.__path("metadata.jsonl"), "rb") as f:
+            for i in numpy.ravel(indices):
+                f.seek(offsets[i])
+                metadata.append(json.loads(f.readline()))
+        return metadata
+
+    def __centroids(self) -> numpy.ndarray:
+        return numpy.load(self.__path("centroids.npy"))
+
+    def __assign(self, embeddings: numpy.ndarray) -> numpy.ndarray:
+        return numpy.argmax(embeddings @ self.__centroids().T, axis=1).astype(
+            numpy.int32
+        )
+
+    def build_partitions(self, partitions: int = None, iterations: int = 10):
+        """Split the index into partitions with spherical k-means, replacing
+        any partitions it has. Defaults to the square root of the number of
+        embeddings."""
+
+        # Take the sample while writers are locked out, so the row count and
+        # the rows agree.
+        with self.__lock():
+            self.__read_settings()
+            matrix = self.matrix()
+            count = len(matrix)
+            if partitions is None:
+                partitions = max(int(numpy.sqrt(count)), 1)
+            rng = numpy.random.default_rng(0)
+            sample_size = min(count, partitions * 256)
+            sample = numpy.array(
+                matrix[numpy.sort(rng.choice(count, sample_size, replace=False))]
+            )
+            del matrix
+
+        # Train the centroids on the sample, then assign every row.
+        centroids = sample[rng.choice(len(sample), partitions, replace=False)]
+        for _ in range(iterations):
+            assignment = numpy.argmax(sample @ centroids.T, axis=1)
+            sums = numpy.zeros_like(centroids)
+            numpy.add.at(sums, assignment, sample)
+            empty = numpy.linalg.norm(sums, axis=1) == 0
+            sums[empty] = centroids[empty]
+            centroids = normalize(sums)
+
+        with self.__lock():
+            # Rows added while training are assigned too.
+            self.__read_settings()
+            matrix = self.matrix()
+            numpy.save(self.__path("centroids.npy"), centroids)
+            with open(self.__path("partitions.i32"), "wb") as f:
+                for i in range(0, len(matrix), self.block_size):
+                    block = numpy.asarray(matrix[i : i + self.block_size])
+                    f.write(self.__assign(block).tobytes())
+            self.settings["partitions"] = partitions
+            self.settings["partitioned_count"] = count
+            self.__write_settings()
+
+    def query(self, queries: numpy.ndarray, k: int = 5):
+        """Find the k most similar embeddings for each query.
+
+        Returns:
+            tuple: (scores, indices), each of shape (Q, k), sorted by
+                descending cosine similarity. When the index holds fewer than
+                k embeddings, missing entries have a score of -inf and an
+                index of -1.
+        """
+
+        queries = normalize(queries)
+        matrix = self.matrix()
+        scores = numpy.full((len(queries), 0), -numpy.inf, dtype=numpy.float32)
+        indices = numpy.full((len(queries), 0), -1, dtype=numpy.int64)
+
+        if self.settings["partitions"] == 0:
+            for i in range(0, len(matrix), self.block_size):
+                block = numpy.asarray(matrix[i : i + self.block_size])
+                block_scores = queries @ block.T
+                block_indices = numpy.broadcast_to(
+                    numpy.arange(i, i + len(block)), block_scores.shape
+                )
+                scores, indices = merge_top_k(
+                    scores, indices, block_scores, block_indices, k
+                )
+        else:
+            scores, indices = self.__query_partitions(queries, matrix, k)
+
+        # Pad to k, then sort each row by score.
+        if scores.shape[1] < k:
+            pad = k - scores.shape[1]
+            scores = numpy.pad(scores, ((0, 0), (0, pad)), constant_values=-numpy.inf)
+            indices = numpy.pad(indices, ((0, 0), (0, pad)), constant_values=-1)
+        order = numpy.argsort(-scores, axis=1)
+        return (
+            numpy.take_along_axis(scores, order, axis=1),
+            numpy.take_along_axis(indices, order, axis=1),
+        )
+
+    def __query_partitions(self, queries: numpy.ndarray, matrix, k: int):
+        centroids = self.__centroids()
+        nprobe = min(self.nprobe, len(centroids))
+        probes = numpy.argpartition(-(queries @ centroids.T), nprobe - 1, axis=1)[
+            :, :nprobe
+        ]
+
+        # Group the rows by partition.
+        assignment = numpy.fromfile(self.__path("partitions.i32"), dtype=numpy.int32)
+        rows = numpy.argsort(assignment, kind="stable")
+        bounds = numpy.searchsorted(
+            assignment[rows], numpy.arange(len(centroids) + 1), side="left"
+        )
+
+        scores = numpy.full((len(queries), k), -numpy.inf, dtype=numpy.float32)
+        indices = numpy.full((len(queries), k), -1, dtype=numpy.int64)
+
+        # Score every query that probes a partition against it at once.
+        for partition in numpy.unique(probes):
+            members = rows[bounds[partition] : bounds[partition + 1]]
+            if len(members) == 0:
+                continue
+            asking = numpy.flatnonzero((probes == partition).any(axis=1))
+            block_scores = queries[asking] @ numpy.asarray(matrix[members]).T
+            block_indices = numpy.broadcast_to(members, block_scores.shape)
+            scores[asking], indices[asking] = merge_top_k(
+                scores[asking], indices[asking], block_scores, block_indices, k
+            )
+
+        return scores, indices
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Query a face embedding index.")
+    parser.add_argument("directory")
+    parser.add_argument(
+        "queries", help="a .npy file of query embeddings, shape (Q, dim)"
+    )
+    parser.add_argument("-k", type=int, default=5)
+    options = parser.parse_args()
+
+    index = StirlingEmbeddingIndex(options.directory)
+    scores, indices = index.query(numpy.load(options.queries), k=options.k)
+
+    results = []
+    for row_scores, row_indices in zip(scores, indices):
+        found = row_indices >= 0
+        results.append(
+            [
+                {"score": float(s), "index": int(i), **m}
+                for s, i, m in zip(
+                    row_scores[found],
+                    row_indices[found],
+                    index.get_metadata(row_indices[found]),
+                )
+            ]
+        )
+    print(json.dumps(results, indent=4))
+
+
+if __name__ == "__main__":
+    main()
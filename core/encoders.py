@@ -104,7 +104,7 @@ class StirlingVideoEncoderAV1(StirlingEncoder):
             of the source video file to determine how many frames should pass
             before inserting a new keyframe. For AV1, this will also set the GOP
             (Group of Pictures) size.
-        encoder_fps (int): The frames-per-second of the video. This is used to
+        encoder_fps (float): The frames-per-second of the video. This is used to
             calculate the keyframe interval, among other things.
         encoder_mode (str): When encoding video, we will either aim for a
             Constant Bit Rate (CBR) or a Variable Bit Rate (VBR). CBR is for
@@ -125,7 +125,7 @@ class StirlingVideoEncoderAV1(StirlingEncoder):
             but lowest file size.
         encoder_bitrate_target (int): The target bitrate (or size per frame)
             of the video, in kilobits. This is used when encoding using CBR. If
-            the `encoder_bitrate_min` and `encoder_bitrate_max` are not set,
+            the `encoder_bitrate_min` and `encoder_bitrate_max` are not set (0),
             then the `encoder_quality_level` must be set.
         encoder_bitrate_min (int): The minimum bitrate (or size per frame) of
             the video, in kilobits. This is used when encoding using CBR.
@@ -138,37 +138,69 @@ class StirlingVideoEncoderAV1(StirlingEncoder):
             Must also be set with encoder_bitrate_min.
         encoder_quality_profile (str): The quality profile (or in some encoders,
             like AV1, the preset) refers to the `preset` option available in
-            some AV1 encoders. Currently, only SVT-AV1 supports this option. The
-            default preset is 0 for maximum quality.
+            some AV1 encoders. For SVT-AV1 this is the `preset` (0-13), and for
+            aom it is `cpu-used` (0-8); in both, lower numbers are slower but
+            better quality. The default preset is 0 for maximum quality.
+        encoder_tile_rows (int): The number of tile rows to split each frame
+            into, as a log2 value (e.g. 2 for 4 rows). Tiles are encoded and
+            decoded in parallel, at a small cost in quality. Defaults to 0.
+        encoder_tile_columns (int): The number of tile columns, as a log2
+            value. Defaults to 0.
+        encoder_lookahead (int): The number of frames the encoder looks ahead
+            when deciding how to spend bits. -1 (the default) uses the
+            encoder's own default.
+        encoder_threads (int): The number of threads the encoder may use
+            (SVT-AV1's level of parallelism). 0 (the default) uses every core.
 
     """
 
     name: str = "av1"
+    options: dict = field(default_factory=dict)
     frameworks: list = field(default_factory=lambda: ["ffmpeg"])
     encoders: list = field(default_factory=lambda: ["aom", "svt"])
     encoder_options: dict = field(default_factory=dict)
     encoder_default: str = "aom"
     encoder_keyframe_interval: float = 10
-    encoder_fps: int = None
+    encoder_fps: float = 0
     encoder_mode: str = "vbr"
     encoder_quality_level: int = 12
     encoder_quality_profile: str = "0"
-    encoder_bitrate_target: int = None
-    encoder_bitrate_min: int = None
-    encoder_bitrate_max: int = None
+    encoder_bitrate_target: int = 0
+    encoder_bitrate_min: int = 0
+    encoder_bitrate_max: int = 0
     encoder_subjective: bool = True
+    encoder_tile_rows: int = 0
+    encoder_tile_columns: int = 0
+    encoder_lookahead: int = -1
+    encoder_threads: int = 0
 
     def __post_init__(self):
         pass
 
-    def get(self, encoder: str, encoder_options: dict):
+    def get(self, encoder: str = None, encoder_options: dict = None) -> dict:
+        """Get the ffmpeg options for an encoder.
+
+        Args:
+            encoder (str): The encoder to use, one of `encoders`. Defaults to
+                `encoder_default`.
+            encoder_options (dict): Options that override the generated
+                ones.
+
+        Raises:
+            ValueError: If the encoder isn't supported.
+        """
         if encoder is None:
             encoder = self.encoder_default
-        if encoder in self.options:
-            return self.__get_encoder_options(encoder, encoder_options)
+        if encoder not in self.encoders:
+            raise ValueError(
+                "unsupported AV1 encoder {}, expected one of: {}".format(
+                    encoder, ", ".join(self.encoders)
+                )
+            )
+        return {**self.__get_encoder_options(encoder), **(encoder_options or {})}
 
-    def __get_encoder_options(self, encoder: str, encoder_options: dict):
-        keyframe_fps_interval = self.encoder_keyframe_interval * self.encoder_fps
+    def __get_encoder_options(self, encoder: str) -> dict:
+        keyframe_fps_interval = int(round(self.encoder_keyframe_interval * self.encoder_fps))
         if keyframe_fps_interval <= 0:
             keyframe_fps_interval = 30 # default to 1 frame every 30 frames
 
@@ -178,7 +210,15 @@ class StirlingVideoEncoderAV1(StirlingEncoder):
                     "c:v": "libaom-av1",
                     "g": keyframe_fps_interval,
                     "keyint_min": keyframe_fps_interval,
+                    "cpu-used": int(self.encoder_quality_profile),
+                    "row-mt": 1,
+                    "tile-rows": self.encoder_tile_rows,
+                    "tile-columns": self.encoder_tile_columns,
                 }
+                if self.encoder_lookahead >= 0:
+                    self.options["lag-in-frames"] = self.encoder_lookahead
+                if self.encoder_threads > 0:
+                    self.options["threads"] = self.encoder_threads
                 match self.encoder_mode:
                     case "vbr":
                         vbr_options = {
@@ -188,19 +228,16 @@ class StirlingVideoEncoderAV1(StirlingEncoder):
                         self.options = {**self.options, **vbr_options}
                     case "cbr":
                         cbr_options = {
-                            "b:v": self.encoder_bitrate_target + "k",
+                            "b:v": "{}k".format(self.encoder_bitrate_target),
                         }
-                        if (
-                            self.encoder_bitrate_min is not None
-                            and self.encoder_bitrate_max is not None
-                        ):
+                        if self.encoder_bitrate_min > 0 and self.encoder_bitrate_max > 0:
                             cbr_bitrate_options = {
-                                "minrate": self.encoder_bitrate_min + "k",
-                                "maxrate": self.encoder_bitrate_max + "k",
+                                "minrate": "{}k".format(self.encoder_bitrate_min),
+                                "maxrate": "{}k".format(self.encoder_bitrate_max),
                             }
                         else:
                             cbr_bitrate_options = {
-                                "b:v": self.encoder_bitrate_target + "k",
+                                "b:v": "{}k".format(self.encoder_bitrate_target),
                                 "crf": self.encoder_quality_level,
                             }
                         self.options = {
@@ -212,12 +249,34 @@ class StirlingVideoEncoderAV1(StirlingEncoder):
             case "svt":
                 self.options = {
                     "c:v": "libsvtav1",
-                    "g": self.encoder_keyframe_fps_interval * self.encoder_fps,
+                    "g": keyframe_fps_interval,
+                    "preset": int(self.encoder_quality_profile),
+                }
+                # SVT-AV1 takes most of its settings as a single list of
+                # key=value parameters.
+                svt_params = {
+                    "tune": 0 if self.encoder_subjective else 1,
+                    "tile-rows": self.encoder_tile_rows,
+                    "tile-columns": self.encoder_tile_columns,
                 }
+                if self.encoder_lookahead >= 0:
+                    svt_params["lookahead"] = self.encoder_lookahead
+                if self.encoder_threads > 0:
+                    svt_params["lp"] = self.encoder_threads
                 match self.encoder_mode:
                     case "vbr":
-                        vbr_options = {
-                            "crf": self.encoder_quality_level,
-                            "preset": int(self.encoder_quality_profile),
-                            "svtav1-params": f"tune={0 if self.encoder_subjective else 1}",
-                        }
+                        self.options["crf"] = self.encoder_quality_level
+                    case "cbr":
+                        # SVT-AV1's strict CBR (rc=2) only works with its
+                        # low-delay prediction structure, which isn't meant for
+                        # files, so the bitrate is targeted with its VBR rate
+                        # control (rc=1) instead, capped by the maximum.
+                        svt_params["rc"] = 1
+                        self.options["b:v"] = "{}k".format(self.encoder_bitrate_target)
+                        if self.encoder_bitrate_max > 0:
+                            self.options["maxrate"] = "{}k".format(self.encoder_bitrate_max)
+                self.options["svtav1-params"] = ":".join(
+                    "{}={}".format(key, value) for key, value in svt_params.items()
+                )
+
+        return self.options
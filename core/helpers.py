@@ -1,21 +1,83 @@
 import json
-import shutil
+import os
+import shlex
+import subprocess
+import sys
+import time
 import uuid
 import dataclasses
 from datetime import datetime
 from pathlib import Path
 
+from core import args, capabilities, definitions
+
+# The root of the engine's source tree, so that commands running the engine's
+# own modules can find them regardless of the job's working directory.
+engine_root = Path(__file__).resolve().parent.parent
+
+# Runs and measures each command (see run_command).
+launcher = engine_root / "core" / "launcher.py"
+
 
 def check_dependencies_binaries(required_binaries: list) -> bool:
-    required_binaries_missing = []
-    for program in required_binaries:
-        if shutil.which(program) is None:
-            required_binaries_missing.append(program)
-    if not len(required_binaries_missing) == 0:
-        return "missing binary dependencies: {}".format(
-            " ".join(required_binaries_missing)
-        )
-    return True
+    """Check that every binary in a list is installed. Each binary is only
+    looked up on the PATH once per process (see core.capabilities)."""
+    return all(capabilities.which(program) is not None for program in required_binaries)
+
+
+def python_module_command(module: str, *positional, **options) -> str:
+    """Build a command that runs one of the engine's own modules with the
+    current Python interpreter, for plugins whose work is done in Python
+    rather than by an external binary."""
+    return "PYTHONPATH={}:$PYTHONPATH {} -m {} {}".format(
+        shlex.quote(str(engine_root)),
+        shlex.quote(sys.executable),
+        module,
+        args.default_unparser.unparse(*positional, **options),
+    )
+
+
+def run_command(command: str) -> tuple:
+    """Run a shell command, and measure the resources it used.
+
+    The command is started through core/launcher.py, which forks it and
+    reports its CPU time, peak memory and I/O (including the processes it
+    started). Measured from the engine itself, every command's peak memory
+    would start from the engine's own.
+
+    Returns:
+        tuple: (exit status, output, definitions.StirlingCmdUsage). The
+            output combines stdout and stderr, without its trailing newline.
+    """
+
+    usage_read, usage_write = os.pipe()
+    time_start = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-S", str(launcher), str(usage_write), command],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        text=True,
+        errors="replace",
+        pass_fds=(usage_write,),
+    )
+    os.close(usage_write)
+    output = process.stdout.read()
+    process.stdout.close()
+    with os.fdopen(usage_read) as f:
+        report = f.read()
+    process.wait()
+
+    usage = definitions.StirlingCmdUsage(time=time.perf_counter() - time_start)
+    status = process.returncode
+    if report:
+        report = json.loads(report)
+        status = report.pop("status")
+        for key, value in report.items():
+            setattr(usage, key, value)
+
+    if output.endswith("\n"):
+        output = output[:-1]
+    return status, output, usage
 
 
 def is_valid_uuid(uuid_to_test: str, version: int = 4) -> bool:
@@ -29,7 +91,10 @@ def is_valid_uuid(uuid_to_test: str, version: int = 4) -> bool:
 # The StirlingJobEncoder class is used to serialize the StirlingJob class into JSON.
 class StirlingJSONEncoder(json.JSONEncoder):
     def default(self, obj):
-        if dataclasses.is_dataclass(obj):
+        if isinstance(obj, definitions.StirlingCmdUsage):
+            # Every counter is kept, so 0 reads as "none", not "unmeasured".
+            return dataclasses.asdict(obj)
+        elif dataclasses.is_dataclass(obj):
             d = dataclasses.asdict(obj)
             return self._remove_hidden_keys(d)
         elif isinstance(obj, uuid.UUID):
@@ -41,9 +106,18 @@ class StirlingJSONEncoder(json.JSONEncoder):
             return str(obj)
         return super().default(obj)
 
-    def _remove_hidden_keys(self, _d):
+    # Values under these keys are records of what a job did, where False and
+    # 0 are results (a missed deadline, a command without I/O), so they are
+    # kept rather than dropped as unset.
+    records = ("plugin_metadata", "usage")
+
+    def _remove_hidden_keys(self, _d, keep_falsy: bool = False):
         return {
-            a: self._remove_hidden_keys(b) if isinstance(b, dict) else b
+            a: (
+                self._remove_hidden_keys(b, keep_falsy or a in self.records)
+                if isinstance(b, dict)
+                else b
+            )
             for a, b in _d.items()
-            if b and not a.startswith("_")
+            if (b or keep_falsy) and not a.startswith("_")
         }
@@ -0,0 +1,360 @@
+import argparse
+import collections
+import json
+import os
+import secrets
+import socket
+import stat
+import tempfile
+import threading
+import time
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client, Listener
+from pathlib import Path
+
+import numpy
+import torch
+
+from core import detection, pytorch
+
+# inference holds a long-lived worker that keeps the detection model loaded
+# and shares it between jobs. Jobs send batches of frames over a unix socket;
+# the worker gathers frames from every connected job into full batches for the
+# model, and sends each job its own results back. Start it once per host:
+#
+#   python -m core.inference --socket /tmp/stirling-inference-1000/inference.sock
+#
+# and point the objects plugin at the socket with `objects_inference_socket`.
+#
+# Requests are pickled, and unpickling can run code, so only the worker's own
+# user may connect: the socket is made in a directory only that user can
+# open, and clients must prove they know a random key, which the worker
+# writes next to the socket (with the suffix ".key") when it starts.
+
+default_socket = str(
+    Path(tempfile.gettempdir())
+    / "stirling-inference-{}".format(os.getuid())
+    / "inference.sock"
+)
+
+
+def get_authkey_file(socket_path: str) -> Path:
+    return Path(str(socket_path) + ".key")
+
+
+def make_private_directory(path: Path):
+    """Make a directory only this user can open, or check that an existing
+    one is.
+
+    Raises:
+        PermissionError: The directory belongs to another user, or other
+            users can open it.
+    """
+
+    path = Path(path)
+    path.mkdir(mode=0o700, parents=True, exist_ok=True)
+    info = path.stat()
+    if info.st_uid != os.getuid() or stat.S_IMODE(info.st_mode) & 0o077:
+        raise PermissionError(
+            "{} must belong to this user, with 0700 permissions.".format(path)
+        )
+
+
+def is_listening(socket_path: str) -> bool:
+    """Check whether a process is accepting connections on a unix socket."""
+
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+        try:
+            connection.connect(str(socket_path))
+        except OSError:
+            return False
+    return True
+
+
+class StirlingInferenceRequest(object):
+    """A batch of frames from one client, waiting for the model."""
+
+    def __init__(self, frames: numpy.ndarray):
+        self.frames = frames
+        self.boxes = []
+        self.probs = []
+        self.error = None
+        self.time_queued = time.perf_counter()
+        self.done = threading.Event()
+
+
+class StirlingInferenceServer(object):
+    """StirlingInferenceServer loads the detector once, and runs requests
+    from any number of clients through it in shared batches.
+
+    Requests are queued as they arrive. The batcher takes the oldest request
+    and then waits up to `max_wait` seconds for more requests with the same
+    frame size, until it has `batch_size` frames to run together.
+
+    Attributes:
+        socket_path (str): The unix socket to listen on. Its directory is
+            made private to this user.
+        batch_size (int): The number of frames to run the model on at once.
+        max_wait (float): The longest to wait for a batch to fill, in seconds.
+        report_interval (float): How often to print the worker's metrics, in
+            seconds.
+    """
+
+    def __init__(
+        self,
+        socket_path: str,
+        batch_size: int = 32,
+        max_wait: float = 0.05,
+        report_interval: float = 60.0,
+    ):
+        self.socket_path = socket_path
+        self.batch_size = batch_size
+        self.max_wait = max_wait
+        self.report_interval = report_interval
+        self.device = pytorch.pytorch_get_device()
+        self.detector = detection.load_detector(self.device)
+
+        self.queue = collections.deque()
+        self.condition = threading.Condition()
+        self.metrics = {
+            "clients": 0,
+            "requests": 0,
+            "frames": 0,
+            "batches": 0,
+            "queue_wait": 0.0,
+        }
+
+    def stats(self) -> dict:
+        """Get the worker's metrics. `batch_fill` is the average share of each
+        batch that was filled with frames, from 0.0 to 1.0."""
+
+        with self.condition:
+            stats = dict(self.metrics)
+            stats["queue_depth"] = len(self.queue)
+            stats["queue_frames"] = sum(len(r.frames) for r in self.queue)
+        stats["batch_size"] = self.batch_size
+        stats["device"] = str(self.device)
+        stats["batch_fill"] = stats["frames"] / max(
+            stats["batches"] * self.batch_size, 1
+        )
+        stats["queue_wait_mean"] = stats["queue_wait"] / max(stats["requests"], 1)
+        return stats
+
+    def serve(self):
+        """Serve clients until the process is stopped.
+
+        Raises:
+            RuntimeError: Another worker is already serving on the socket.
+        """
+
+        make_private_directory(Path(self.socket_path).parent)
+        if is_listening(self.socket_path):
+            raise RuntimeError(
+                "An inference worker is already serving on {}.".format(self.socket_path)
+            )
+        # Left by a worker that didn't close it.
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+
+        # A new key for every run, readable only by this user.
+        authkey = secrets.token_bytes(32)
+        authkey_file = get_authkey_file(self.socket_path)
+        handle = os.open(authkey_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(handle, "wb") as f:
+            f.write(authkey)
+
+        listener = Listener(self.socket_path, family="AF_UNIX", authkey=authkey)
+        threading.Thread(target=self.__batch, daemon=True).start()
+        print(
+            "Serving {} on {} with batches of {}.".format(
+                self.device, self.socket_path, self.batch_size
+            )
+        )
+
+        try:
+            while True:
+                try:
+                    connection = listener.accept()
+                except (AuthenticationError, EOFError, OSError):
+                    # A client without the key, or one that hung up.
+                    continue
+                threading.Thread(
+                    target=self.__handle, args=(connection,), daemon=True
+                ).start()
+        finally:
+            listener.close()
+            authkey_file.unlink(missing_ok=True)
+
+    def __handle(self, connection):
+        with self.condition:
+            self.metrics["clients"] += 1
+
+        try:
+            while True:
+                message = connection.recv()
+                match message[0]:
+                    case "detect":
+                        request = StirlingInferenceRequest(message[1])
+                        with self.condition:
+                            self.queue.append(request)
+                            self.condition.notify()
+                        request.done.wait()
+                        if request.error is not None:
+                            connection.send(request.error)
+                        else:
+                            connection.send((request.boxes, request.probs))
+                    case "stats":
+                        connection.send(self.stats())
+                    case _:
+                        connection.send(ValueError("unknown request"))
+        except EOFError:
+            pass
+        finally:
+            connection.close()
+            with self.condition:
+                self.metrics["clients"] -= 1
+
+    def __next_batch(self) -> list:
+        """Wait for the next set of requests to run together."""
+
+        with self.condition:
+            while len(self.queue) == 0:
+                self.condition.wait()
+
+            first = self.queue.popleft()
+            batch = [first]
+            frames = len(first.frames)
+            deadline = time.perf_counter() + self.max_wait
+
+            while frames < self.batch_size:
+                # Take any waiting requests that fit, and have the same frame
+                # size as the first.
+                for request in list(self.queue):
+                    if frames >= self.batch_size:
+                        break
+                    if (
+                        request.frames.shape[1:] == first.frames.shape[1:]
+                        and frames + len(request.frames) <= self.batch_size
+                    ):
+                        self.queue.remove(request)
+                        batch.append(request)
+                        frames += len(request.frames)
+
+                remaining = deadline - time.perf_counter()
+                if frames >= self.batch_size or remaining <= 0:
+                    break
+                self.condition.wait(remaining)
+
+        return batch
+
+    def __batch(self):
+        report_time = time.perf_counter()
+        while True:
+            batch = self.__next_batch()
+            frames = numpy.concatenate([r.frames for r in batch])
+            now = time.perf_counter()
+
+            # A single request can be larger than a batch, so run the model
+            # over the frames in slices.
+            boxes, probs = [], []
+            try:
+                for i in range(0, len(frames), self.batch_size):
+                    with torch.no_grad():
+                        b, p = self.detector.detect(
+                            torch.from_numpy(frames[i : i + self.batch_size])
+                        )
+                    boxes.extend(b)
+                    probs.extend(p)
+            except Exception as e:
+                # Fail the requests in this batch, but keep serving.
+                for request in batch:
+                    request.error = e
+                    request.done.set()
+                continue
+
+            with self.condition:
+                self.metrics["batches"] += -(-len(frames) // self.batch_size)
+                self.metrics["frames"] += len(frames)
+                self.metrics["requests"] += len(batch)
+                self.metrics["queue_wait"] += sum(now - r.time_queued for r in batch)
+
+            offset = 0
+            for request in batch:
+                count = len(request.frames)
+                request.boxes = boxes[offset : offset + count]
+                request.probs = probs[offset : offset + count]
+                offset += count
+                request.done.set()
+
+            if time.perf_counter() - report_time > self.report_interval:
+                report_time = time.perf_counter()
+                print(json.dumps(self.stats()), flush=True)
+
+
+class StirlingInferenceClient(object):
+    """A detector that sends its frames to a running StirlingInferenceServer.
+    It has the same `detect()` interface as the MTCNN detector, so it can be
+    passed to detection.detect()."""
+
+    def __init__(self, socket_path: str = default_socket):
+        authkey = get_authkey_file(socket_path).read_bytes()
+        self.connection = Client(socket_path, family="AF_UNIX", authkey=authkey)
+
+    def detect(self, batch):
+        if isinstance(batch, torch.Tensor):
+            batch = batch.numpy()
+        self.connection.send(("detect", batch))
+        result = self.connection.recv()
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def stats(self) -> dict:
+        self.connection.send(("stats",))
+        return self.connection.recv()
+
+    def close(self):
+        self.connection.close()
+
+
+def get_detector(socket_path: str = None):
+    """Get a client for the inference worker on `socket_path`, or load a
+    detector in this process if no worker is running there."""
+
+    if socket_path is not None:
+        if Path(socket_path).exists():
+            try:
+                return StirlingInferenceClient(socket_path)
+            except (OSError, AuthenticationError):
+                pass
+        print(
+            "No inference worker on {}, loading the detector locally.".format(
+                socket_path
+            )
+        )
+    return detection.load_detector()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Shared inference worker.")
+    parser.add_argument("--socket", default=default_socket)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--max-wait", type=float, default=0.05)
+    parser.add_argument(
+        "--stats", action="store_true", help="print a running worker's metrics"
+    )
+    options = parser.parse_args()
+
+    if options.stats:
+        client = StirlingInferenceClient(options.socket)
+        print(json.dumps(client.stats(), indent=4))
+        client.close()
+        return
+
+    StirlingInferenceServer(
+        options.socket, batch_size=options.batch_size, max_wait=options.max_wait
+    ).serve()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,9 @@
+import dataclasses
 import json
 import os
 import shutil
-import subprocess
 import textwrap
+import time
 import uuid
 from dataclasses import dataclass, field
 from datetime import datetime
@@ -10,11 +11,7 @@ from pathlib import Path
 from typing import List
 from urllib.parse import urlsplit
 
-import networkx
-import requests
-import validators
-
-from core import definitions, helpers, probe
+from core import definitions, helpers, metrics, probe, tracing
 
 # TODO: Need this later for merging in a json job file.
 # from mergedeep import merge
@@ -63,8 +60,33 @@ class StirlingJob(definitions.StirlingClass):
             transcoding/extraction or running and plugins.. This is poorly
             supported and will be removed in a future version.
         debug (bool): Enable additional debugging output
+        trace (bool): Record how long each phase of the job takes (getting
+            the source, probing it, building each plugin's commands, running
+            each command and writing the job file), and write them as a
+            Chrome trace (see core.tracing) named 'trace.json', next to the
+            job file. Open it in https://ui.perfetto.dev to see the timeline.
         media_info (probe.StirlingMediaInfo): Contains metadata about the
             source media file, after it is probed.
+        plugin_metadata (dict): Decisions made by plugins while building
+            their commands (such as the renditions chosen for a streaming
+            package), keyed by plugin name, so they are recorded in the job
+            file.
+        deadline (float): The time the job must finish in, in seconds from
+            when it starts. Encoder presets are chosen to meet it, from this
+            host's measured encoding speed (see core.deadline), and the
+            predicted and actual times are recorded in the plugin metadata.
+            0 (the default) means no deadline.
+        usage (dict): The resources used by each command that has run
+            (`commands`: wall time, CPU time, peak memory and storage I/O, see
+            definitions.StirlingCmdUsage), and their totals for each plugin
+            (`plugins`), with the peak memory of its largest command.
+        outputs_ready (list[str]): The expected outputs of the commands that
+            have finished successfully, in the order they finished, once
+            the commands that finish writing them have too (see
+            definitions.StirlingCmd.ready_after). The job
+            file is written after every command, so outputs (like the editor
+            proxy) can be picked up from it as soon as they exist, before the
+            job is done.
 
     Raises:
         FileNotFoundError: _description_
@@ -72,8 +94,8 @@ class StirlingJob(definitions.StirlingClass):
     """
 
     source: str  # required
-    id: uuid.UUID = uuid.uuid4()
-    time_start: datetime = datetime.now()
+    id: uuid.UUID = field(default_factory=uuid.uuid4)
+    time_start: datetime = field(default_factory=datetime.now)
     time_end: datetime = None
     duration: float = 0.0
     job_file: Path = None
@@ -85,12 +107,18 @@ class StirlingJob(definitions.StirlingClass):
     source_copy_disable: bool = False
     simulate: bool = False
     debug: bool = True
+    trace: bool = False
     media_info: probe.StirlingMediaInfo = None
+    plugin_metadata: dict = field(default_factory=dict)
+    deadline: float = 0
+    usage: dict = field(default_factory=dict)
+    outputs_ready: List[str] = field(default_factory=list)
 
     # Private fields
     _plugins: List = field(default_factory=list)
     _outputs: List = field(default_factory=list)
     _commands: List[definitions.StirlingCmd] = field(default_factory=list)
+    _tracer: tracing.StirlingTracer = None
 
     def __post_init__(self):
         """Setup the job after it is created.
@@ -104,6 +132,10 @@ class StirlingJob(definitions.StirlingClass):
         As well, if we provide a JSON job file, we attempt to load that in and
         set the job up based on that.
         """
+        self._tracer = tracing.StirlingTracer(
+            enabled=self.trace, name="stirling job {}".format(self.id)
+        )
+
         # If the job file has been passed in, then load it.
         # Currently, we are setting the Job File as a default Path. We should
         # instead default this field to None, and check here if it is set
@@ -122,11 +154,14 @@ class StirlingJob(definitions.StirlingClass):
         self.log("Output Directory will be: " + str(self.output_directory))
 
         # Validate our incoming source file
-        self.__get_source()
+        with self.span("source"):
+            self.__get_source()
 
         # Probe the source file
-        self.media_info = probe.StirlingMediaInfo(source=self.source)
+        with self.span("probe"):
+            self.media_info = probe.StirlingMediaInfo(source=self.source)
         self.log("Media file {} probed: ".format(self.source), self.media_info)
+        metrics.job_started(self)
         self.write()
 
     @property
@@ -174,6 +209,20 @@ class StirlingJob(definitions.StirlingClass):
 
         return self._plugins
 
+    def span(self, name: str, category: str = "job", **args):
+        """Time a block of code in the job's trace, when tracing is enabled.
+
+        Args:
+            name (str): The name of the span.
+            category (str): The span's category.
+            **args: Details to show with the span.
+
+        Returns:
+            tracing.StirlingSpan: A context manager that times the block.
+        """
+
+        return self._tracer.span(name, category, **args)
+
     def get_plugin(self, plugin_name: str):
         """Get a plugin by name.
 
@@ -207,8 +256,8 @@ class StirlingJob(definitions.StirlingClass):
         for asset in assets:
             if asset.name == asset_name:
                 return asset.path
-            else:
-                raise ValueError("Asset not found")
+
+        raise ValueError("Asset not found")
 
     def add_plugins(self, *args):
         """Add new plugins to the job.
@@ -223,7 +272,8 @@ class StirlingJob(definitions.StirlingClass):
         for plugin in args:
             self._plugins.append(plugin)
             self.log('Added plugin "{}". '.format(plugin.name))
-        self.__parse()
+        with self.span("parse"):
+            self.__parse()
         self.write()
 
     def load(self):
@@ -244,6 +294,10 @@ class StirlingJob(definitions.StirlingClass):
 
         self.time_end = datetime.now()
         self.duration = (self.time_end - self.time_start).total_seconds()
+        if "deadline" in self.plugin_metadata:
+            self.plugin_metadata["deadline"]["actual_total"] = round(self.duration, 1)
+            self.plugin_metadata["deadline"]["met"] = self.duration <= self.deadline
+        metrics.job_finished(self)
         self.log(
             "Ending job {} at {}, total duration: {}".format(
                 self.id, self.time_end, self.duration
@@ -258,13 +312,22 @@ class StirlingJob(definitions.StirlingClass):
         for cmd in self.commands:
             # Check if we can probe the input file.
             cmd.status = definitions.StirlingCmdStatus.RUNNING
+            metrics.command_started(self, cmd)
             self.log(
                 "Starting command {} for plugin {}".format(
                     textwrap.shorten(cmd.command, width=20), cmd.name
                 )
             )
-            cmd_output = subprocess.getstatusoutput(cmd.command)
+            with self.span(cmd.name, "command", plugin=cmd.plugin) as span:
+                cmd_output = helpers.run_command(cmd.command)
+                span.set(
+                    returncode=cmd_output[0],
+                    cpu_user=cmd_output[2].cpu_user,
+                    cpu_system=cmd_output[2].cpu_system,
+                    max_rss=cmd_output[2].max_rss,
+                )
             cmd.log = cmd_output[1]
+            cmd.usage = cmd_output[2]
             if cmd_output[0] != 0:
                 cmd.status = definitions.StirlingCmdStatus.FAILED
                 self.log(
@@ -274,13 +337,17 @@ class StirlingJob(definitions.StirlingClass):
                 )
                 self.log("Command for plugin {}:".format(cmd.name), cmd.command)
                 self.log("Output:", cmd.log)
-            elif cmd_output[0] == 1:
+            else:
                 self.log(
                     "Command {} for plugin {} succeeded.".format(
                         textwrap.shorten(cmd.command, width=20), cmd.name
                     )
                 )
                 cmd.status = definitions.StirlingCmdStatus.SUCCESS
+                self.__add_outputs_ready()
+                plugin = self.get_plugin(cmd.plugin)
+                if plugin is not None:
+                    plugin.done(self, cmd)
 
                 self.log(
                     "Command {} for plugin {} output:".format(
@@ -288,18 +355,53 @@ class StirlingJob(definitions.StirlingClass):
                     ),
                     cmd.log,
                 )
+            self.__add_usage(cmd)
+            metrics.command_finished(self, cmd)
             self.write()
 
             cmd_holder.append(cmd)
 
         self._commands = cmd_holder
 
+        if "deadline" in self.plugin_metadata:
+            # The actual times of the encodes that had predictions.
+            predicted = self.plugin_metadata["deadline"].get("predicted", {})
+            self.plugin_metadata["deadline"]["actual"] = {
+                cmd.name: round(cmd.usage.time, 1)
+                for cmd in self.commands
+                if cmd.name in predicted and cmd.usage is not None
+            }
+            self.write()
+
+    def __add_usage(self, cmd: definitions.StirlingCmd):
+        """Record a command's resource usage, and add it to its plugin's
+        totals."""
+
+        usage = dataclasses.asdict(cmd.usage)
+        self.usage.setdefault("commands", []).append(
+            {"name": cmd.name, "plugin": cmd.plugin, "status": cmd.status} | usage
+        )
+
+        totals = self.usage.setdefault("plugins", {}).setdefault(
+            cmd.plugin or cmd.name, {"commands": 0}
+        )
+        totals["commands"] += 1
+        for key, value in usage.items():
+            if key == "max_rss":
+                totals[key] = max(totals.get(key, 0), value)
+            else:
+                totals[key] = totals.get(key, 0) + value
+
     def write(self):
         """Log an object (in JSON format) to the job log file."""
 
-        output_file = open(self.job_file, "w")
-        output_file.write(json.dumps(self, indent=4, cls=helpers.StirlingJSONEncoder))
-        output_file.close()
+        with self.span("write"):
+            output_file = open(self.job_file, "w")
+            output_file.write(
+                json.dumps(self, indent=4, cls=helpers.StirlingJSONEncoder)
+            )
+            output_file.close()
+        self._tracer.write(self.job_file.with_name("trace.json"))
 
     def log(self, message: str, *args):
         """Write a message to the log file.
@@ -380,8 +482,11 @@ class StirlingJob(definitions.StirlingClass):
             FileNotFoundError: _description_
         """
 
-        # If the incoming source is a URL, then let's download it.
-        if validators.url(self.source, public=False):
+        # If the incoming source is a URL, then let's download it. The URL
+        # libraries are only imported for sources that look like one.
+        if "://" in str(self.source) and self.__is_url(self.source):
+            import requests
+
             response = requests.get(self.source)
             incoming_filename = "".join(
                 os.path.splitext(os.path.basename(urlsplit(self.source).path))
@@ -416,6 +521,12 @@ class StirlingJob(definitions.StirlingClass):
 
             self.source = incoming_filename
 
+    @staticmethod
+    def __is_url(source: str) -> bool:
+        import validators
+
+        return bool(validators.url(source, public=False))
+
     def __get_output_directory(self):
         """Get the full path to the output directory for this job.
 
@@ -463,43 +574,87 @@ class StirlingJob(definitions.StirlingClass):
 
         test_file.close()
 
+    def __add_outputs_ready(self):
+        """Add the expected outputs that are complete to outputs_ready: those
+        of successful commands whose `ready_after` commands have succeeded
+        too. Each output is listed once."""
+
+        succeeded = set(
+            cmd.name
+            for cmd in self.commands
+            if cmd.status == definitions.StirlingCmdStatus.SUCCESS
+        )
+        for cmd in self.commands:
+            output = str(cmd.expected_output)
+            if (
+                cmd.expected_output
+                and cmd.name in succeeded
+                and succeeded.issuperset(cmd.ready_after)
+                and output not in self.outputs_ready
+            ):
+                self.outputs_ready.append(output)
+
     def __parse(self):
         """Parse the job and plugins to generate a list of commands to run."""
 
         # Clear the previous expected outputs
         self._outputs = []
 
-        # Create some holder variables
-        cmd_sort_holder = {}
-        cmd_output_holder = []
+        # Fit the encoders' presets to the deadline before the commands are
+        # built from them.
+        if self.deadline > 0:
+            from core import deadline
+
+            with self.span("deadline"):
+                deadline.plan(self)
 
         for plugin in self._plugins:
             self.log('Parsing plugin "{}" commands.'.format(plugin.name))
-            plugin.cmd(self)
-
-            # Sort each command in the plugin by its priority
-            self.commands.sort(key=lambda x: x.priority, reverse=True)
-
-            # Create a holder so we can run a topographical sort on the commands
+            count = len(self.commands)
+            with self.span(plugin.name, "plugin"):
+                plugin.cmd(self)
+            for cmd in self.commands[count:]:
+                if cmd.plugin is None:
+                    cmd.plugin = plugin.name
+                if not cmd.time_queued:
+                    cmd.time_queued = time.time()
+
+        if len(self.commands) > 0:
+            import networkx
+
+            # Every command is a node, so commands without dependencies are
+            # kept, with an edge from each command to the ones that depend on
+            # it.
+            graph = networkx.DiGraph()
+            order = {}
+            for i, cmd in enumerate(self.commands):
+                graph.add_node(cmd.name)
+                order.setdefault(cmd.name, i)
             for cmd in self.commands:
-                if len(cmd.depends_on) > 0:
-                    cmd_sort_holder[cmd.name] = cmd.depends_on
-
-        if len(cmd_sort_holder) > 0:
-            self.log(
-                'Parsing plugin "{}" dependencies {}.'.format(
-                    plugin.name, plugin.depends_on
-                )
-            )
+                for dependency in cmd.depends_on:
+                    if dependency in order:
+                        graph.add_edge(dependency, cmd.name)
+                    else:
+                        self.log(
+                            'Command "{}" depends on "{}", which has no command.'.format(
+                                cmd.name, dependency
+                            )
+                        )
 
-            # Sort the commands by their dependencies
-            cmd_sort_list = list(
-                reversed(
-                    list(networkx.topological_sort(networkx.DiGraph(cmd_sort_holder)))
+            # Sort the commands by their dependencies. Of the commands that
+            # are ready to run, the lowest priority number runs first, then
+            # the command that was added first.
+            priorities = {}
+            for cmd in self.commands:
+                priorities[cmd.name] = min(
+                    priorities.get(cmd.name, cmd.priority), cmd.priority
                 )
+            cmd_sort_list = networkx.lexicographical_topological_sort(
+                graph, key=lambda name: (priorities[name], order[name])
             )
 
             # Reorder the commands based on the topographical sort
+            cmd_output_holder = []
             for v in cmd_sort_list:
                 for cmd in self.commands:
                     if cmd.name == v:
@@ -0,0 +1,60 @@
+import json
+import os
+import sys
+
+# launcher runs a shell command for helpers.run_command, and reports the
+# resources it used, as GNU time does. Measuring the command from the engine
+# directly would be wrong: a child's peak memory (ru_maxrss) starts from its
+# parent's at fork, so every command would report at least the engine's own
+# memory. This process is small, and forks the command, so the command's
+# peak memory is its own:
+#
+#   python -S core/launcher.py <fd> <command>
+#
+# The command's output goes to this process's stdout and stderr. Its usage
+# is written as JSON to the file descriptor `fd`, once it has finished. Only
+# the standard library's builtin modules are used, so this starts quickly
+# with -S.
+
+
+def main():
+    usage_fd, command = int(sys.argv[1]), sys.argv[2]
+
+    pid = os.fork()
+    if pid == 0:
+        os.close(usage_fd)
+        try:
+            os.execv("/bin/sh", ["/bin/sh", "-c", command])
+        finally:
+            os._exit(127)
+
+    usage = {}
+    # Wait without reaping, so its I/O counters can still be read.
+    if hasattr(os, "waitid"):
+        os.waitid(os.P_PID, pid, os.WEXITED | os.WNOWAIT)
+        try:
+            with open("/proc/{}/io".format(pid)) as f:
+                io = dict(line.split(": ") for line in f.read().splitlines())
+            usage["read_bytes"] = int(io["read_bytes"])
+            usage["write_bytes"] = int(io["write_bytes"])
+        except (OSError, KeyError, ValueError):
+            pass
+
+    # CPU time and peak memory include the processes the command started.
+    _, status, rusage = os.wait4(pid, 0)
+    usage["cpu_user"] = rusage.ru_utime
+    usage["cpu_system"] = rusage.ru_stime
+    # Kilobytes on Linux, bytes on macOS.
+    usage["max_rss"] = rusage.ru_maxrss * (1 if sys.platform == "darwin" else 1024)
+
+    # A command killed by a signal exits as the shell reports it.
+    code = os.waitstatus_to_exitcode(status)
+    usage["status"] = code if code >= 0 else 128 - code
+
+    with os.fdopen(usage_fd, "w") as f:
+        json.dump(usage, f)
+    sys.exit(usage["status"])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,331 @@
+import glob
+import math
+import os
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+# metrics counts what a worker process has done, for monitoring engines that
+# run jobs continuously: how many jobs started, finished and failed, how long
+# each plugin's commands take and how fast they run against the media's
+# duration, how long commands waited to start, and how many bytes came in and
+# went out. Jobs feed it as they and their commands change state (see
+# job_started, command_started, command_finished and job_finished).
+#
+# The metrics are in Prometheus' text format, and can be exposed either way:
+#
+#   metrics.serve(9464)                        # http://127.0.0.1:9464/metrics
+#   metrics.registry.textfile = Path("/var/lib/node_exporter/stirling.prom")
+#
+# A textfile is rewritten after every change, for node-exporter's textfile
+# collector, and suits hosts where a worker can't listen on a port.
+
+# Bucket upper bounds, in seconds, for durations (commands run from well
+# under a second to hours).
+duration_buckets = (0.1, 0.5, 1, 5, 10, 30, 60, 300, 600, 1800, 3600, 7200)
+
+# Bucket upper bounds for speeds, as multiples of realtime.
+speed_buckets = (0.1, 0.25, 0.5, 1, 2, 4, 8, 16, 32, 64, 128)
+
+
+def format_labels(labels: tuple) -> str:
+    """Format (name, value) label pairs, escaped as the text format needs."""
+
+    if len(labels) == 0:
+        return ""
+    return "{{{}}}".format(
+        ",".join(
+            '{}="{}"'.format(
+                name,
+                str(value)
+                .replace("\\", "\\\\")
+                .replace('"', '\\"')
+                .replace("\n", "\\n"),
+            )
+            for name, value in labels
+        )
+    )
+
+
+def format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class StirlingCounter(object):
+    """A count that only goes up, for each set of label values."""
+
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels: tuple = ()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        # A count without labels starts at 0, so it is there to be scraped
+        # before anything happens.
+        self.values = {} if labels else {(): 0}
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple((name, labels[name]) for name in self.labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def render(self) -> list:
+        return [
+            "{}{} {}".format(self.name, format_labels(key), format_value(value))
+            for key, value in self.values.items()
+        ]
+
+
+class StirlingHistogram(object):
+    """Observations counted into buckets, for each set of label values."""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, buckets: tuple, labels: tuple = ()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = tuple(buckets) + (math.inf,)
+        # {label values: [count in each bucket, sum, count]}
+        self.values = {}
+
+    def observe(self, value: float, **labels):
+        key = tuple((name, labels[name]) for name in self.labels)
+        counts = self.values.setdefault(key, [[0] * len(self.buckets), 0, 0])
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                counts[0][i] += 1
+        counts[1] += value
+        counts[2] += 1
+
+    def render(self) -> list:
+        lines = []
+        for key, (buckets, total, count) in self.values.items():
+            for bound, bucket_count in zip(self.buckets, buckets):
+                lines.append(
+                    "{}_bucket{} {}".format(
+                        self.name,
+                        format_labels(key + (("le", format_value(bound)),)),
+                        bucket_count,
+                    )
+                )
+            lines.append(
+                "{}_sum{} {}".format(self.name, format_labels(key), format_value(total))
+            )
+            lines.append("{}_count{} {}".format(self.name, format_labels(key), count))
+        return lines
+
+
+class StirlingMetrics(object):
+    """The metrics of a worker process.
+
+    Attributes:
+        textfile (pathlib.Path): Rewrite this file with the metrics after
+            every change, for node-exporter's textfile collector. None (the
+            default) writes no file.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.textfile = None
+        self.metrics = {}
+
+    def add(self, metric):
+        self.metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        """Get the metrics in Prometheus' text format."""
+
+        lines = []
+        with self.lock:
+            for metric in self.metrics.values():
+                lines.append("# HELP {} {}".format(metric.name, metric.help))
+                lines.append("# TYPE {} {}".format(metric.name, metric.kind))
+                lines += metric.render()
+        return "\n".join(lines) + "\n"
+
+    def update(self, change):
+        """Make a change to the metrics, e.g. `lambda: counter.inc()`, and
+        rewrite the textfile if there is one."""
+
+        with self.lock:
+            change()
+        if self.textfile is not None:
+            self.write_textfile(self.textfile)
+
+    def write_textfile(self, path: Path):
+        """Write the metrics to a file. It is replaced in one step, so the
+        collector never reads a partial file."""
+
+        path = Path(path)
+        handle, temp = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+        with os.fdopen(handle, "w") as f:
+            f.write(self.render())
+        os.chmod(temp, 0o644)
+        os.replace(temp, path)
+
+
+registry = StirlingMetrics()
+
+jobs_started = registry.add(
+    StirlingCounter("stirling_jobs_started_total", "Jobs started.")
+)
+jobs_finished = registry.add(
+    StirlingCounter("stirling_jobs_finished_total", "Jobs finished, failed or not.")
+)
+jobs_failed = registry.add(
+    StirlingCounter(
+        "stirling_jobs_failed_total", "Jobs finished with a failed command."
+    )
+)
+command_duration = registry.add(
+    StirlingHistogram(
+        "stirling_command_duration_seconds",
+        "How long each command took to run.",
+        duration_buckets,
+        ("plugin", "status"),
+    )
+)
+command_speed = registry.add(
+    StirlingHistogram(
+        "stirling_command_speed_realtime",
+        "The source's duration divided by how long each successful command "
+        "took, e.g. 4 for an encode that ran at four times realtime.",
+        speed_buckets,
+        ("plugin",),
+    )
+)
+queue_wait = registry.add(
+    StirlingHistogram(
+        "stirling_command_queue_wait_seconds",
+        "How long each command waited to start, after the job's commands "
+        "were planned.",
+        duration_buckets,
+        ("plugin",),
+    )
+)
+bytes_ingested = registry.add(
+    StirlingCounter("stirling_ingested_bytes_total", "The size of the job sources.")
+)
+bytes_produced = registry.add(
+    StirlingCounter(
+        "stirling_produced_bytes_total",
+        "The size of the outputs of successful commands.",
+        ("plugin",),
+    )
+)
+
+
+def get_size(path: str) -> int:
+    """Get the size of a file, of every file in a directory, or of every
+    file matching a glob pattern."""
+
+    if not path:
+        return 0
+    size = 0
+    matches = [path] if Path(path).exists() else glob.glob(str(path))
+    for match in matches:
+        match = Path(match)
+        if match.is_file():
+            size += match.stat().st_size
+        elif match.is_dir():
+            size += sum(p.stat().st_size for p in match.rglob("*") if p.is_file())
+    return size
+
+
+def get_media_duration(job) -> float:
+    """Get the duration of a job's source, in seconds, or 0 if it hasn't
+    been probed."""
+
+    if job.media_info is None:
+        return 0.0
+    streams = job.media_info.video_streams + job.media_info.audio_streams
+    return max((float(stream.duration or 0) for stream in streams), default=0.0)
+
+
+def job_started(job):
+    """Count a job that has got and probed its source."""
+
+    size = get_size(job.source)
+
+    def change():
+        jobs_started.inc()
+        bytes_ingested.inc(size)
+
+    registry.update(change)
+
+
+def command_started(job, cmd):
+    """Record how long a command waited to start."""
+
+    if cmd.time_queued:
+        waited = max(time.time() - cmd.time_queued, 0)
+        registry.update(lambda: queue_wait.observe(waited, plugin=cmd.plugin))
+
+
+def command_finished(job, cmd):
+    """Record a command's duration, speed and output, once it has run."""
+
+    seconds = cmd.usage.time if cmd.usage is not None else 0
+    succeeded = cmd.status == "SUCCESS"
+    size = get_size(cmd.expected_output) if succeeded else 0
+    media_duration = get_media_duration(job)
+
+    def change():
+        command_duration.observe(
+            seconds, plugin=cmd.plugin, status=str(cmd.status.value)
+        )
+        if succeeded and seconds > 0 and media_duration > 0:
+            command_speed.observe(media_duration / seconds, plugin=cmd.plugin)
+        if succeeded:
+            bytes_produced.inc(size, plugin=cmd.plugin)
+
+    registry.update(change)
+
+
+def job_finished(job):
+    """Count a job that has closed, and whether any of its commands failed."""
+
+    failed = any(cmd.status == "FAILED" for cmd in job.commands)
+
+    def change():
+        jobs_finished.inc()
+        if failed:
+            jobs_failed.inc()
+
+    registry.update(change)
+
+
+def serve(port: int, address: str = "127.0.0.1"):
+    """Serve the metrics over HTTP, at /metrics, from a background thread.
+
+    Returns:
+        http.server.ThreadingHTTPServer: The server. Call its shutdown() to
+            stop it.
+    """
+
+    # Only workers that serve their metrics import the HTTP server.
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class StirlingMetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] not in ("/", "/metrics"):
+                self.send_error(404)
+                return
+            body = registry.render().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            # Scrapes would fill the worker's output.
+            pass
+
+    server = ThreadingHTTPServer((address, port), StirlingMetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
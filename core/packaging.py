@@ -0,0 +1,633 @@
+import argparse
+import math
+import re
+import struct
+from pathlib import Path
+from xml.etree import ElementTree
+
+# packaging builds extra streaming manifests from an HLS package that has
+# already been encoded, without encoding anything again. When the HLS plugin
+# writes fMP4 (CMAF) segments, the same init and segment files can be played
+# with DASH, so a DASH manifest is generated from the HLS playlists:
+#
+#   python -m core.packaging --dash manifest.mpd output/hls/
+#
+# Codecs are read from each rendition's init segment, and segment durations
+# from its media playlist.
+#
+# It also writes I-frame only playlists (--iframes) for trick play, which
+# address the keyframes inside the existing segments by byte range, found by
+# reading the MPEG-TS packets or fMP4 fragments of each segment.
+
+
+def parse_attributes(text: str) -> dict:
+    """Parse an HLS attribute list, e.g. BANDWIDTH=1000,CODECS="a,b"."""
+
+    return {
+        key: value.strip('"')
+        for key, value in re.findall(r'([A-Z0-9-]+)=("[^"]*"|[^,]*)', text)
+    }
+
+
+def read_master_playlist(path: Path) -> dict:
+    """Read the renditions from an HLS master playlist.
+
+    Returns:
+        dict: `media`, the EXT-X-MEDIA renditions, and `variants`, the
+            EXT-X-STREAM-INF renditions, each as a dict of their attributes
+            with their playlist in `URI`.
+    """
+
+    master = {"media": [], "variants": []}
+    lines = Path(path).read_text().splitlines()
+    for i, line in enumerate(lines):
+        if line.startswith("#EXT-X-MEDIA:"):
+            master["media"].append(parse_attributes(line.split(":", 1)[1]))
+        elif line.startswith("#EXT-X-STREAM-INF:"):
+            variant = parse_attributes(line.split(":", 1)[1])
+            variant["URI"] = lines[i + 1].strip()
+            master["variants"].append(variant)
+    return master
+
+
+def parse_byterange(text: str, offset: int) -> tuple:
+    """Parse an HLS byte range (length[@offset]) into (start, end), where end
+    is inclusive. Without an offset, the range follows on from `offset`."""
+
+    length, _, start = text.partition("@")
+    start = int(start) if start else offset
+    return start, start + int(length) - 1
+
+
+def read_media_playlist(path: Path) -> dict:
+    """Read the init segment and segments from an HLS media playlist.
+
+    Returns:
+        dict: `init` (the init segment's URI, or None), `init_range`, and
+            `segments`, a list of dicts with the `uri`, `duration` (in
+            seconds) and byte `range` (or None) of each segment.
+    """
+
+    playlist = {"init": None, "init_range": None, "segments": []}
+    duration, byterange, offset = None, None, 0
+    for line in Path(path).read_text().splitlines():
+        line = line.strip()
+        if line.startswith("#EXT-X-MAP:"):
+            attributes = parse_attributes(line.split(":", 1)[1])
+            playlist["init"] = attributes["URI"]
+            if "BYTERANGE" in attributes:
+                playlist["init_range"] = parse_byterange(attributes["BYTERANGE"], 0)
+        elif line.startswith("#EXTINF:"):
+            duration = float(line.split(":", 1)[1].split(",")[0])
+        elif line.startswith("#EXT-X-BYTERANGE:"):
+            byterange = parse_byterange(line.split(":", 1)[1], offset)
+            offset = byterange[1] + 1
+        elif line and not line.startswith("#"):
+            playlist["segments"].append(
+                {"uri": line, "duration": duration, "range": byterange}
+            )
+            duration, byterange = None, None
+    return playlist
+
+
+def iterate_boxes(data: bytes, start: int = 0, end: int = None):
+    """Yield (type, payload start, payload end) for each ISO BMFF box."""
+
+    end = len(data) if end is None else end
+    while start + 8 <= end:
+        size, box_type = struct.unpack(">I4s", data[start : start + 8])
+        header = 8
+        if size == 1:
+            size = struct.unpack(">Q", data[start + 8 : start + 16])[0]
+            header = 16
+        elif size == 0:
+            size = end - start
+        if size < header:
+            return
+        yield box_type.decode("latin-1"), start + header, start + size
+        start += size
+
+
+def find_box(data: bytes, path: list, start: int = 0, end: int = None):
+    """Find a nested box by its path of types, e.g. ["moov", "trak"]."""
+
+    for box_type, payload_start, payload_end in iterate_boxes(data, start, end):
+        if box_type == path[0]:
+            if len(path) == 1:
+                return payload_start, payload_end
+            found = find_box(data, path[1:], payload_start, payload_end)
+            if found is not None:
+                return found
+    return None
+
+
+def read_descriptor(data: bytes, position: int) -> tuple:
+    """Read an MPEG-4 descriptor's tag and length. Returns (tag, position of
+    its payload)."""
+
+    tag = data[position]
+    position += 1
+    for _ in range(4):
+        more = data[position] & 0x80
+        position += 1
+        if not more:
+            break
+    return tag, position
+
+
+def read_audio_codec(data: bytes, position: int) -> str:
+    """Get the codecs string for AAC from an esds box's descriptors: the
+    object type from the decoder config, and the audio object type from the
+    first 5 bits of the decoder specific info."""
+
+    # ES_Descriptor: an ID, then flags for optional fields.
+    _, position = read_descriptor(data, position)
+    flags = data[position + 2]
+    position += 3
+    if flags & 0x80:
+        position += 2
+    if flags & 0x40:
+        position += 1 + data[position]
+    if flags & 0x20:
+        position += 2
+
+    # DecoderConfigDescriptor, then DecoderSpecificInfo.
+    _, position = read_descriptor(data, position)
+    object_type = data[position]
+    _, position = read_descriptor(data, position + 13)
+    audio_object_type = data[position] >> 3
+    if audio_object_type == 31:
+        audio_object_type = 32 + (
+            ((data[position] & 0x07) << 3) | (data[position + 1] >> 5)
+        )
+    return "mp4a.{:02x}.{}".format(object_type, audio_object_type)
+
+
+def read_codec(init_file: Path) -> str:
+    """Get the RFC 6381 codecs string (e.g. avc1.64001f) of the track in an
+    fMP4 init segment."""
+
+    data = Path(init_file).read_bytes()
+    stsd = find_box(data, ["moov", "trak", "mdia", "minf", "stbl", "stsd"])
+    if stsd is None:
+        raise ValueError("no sample description in {}".format(init_file))
+
+    # stsd: version/flags and entry count, then the first sample entry.
+    entry_type, entry_start, entry_end = next(iterate_boxes(data, stsd[0] + 8, stsd[1]))
+    match entry_type:
+        case "avc1" | "avc3":
+            # Visual sample entries have 78 bytes of fields before their
+            # child boxes.
+            avcc = find_box(data, ["avcC"], entry_start + 78, entry_end)
+            if avcc is not None:
+                profile, constraints, level = data[avcc[0] + 1 : avcc[0] + 4]
+                return "{}.{:02x}{:02x}{:02x}".format(
+                    entry_type, profile, constraints, level
+                )
+        case "av01":
+            av1c = find_box(data, ["av1C"], entry_start + 78, entry_end)
+            if av1c is not None:
+                first, second = data[av1c[0] + 1 : av1c[0] + 3]
+                # high_bitdepth, then twelve_bit.
+                bit_depth = 8
+                if second & 0x40:
+                    bit_depth = 12 if second & 0x20 else 10
+                return "av01.{}.{:02d}{}.{:02d}".format(
+                    first >> 5,
+                    first & 0x1F,
+                    "H" if second & 0x80 else "M",
+                    bit_depth,
+                )
+        case "mp4a":
+            # Audio sample entries have 28 bytes of fields before their child
+            # boxes.
+            esds = find_box(data, ["esds"], entry_start + 28, entry_end)
+            if esds is not None:
+                return read_audio_codec(data, esds[0] + 4)
+            return "mp4a.40.2"
+    return entry_type
+
+
+def get_peak_bandwidth(directory: Path, playlist: dict) -> int:
+    """Get the highest bitrate of any segment in a playlist, in bits per
+    second."""
+
+    peak = 0
+    for segment in playlist["segments"]:
+        if segment["range"] is not None:
+            size = segment["range"][1] - segment["range"][0] + 1
+        else:
+            size = (Path(directory) / segment["uri"]).stat().st_size
+        peak = max(peak, size * 8 / max(segment["duration"], 0.001))
+    return int(peak)
+
+
+def format_duration(seconds: float) -> str:
+    return "PT{:.3f}S".format(seconds)
+
+
+def add_segment_list(representation, playlist: dict) -> float:
+    """Add a SegmentList that refers to the HLS playlist's segment files.
+    Returns the playlist's duration, in seconds."""
+
+    segment_list = ElementTree.SubElement(
+        representation, "SegmentList", timescale="1000"
+    )
+    initialization = ElementTree.SubElement(
+        segment_list, "Initialization", sourceURL=playlist["init"]
+    )
+    if playlist["init_range"] is not None:
+        initialization.set("range", "{}-{}".format(*playlist["init_range"]))
+
+    # Round the running total rather than each duration, so rounding errors
+    # don't add up over a long video.
+    timeline = ElementTree.SubElement(segment_list, "SegmentTimeline")
+    elapsed = 0.0
+    for segment in playlist["segments"]:
+        start = round(elapsed * 1000)
+        elapsed += segment["duration"]
+        ElementTree.SubElement(timeline, "S", d=str(round(elapsed * 1000) - start))
+
+    for segment in playlist["segments"]:
+        segment_url = ElementTree.SubElement(
+            segment_list, "SegmentURL", media=segment["uri"]
+        )
+        if segment["range"] is not None:
+            segment_url.set("mediaRange", "{}-{}".format(*segment["range"]))
+
+    return elapsed
+
+
+def write_dash(directory: Path, master: str, output: str):
+    """Write a DASH manifest for an fMP4 HLS package.
+
+    Args:
+        directory (pathlib.Path): The folder holding the HLS package.
+        master (str): The master playlist's filename.
+        output (str): The DASH manifest's filename.
+    """
+
+    directory = Path(directory)
+    renditions = read_master_playlist(directory / master)
+
+    mpd = ElementTree.Element(
+        "MPD",
+        xmlns="urn:mpeg:dash:schema:mpd:2011",
+        profiles="urn:mpeg:dash:profile:isoff-main:2011",
+        type="static",
+        minBufferTime="PT2S",
+    )
+    period = ElementTree.SubElement(mpd, "Period", id="0", start="PT0S")
+    duration = 0.0
+
+    video = ElementTree.SubElement(
+        period,
+        "AdaptationSet",
+        contentType="video",
+        mimeType="video/mp4",
+        segmentAlignment="true",
+        startWithSAP="1",
+    )
+    for variant in renditions["variants"]:
+        playlist = read_media_playlist(directory / variant["URI"])
+        if playlist["init"] is None:
+            raise ValueError(
+                "{} has no init segment, DASH needs fMP4 segments".format(
+                    variant["URI"]
+                )
+            )
+        width, height = variant["RESOLUTION"].split("x")
+        representation = ElementTree.SubElement(
+            video,
+            "Representation",
+            id=Path(variant["URI"]).stem,
+            # The variant's BANDWIDTH includes its audio, which DASH lists
+            # separately.
+            bandwidth=str(get_peak_bandwidth(directory, playlist)),
+            width=width,
+            height=height,
+            codecs=read_codec(directory / playlist["init"]),
+        )
+        duration = max(duration, add_segment_list(representation, playlist))
+
+    # The audio renditions in each language share an adaptation set, so
+    # players pick a language and then switch between its bitrates.
+    languages = {}
+    for media in renditions["media"]:
+        if media.get("TYPE") != "AUDIO" or "URI" not in media:
+            continue
+        language = media.get("LANGUAGE")
+        if language not in languages:
+            languages[language] = ElementTree.SubElement(
+                period,
+                "AdaptationSet",
+                contentType="audio",
+                mimeType="audio/mp4",
+                segmentAlignment="true",
+                startWithSAP="1",
+            )
+            if language is not None:
+                languages[language].set("lang", language)
+
+        playlist = read_media_playlist(directory / media["URI"])
+        representation = ElementTree.SubElement(
+            languages[language],
+            "Representation",
+            id=media["GROUP-ID"],
+            bandwidth=str(get_peak_bandwidth(directory, playlist)),
+            codecs=read_codec(directory / playlist["init"]),
+        )
+        duration = max(duration, add_segment_list(representation, playlist))
+
+    mpd.set(
+        "mediaPresentationDuration", format_duration(math.ceil(duration * 1000) / 1000)
+    )
+    ElementTree.indent(mpd)
+    ElementTree.ElementTree(mpd).write(
+        directory / output, encoding="utf-8", xml_declaration=True
+    )
+
+
+def read_range(path: Path, byterange: tuple = None) -> bytes:
+    """Read a file, or the inclusive (start, end) byte range of it."""
+
+    with open(path, "rb") as f:
+        if byterange is None:
+            return f.read()
+        f.seek(byterange[0])
+        return f.read(byterange[1] - byterange[0] + 1)
+
+
+def read_pts(data: bytes, position: int) -> int:
+    """Read a PES header's 33 bit presentation timestamp, in 90kHz ticks."""
+
+    pts = data[position : position + 5]
+    return (
+        ((pts[0] >> 1) & 0x07) << 30
+        | pts[1] << 22
+        | (pts[2] >> 1) << 15
+        | pts[3] << 7
+        | pts[4] >> 1
+    )
+
+
+def find_ts_keyframes(data: bytes) -> list:
+    """Find the keyframes in an MPEG-TS segment.
+
+    A keyframe starts with a packet that begins a video PES packet and has
+    the random access indicator set, and runs until the next PES packet on
+    the same PID.
+
+    Returns:
+        list: (offset, length, time) of each keyframe, with the offset and
+            length in bytes, and the time in seconds.
+    """
+
+    keyframes, current, pid = [], None, None
+    for offset in range(0, len(data) - 187, 188):
+        packet = data[offset : offset + 188]
+        if packet[0] != 0x47 or not packet[1] & 0x40:
+            continue
+        packet_pid = ((packet[1] & 0x1F) << 8) | packet[2]
+        if pid is not None and packet_pid != pid:
+            continue
+
+        # Skip the adaptation field, noting its random access indicator.
+        payload = 4
+        random_access = False
+        if packet[3] & 0x20:
+            random_access = packet[4] > 0 and bool(packet[5] & 0x40)
+            payload += 1 + packet[4]
+        pes = packet[payload:]
+        if len(pes) < 14 or pes[:3] != b"\x00\x00\x01" or pes[3] & 0xF0 != 0xE0:
+            continue
+
+        # A new video PES packet ends the keyframe before it.
+        if current is not None:
+            keyframes.append((current[0], offset - current[0], current[1]))
+            current = None
+        if random_access and pes[7] & 0x80:
+            pid = packet_pid
+            current = (offset, read_pts(pes, 9) / 90000)
+
+    if current is not None:
+        keyframes.append((current[0], len(data) - current[0], current[1]))
+    return keyframes
+
+
+def read_timescale(data: bytes) -> int:
+    """Read the track's timescale from an fMP4 init segment's mdhd box."""
+
+    mdhd = find_box(data, ["moov", "trak", "mdia", "mdhd"])
+    if mdhd is None:
+        raise ValueError("no media header in init segment")
+    position = mdhd[0] + (20 if data[mdhd[0]] == 1 else 12)
+    return struct.unpack(">I", data[position : position + 4])[0]
+
+
+def find_fmp4_keyframes(data: bytes, timescale: int) -> list:
+    """Find the keyframes in an fMP4 segment. Only a fragment's first
+    sample is used, as a player needs a fragment's moof box to decode any of
+    its samples.
+
+    Returns:
+        list: (offset, length, time) of each keyframe. Each one runs from the
+            start of its fragment's moof box to the end of the keyframe.
+    """
+
+    keyframes = []
+    for box_type, start, end in iterate_boxes(data):
+        if box_type != "moof":
+            continue
+        moof = start - 8
+        tfhd = find_box(data, ["traf", "tfhd"], start, end)
+        tfdt = find_box(data, ["traf", "tfdt"], start, end)
+        trun = find_box(data, ["traf", "trun"], start, end)
+        if tfhd is None or tfdt is None or trun is None:
+            continue
+
+        # tfhd: flags, then the track ID and optional defaults.
+        flags = struct.unpack(">I", data[tfhd[0] : tfhd[0] + 4])[0] & 0xFFFFFF
+        position = tfhd[0] + 8
+        base = moof
+        if flags & 0x01:
+            base = struct.unpack(">Q", data[position : position + 8])[0]
+            position += 8
+        if flags & 0x02:
+            position += 4
+        if flags & 0x08:
+            position += 4
+        default_size, default_flags = None, 0
+        if flags & 0x10:
+            default_size = struct.unpack(">I", data[position : position + 4])[0]
+            position += 4
+        if flags & 0x20:
+            default_flags = struct.unpack(">I", data[position : position + 4])[0]
+
+        if data[tfdt[0]] == 1:
+            decode_time = struct.unpack(">Q", data[tfdt[0] + 4 : tfdt[0] + 12])[0]
+        else:
+            decode_time = struct.unpack(">I", data[tfdt[0] + 4 : tfdt[0] + 8])[0]
+
+        # trun: flags and sample count, then optional fields and the first
+        # sample's entry.
+        flags = struct.unpack(">I", data[trun[0] : trun[0] + 4])[0] & 0xFFFFFF
+        position = trun[0] + 8
+        data_offset = 0
+        if flags & 0x01:
+            data_offset = struct.unpack(">i", data[position : position + 4])[0]
+            position += 4
+        sample_flags = default_flags
+        if flags & 0x04:
+            sample_flags = struct.unpack(">I", data[position : position + 4])[0]
+            position += 4
+        if flags & 0x100:
+            position += 4
+        sample_size = default_size
+        if flags & 0x200:
+            sample_size = struct.unpack(">I", data[position : position + 4])[0]
+            position += 4
+        if flags & 0x400 and not flags & 0x04:
+            sample_flags = struct.unpack(">I", data[position : position + 4])[0]
+
+        # sample_is_non_sync_sample
+        if sample_size is None or sample_flags & 0x10000:
+            continue
+        sample_end = base + data_offset + sample_size
+        keyframes.append((moof, sample_end - moof, decode_time / timescale))
+    return keyframes
+
+
+def write_iframe_playlist(directory: Path, uri: str, output: str) -> int:
+    """Write an I-frame only playlist for a media playlist, addressing the
+    keyframes in its existing segments by byte range.
+
+    Returns:
+        int: The playlist's peak bitrate, in bits per second.
+    """
+
+    directory = Path(directory)
+    playlist = read_media_playlist(directory / uri)
+    header = ""
+    if playlist["init"] is not None:
+        init = read_range(directory / playlist["init"], playlist["init_range"])
+        timescale = read_timescale(init)
+        header = '#EXT-X-MAP:URI="{}"'.format(playlist["init"])
+        if playlist["init_range"] is not None:
+            header += ',BYTERANGE="{}@{}"'.format(len(init), playlist["init_range"][0])
+        header += "\n"
+
+    # Keyframes as (uri, offset, length, time), with offsets from the start
+    # of their segment's file, and times from the start of the playlist.
+    keyframes, elapsed, first_time = [], 0.0, None
+    for segment in playlist["segments"]:
+        data = read_range(directory / segment["uri"], segment["range"])
+        start = segment["range"][0] if segment["range"] is not None else 0
+        if playlist["init"] is not None:
+            found = find_fmp4_keyframes(data, timescale)
+        else:
+            found = find_ts_keyframes(data)
+            first_pid = ((data[1] & 0x1F) << 8) | data[2] if len(data) > 2 else None
+            if header == "" and len(found) > 0 and first_pid in (0x00, 0x11):
+                # The segment starts with its program tables (SDT, PAT and
+                # PMT), which a player needs before any keyframe.
+                header = '#EXT-X-MAP:URI="{}",BYTERANGE="{}@{}"\n'.format(
+                    segment["uri"], found[0][0], start
+                )
+        for offset, length, time in found:
+            if first_time is None:
+                first_time = time - elapsed
+            keyframes.append(
+                (segment["uri"], start + offset, length, time - first_time)
+            )
+        elapsed += segment["duration"]
+
+    # Each keyframe lasts until the next one, or the end of the playlist.
+    durations = [
+        following[3] - keyframe[3]
+        for keyframe, following in zip(keyframes, keyframes[1:])
+    ]
+    if len(keyframes) > 0:
+        durations.append(max(elapsed - keyframes[-1][3], 0.001))
+
+    # EXT-X-MAP in an I-frame only playlist needs version 5, and fMP4
+    # segments version 6.
+    version = 4
+    if playlist["init"] is not None:
+        version = 7
+    elif header:
+        version = 5
+    contents = "#EXTM3U\n#EXT-X-VERSION:{}\n".format(version)
+    contents += "#EXT-X-TARGETDURATION:{}\n".format(
+        math.ceil(max(durations, default=1))
+    )
+    contents += "#EXT-X-PLAYLIST-TYPE:VOD\n#EXT-X-I-FRAMES-ONLY\n" + header
+    peak = 0
+    for (segment_uri, offset, length, _), duration in zip(keyframes, durations):
+        contents += "#EXTINF:{:.6f},\n#EXT-X-BYTERANGE:{}@{}\n{}\n".format(
+            duration, length, offset, segment_uri
+        )
+        peak = max(peak, length * 8 / max(duration, 0.001))
+    contents += "#EXT-X-ENDLIST\n"
+
+    (directory / output).write_text(contents)
+    return int(peak)
+
+
+def write_iframes(directory: Path, master: str):
+    """Write an I-frame only playlist for each video rendition of an HLS
+    package, and list them in its master playlist, so players can show a
+    frame when scrubbing without downloading whole segments.
+
+    Args:
+        directory (pathlib.Path): The folder holding the HLS package.
+        master (str): The master playlist's filename.
+    """
+
+    directory = Path(directory)
+    renditions = read_master_playlist(directory / master)
+
+    lines = []
+    for variant in renditions["variants"]:
+        uri = "{}_iframes.m3u8".format(Path(variant["URI"]).stem)
+        bandwidth = write_iframe_playlist(directory, variant["URI"], uri)
+        lines.append(
+            '#EXT-X-I-FRAME-STREAM-INF:BANDWIDTH={},RESOLUTION={},URI="{}"'.format(
+                bandwidth, variant["RESOLUTION"], uri
+            )
+        )
+
+    # Replace any I-frame renditions from an earlier run. I-frame playlists
+    # need version 4 of the protocol.
+    contents = []
+    for line in (directory / master).read_text().splitlines():
+        if line.startswith("#EXT-X-I-FRAME-STREAM-INF:") or not line:
+            continue
+        if line.startswith("#EXT-X-VERSION:"):
+            line = "#EXT-X-VERSION:{}".format(max(int(line.split(":")[1]), 4))
+        contents.append(line)
+    (directory / master).write_text("\n".join(contents + lines) + "\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Build streaming manifests from an HLS package."
+    )
+    parser.add_argument("directory")
+    parser.add_argument("--master", default="playlist.m3u8")
+    parser.add_argument("--dash", help="write a DASH manifest with this filename")
+    parser.add_argument(
+        "--iframes",
+        action="store_true",
+        help="write I-frame only playlists and add them to the master playlist",
+    )
+    options = parser.parse_args()
+
+    if options.dash:
+        write_dash(options.directory, options.master, options.dash)
+    if options.iframes:
+        write_iframes(options.directory, options.master)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,228 @@
+import atexit
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from pathlib import Path
+
+# pertitle fits encoder settings to the source, rather than using the same
+# bitrates for every title. A few short sample clips are cut from the source
+# and encoded at several CRF points, in parallel, and the quality of each
+# encode is measured against the source with ffmpeg's ssim or psnr filter.
+# Simple content (cartoons, slides) reaches the target quality at a much
+# lower bitrate than grainy film, so:
+#
+#   - each HLS rendition gets the lowest bitrate that reaches the target
+#     quality (see pick_bitrate), and
+#   - the archive gets the highest (smallest file) CRF that reaches it (see
+#     pick_crf).
+#
+# The analysis runs while the job's commands are planned, as the plugins'
+# commands need its result.
+
+# Where each metric's summary is printed in ffmpeg's log.
+metric_patterns = {
+    "ssim": re.compile(r"SSIM .*All:([0-9.]+)"),
+    "psnr": re.compile(r"PSNR .*average:([0-9.]+|inf)"),
+}
+
+
+def get_sample_times(duration: float, clips: int, clip_length: float) -> list:
+    """Get the start times of sample clips, spread evenly through the source,
+    skipping the very start and end (titles and credits)."""
+
+    if duration <= clip_length:
+        return [0.0]
+    clips = max(min(clips, int(duration // clip_length)), 1)
+    step = (duration - clip_length) / (clips + 1)
+    return [round(step * (i + 1), 3) for i in range(clips)]
+
+
+def to_arguments(options: dict) -> list:
+    """Turn ffmpeg options into a list of command line arguments."""
+
+    arguments = []
+    for key, value in options.items():
+        if value is True:
+            arguments.append("-" + key)
+        elif value is not None and value is not False:
+            arguments += ["-" + key, str(value)]
+    return arguments
+
+
+def run(command: list) -> str:
+    """Run an ffmpeg command, and return its log.
+
+    Raises:
+        RuntimeError: If ffmpeg fails.
+    """
+
+    result = subprocess.run(command, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(
+            "{} failed:\n{}".format(" ".join(command[:4]), result.stderr.strip())
+        )
+    return result.stderr
+
+
+@lru_cache(maxsize=None)
+def get_clips(
+    source: str, stream: int, duration: float, clips: int, clip_length: float
+) -> tuple:
+    """Cut lossless sample clips of a video stream, in parallel. Clips are
+    cut once per process and shared by every plugin that analyzes the same
+    source, and deleted when the process exits.
+
+    Returns:
+        tuple: The paths of the clips.
+    """
+
+    directory = Path(tempfile.mkdtemp(prefix="stirling-pertitle-"))
+    atexit.register(shutil.rmtree, directory, ignore_errors=True)
+
+    def cut(i_start):
+        i, start = i_start
+        path = directory / "clip_{}.mkv".format(i)
+        # Losslessly, so the clips don't add artifacts of their own.
+        run(
+            ["ffmpeg", "-hide_banner", "-y", "-ss", str(start), "-i", str(source)]
+            + ["-t", str(clip_length), "-map", "0:{}".format(stream), "-an"]
+            + ["-c:v", "libx264", "-preset", "ultrafast", "-qp", "0", str(path)]
+        )
+        return path
+
+    times = get_sample_times(duration, clips, clip_length)
+    with ThreadPoolExecutor(max_workers=len(times)) as executor:
+        return tuple(executor.map(cut, enumerate(times)))
+
+
+def measure(
+    clip: Path, encoder_options: dict, width: int, height: int, metric: str
+) -> tuple:
+    """Encode a clip, and measure the encode's quality against the clip
+    scaled the same way.
+
+    Returns:
+        tuple: (bitrate in kilobits per second, quality).
+    """
+
+    scale = "scale=w={}:h={}".format(width, height) if width and height else "null"
+    with tempfile.TemporaryDirectory() as directory:
+        output = Path(directory) / "encode.mkv"
+        run(
+            ["ffmpeg", "-hide_banner", "-y", "-i", str(clip), "-vf", scale]
+            + to_arguments(encoder_options)
+            + [str(output)]
+        )
+        log = run(
+            ["ffmpeg", "-hide_banner", "-i", str(output), "-i", str(clip)]
+            + ["-lavfi", "[1:v]{}[reference];[0:v][reference]{}".format(scale, metric)]
+            + ["-f", "null", "-"]
+        )
+        # The clip's duration, from the encode's frame count and the log.
+        duration = get_duration(log)
+        bitrate = output.stat().st_size * 8 / 1000 / max(duration, 0.001)
+
+    match = metric_patterns[metric].search(log)
+    if match is None:
+        raise RuntimeError("no {} in ffmpeg's output".format(metric))
+    quality = float(match.group(1)) if match.group(1) != "inf" else 100.0
+    return bitrate, quality
+
+
+def get_duration(log: str) -> float:
+    """Get the duration of the first input from an ffmpeg log."""
+
+    match = re.search(r"Duration: (\d+):(\d+):([0-9.]+)", log)
+    if match is None:
+        return 0.0
+    hours, minutes, seconds = match.groups()
+    return int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+
+
+def analyze(
+    clips: tuple,
+    encoder_options: dict,
+    crfs: list,
+    width: int = None,
+    height: int = None,
+    metric: str = "ssim",
+    workers: int = 0,
+) -> list:
+    """Encode every clip at every CRF, in parallel, and measure them.
+
+    Args:
+        clips (tuple): The sample clips, from get_clips.
+        encoder_options (dict): The ffmpeg options for the encoder. Each
+            encode adds its CRF to these.
+        crfs (list[int]): The CRF points to measure.
+        width (int): Scale to this width and height, e.g. for a rendition.
+            None keeps the source's size.
+        height (int): The height to scale to.
+        metric (str): "ssim" or "psnr".
+        workers (int): How many encodes to run at once. 0 uses one per
+            core.
+
+    Returns:
+        list[dict]: The `crf`, mean `bitrate` (in kilobits) and mean
+            `quality` of the clips at each CRF point, in CRF order.
+    """
+
+    if metric not in metric_patterns:
+        raise ValueError(
+            "unknown quality metric {}, expected one of: {}".format(
+                metric, ", ".join(metric_patterns)
+            )
+        )
+
+    tasks = [(crf, clip) for crf in crfs for clip in clips]
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as executor:
+        results = list(
+            executor.map(
+                lambda task: measure(
+                    task[1], encoder_options | {"crf": task[0]}, width, height, metric
+                ),
+                tasks,
+            )
+        )
+
+    points = []
+    for crf in sorted(crfs):
+        measured = [r for (c, _), r in zip(tasks, results) if c == crf]
+        points.append(
+            {
+                "crf": crf,
+                "bitrate": round(sum(r[0] for r in measured) / len(measured), 1),
+                "quality": round(sum(r[1] for r in measured) / len(measured), 4),
+            }
+        )
+    return points
+
+
+def pick_bitrate(points: list, target: float) -> int:
+    """Get the lowest bitrate (in kilobits) that reaches the target quality,
+    interpolating between the measured points. When no point reaches it,
+    the highest bitrate measured is used."""
+
+    points = sorted(points, key=lambda p: p["bitrate"])
+    for lower, upper in zip([None] + points, points):
+        if upper["quality"] < target:
+            continue
+        if lower is None or upper["quality"] == lower["quality"]:
+            return int(upper["bitrate"])
+        ratio = (target - lower["quality"]) / (upper["quality"] - lower["quality"])
+        return int(lower["bitrate"] + ratio * (upper["bitrate"] - lower["bitrate"]))
+    return int(points[-1]["bitrate"])
+
+
+def pick_crf(points: list, target: float) -> int:
+    """Get the highest CRF (the smallest file) that reaches the target
+    quality. When no point reaches it, the lowest CRF measured is used."""
+
+    reached = [p["crf"] for p in points if p["quality"] >= target]
+    if len(reached) > 0:
+        return max(reached)
+    return min(p["crf"] for p in points)
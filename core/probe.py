@@ -62,6 +62,59 @@ class StirlingMediaInfo(definitions.StirlingClass):
         self.preferred["video"] = self.__auto_set_preferred("video")
         self.preferred["audio"] = self.__auto_set_preferred("audio")
 
+    def get_keyframe_interval(
+        self, stream_id: int, windows: int = 10, window: float = 30
+    ) -> float:
+        """Get the longest gap between keyframes in a stream, in seconds.
+
+        Only the packets' flags are read, from the container's index, so
+        nothing is decoded. The gaps are measured in `windows` windows of
+        `window` seconds, spread evenly from the start of the stream to its
+        end, so a change in GOP structure partway through is seen without
+        reading the whole source. Streams shorter than the windows combined
+        are read whole.
+
+        Returns:
+            float: The longest gap. A window with fewer than two keyframes
+                counts as a gap of the whole window.
+        """
+
+        stream = next((s for s in self.video_streams if s.stream == stream_id), None)
+        duration = float(stream.duration or 0) if stream is not None else 0
+        if duration <= windows * window:
+            intervals = [(0, max(duration, window))]
+        else:
+            step = (duration - window) / (windows - 1)
+            intervals = [(round(step * i, 3), window) for i in range(windows)]
+
+        longest = 0
+        for start, length in intervals:
+            options = {
+                "loglevel": "quiet",
+                "select_streams": stream_id,
+                "show_entries": "packet=pts_time,flags",
+                "read_intervals": "{}%+{}".format(start, length),
+                "print_format": "csv=p=0",
+            }
+            cmd = "ffprobe " + args.ffmpeg_unparser.unparse(str(self.source), **options)
+            cmd_output = subprocess.getstatusoutput(cmd)
+            if cmd_output[0] != 0:
+                return length
+
+            keyframes = []
+            for line in cmd_output[1].splitlines():
+                pts_time, _, flags = line.partition(",")
+                if flags.startswith("K"):
+                    try:
+                        keyframes.append(float(pts_time))
+                    except ValueError:
+                        continue
+            keyframes.sort()
+            if len(keyframes) < 2:
+                return length
+            longest = max(longest, max(b - a for a, b in zip(keyframes, keyframes[1:])))
+        return longest
+
     def get_stream(self, type: str, id: int):
         match type:
             case "video":
@@ -124,20 +177,21 @@ class StirlingMediaInfo(definitions.StirlingClass):
 
     def __create_text_stream(self, stream: dict):
         dispositions = []
-        if "dispositions" in stream:
-            for k, v in stream["dispositions"]:
+        if "disposition" in stream:
+            for k, v in stream["disposition"].items():
                 if v == 1:
                     dispositions.append(k)
 
         self.text_streams.append(
             definitions.StreamText(
                 stream=self.__set_default(stream, "index"),
-                duration=float(self.__set_default(stream, "duration")),
+                duration=float(self.__set_default(stream, "duration", 0)),
                 codec=self.__set_default(stream, "codec_name"),
                 start_time=self.__set_default(stream, "start_time"),
                 dispositions=dispositions,
-                language=self.__set_default(stream["tags"], "language", "und"),
-                channel_layout=self.__set_default(stream, "channel_layout"),
+                language=self.__set_default(
+                    self.__set_default(stream, "tags", {}), "language", "und"
+                ),
             )
         )
 
@@ -152,6 +206,9 @@ class StirlingMediaInfo(definitions.StirlingClass):
                 sample_rate=self.__set_default(stream, "sample_rate"),
                 channels=self.__set_default(stream, "channels"),
                 channel_layout=self.__set_default(stream, "channel_layout"),
+                language=self.__set_default(
+                    self.__set_default(stream, "tags", {}), "language", "und"
+                ),
             )
         )
 
@@ -182,3 +239,45 @@ class StirlingMediaInfo(definitions.StirlingClass):
             return obj[key]
         else:
             return default
+
+
+def is_video_compatible(
+    stream: definitions.StreamVideo,
+    codecs: list,
+    profiles: list = None,
+    pixel_formats: list = None,
+    width: int = None,
+    height: int = None,
+) -> bool:
+    """Check whether a video stream can be copied as-is, rather than
+    encoded, into an output that needs one of `codecs`. Profiles and pixel
+    formats are only checked when given, and the stream's dimensions must
+    match exactly when given."""
+
+    if stream.codec not in codecs:
+        return False
+    if profiles is not None and stream.profile not in profiles:
+        return False
+    if pixel_formats is not None and stream.color_model not in pixel_formats:
+        return False
+    if width is not None and int(stream.width) != int(width):
+        return False
+    if height is not None and int(stream.height) != int(height):
+        return False
+    return True
+
+
+def is_audio_compatible(
+    stream: definitions.StreamAudio, codecs: list, max_bitrate: int = None
+) -> bool:
+    """Check whether an audio stream can be copied as-is into an output that
+    needs one of `codecs`, at no more than `max_bitrate` bits per second."""
+
+    if stream.codec not in codecs:
+        return False
+    if max_bitrate is not None:
+        try:
+            return 0 < int(stream.bitrate) <= max_bitrate
+        except (TypeError, ValueError):
+            return False
+    return True
@@ -1,7 +1,7 @@
-import torch
-
-
 def pytorch_get_device():
+    # Imported here, so importing this module doesn't load PyTorch.
+    import torch
+
     if torch.backends.mps.is_available():
         return torch.device("mps")
     elif torch.cuda.is_available():
@@ -0,0 +1,253 @@
+import argparse
+import json
+import subprocess
+import time
+
+import numpy
+
+from core import annotations
+
+# scenes holds the scene cut and black frame analysis used by the scenes
+# plugin. ffmpeg decodes the video, downscales each frame to a small grayscale
+# image and streams the raw pixels to us, and each chunk of frames is analyzed
+# at once with NumPy: the mean luma, the share of dark pixels, and how much
+# each frame's luma histogram differs from the frame before it. Decoding
+# dominates the cost, so this runs many times faster than real time on a CPU.
+# The analysis is run as its own command by the scenes plugin:
+#
+#   python -m core.scenes --output scenes.json --rate 10 source.mp4
+
+# The size of the downscaled frames. The aspect ratio doesn't matter for
+# luma statistics, so every frame is squashed to the same size.
+width = 64
+height = 36
+bins = 32
+
+
+def read_chunks(source: str, stream: int, rate: float, chunk_frames: int):
+    """Decode a video stream into chunks of downscaled grayscale frames.
+
+    Yields:
+        numpy.ndarray: uint8 arrays of shape (N, height * width), with up to
+            `chunk_frames` frames each.
+    """
+
+    command = [
+        "ffmpeg",
+        "-hide_banner",
+        "-loglevel",
+        "error",
+        "-i",
+        source,
+        "-map",
+        "0:{}".format(stream),
+        "-vf",
+        "fps={},scale={}:{}:flags=area,format=gray".format(rate, width, height),
+        "-f",
+        "rawvideo",
+        "-",
+    ]
+    frame_size = width * height
+    process = subprocess.Popen(command, stdout=subprocess.PIPE)
+    try:
+        while True:
+            data = process.stdout.read(frame_size * chunk_frames)
+            count = len(data) // frame_size
+            if count == 0:
+                break
+            yield numpy.frombuffer(
+                data[: count * frame_size], dtype=numpy.uint8
+            ).reshape(count, frame_size)
+    finally:
+        process.stdout.close()
+        if process.wait() != 0:
+            raise RuntimeError("ffmpeg failed to decode {}".format(source))
+
+
+def analyze_chunk(frames: numpy.ndarray, previous: numpy.ndarray, black_pixel: int):
+    """Get the statistics for a chunk of frames.
+
+    Args:
+        frames (numpy.ndarray): A (N, pixels) uint8 array of frames.
+        previous (numpy.ndarray): The histogram of the frame before the
+            chunk, or None at the start of the video.
+        black_pixel (int): Pixels darker than this (0-255) count as black.
+
+    Returns:
+        tuple: (luma, dark, diff, last histogram). luma is the mean luma of
+            each frame (0.0-1.0), dark the share of its pixels that are
+            black, and diff half the L1 distance between its normalized
+            histogram and the previous frame's (0.0-1.0).
+    """
+
+    count, pixels = frames.shape
+    luma = frames.mean(axis=1) / 255
+    dark = (frames < black_pixel).mean(axis=1)
+
+    # Offset each frame's bins so one bincount builds every histogram.
+    offsets = (numpy.arange(count, dtype=numpy.int64) * bins)[:, None]
+    hists = (
+        numpy.bincount(
+            ((frames >> 3) + offsets).ravel(), minlength=count * bins
+        ).reshape(count, bins)
+        / pixels
+    )
+
+    if previous is None:
+        previous = hists[:1]
+    diff = numpy.abs(numpy.diff(numpy.concatenate([previous, hists]), axis=0))
+    return luma, dark, diff.sum(axis=1) / 2, hists[-1:]
+
+
+def find_runs(mask: numpy.ndarray) -> list:
+    """Get the (start, end) frame ranges where a boolean mask is set. end is
+    exclusive."""
+
+    edges = numpy.diff(numpy.concatenate([[0], mask.astype(numpy.int8), [0]]))
+    return list(zip(numpy.flatnonzero(edges == 1), numpy.flatnonzero(edges == -1)))
+
+
+def detect(
+    source: str,
+    stream: int = 0,
+    rate: float = 10.0,
+    scene_threshold: float = 0.4,
+    min_scene_length: float = 0.5,
+    black_pixel: float = 0.1,
+    black_ratio: float = 0.98,
+    min_black_length: float = 0.5,
+    chunk_frames: int = 1024,
+) -> dict:
+    """Find the scene cuts and black segments in a video.
+
+    Args:
+        source (str): The video file.
+        stream (int): The index of the video stream in the file.
+        rate (float): The number of frames per second to analyze.
+        scene_threshold (float): How different (0.0-1.0) a frame's luma
+            histogram must be from the previous frame's to be a cut.
+        min_scene_length (float): Cuts closer together than this (in
+            seconds) are merged, keeping the strongest.
+        black_pixel (float): Pixels darker than this (0.0-1.0) are black.
+        black_ratio (float): The share of a frame's pixels that must be
+            black for the frame to be black.
+        min_black_length (float): The shortest black segment to report, in
+            seconds.
+        chunk_frames (int): The number of frames to analyze at once.
+
+    Returns:
+        dict: The cuts, scenes and black segments, with times in seconds.
+    """
+
+    time_start = time.perf_counter()
+    luma, dark, diff = [], [], []
+    previous = None
+    for frames in read_chunks(source, stream, rate, chunk_frames):
+        chunk_luma, chunk_dark, chunk_diff, previous = analyze_chunk(
+            frames, previous, int(black_pixel * 255)
+        )
+        luma.append(chunk_luma)
+        dark.append(chunk_dark)
+        diff.append(chunk_diff)
+
+    if len(luma) == 0:
+        return {"rate": rate, "frames": 0, "cuts": [], "scenes": [], "black": []}
+
+    luma, dark, diff = map(numpy.concatenate, (luma, dark, diff))
+    count = len(luma)
+    black = dark >= black_ratio
+
+    # A cut between two black frames is noise in the dark, not a new scene.
+    candidates = numpy.flatnonzero(diff > scene_threshold)
+    candidates = candidates[~(black[candidates] & black[candidates - 1])]
+
+    cuts = []
+    min_gap = max(int(round(min_scene_length * rate)), 1)
+    for frame in candidates:
+        if len(cuts) > 0 and frame - cuts[-1] < min_gap:
+            if diff[frame] > diff[cuts[-1]]:
+                cuts[-1] = frame
+            continue
+        cuts.append(frame)
+
+    bounds = [0] + cuts + [count]
+    scenes = [
+        {
+            "start": bounds[i] / rate,
+            "end": bounds[i + 1] / rate,
+            "confidence": 1.0 if i == 0 else float(diff[bounds[i]]),
+        }
+        for i in range(len(bounds) - 1)
+    ]
+
+    min_black = max(int(round(min_black_length * rate)), 1)
+    black_segments = [
+        {
+            "start": start / rate,
+            "end": end / rate,
+            "confidence": float(dark[start:end].mean()),
+            "luma": float(luma[start:end].mean()),
+        }
+        for start, end in find_runs(black)
+        if end - start >= min_black
+    ]
+
+    duration = time.perf_counter() - time_start
+    print(
+        "Analyzed {} frames ({:.1f}s of video) in {:.2f}s ({:.0f}x real time).".format(
+            count, count / rate, duration, count / rate / max(duration, 1e-9)
+        )
+    )
+
+    return {
+        "rate": rate,
+        "frames": count,
+        "cuts": [
+            {"time": frame / rate, "confidence": float(diff[frame])} for frame in cuts
+        ],
+        "scenes": scenes,
+        "black": black_segments,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Scene cut and black detection.")
+    parser.add_argument("source")
+    parser.add_argument("--output", required=True)
+    parser.add_argument("--stream", type=int, default=0)
+    parser.add_argument("--rate", type=float, default=10.0)
+    parser.add_argument("--scene-threshold", type=float, default=0.4)
+    parser.add_argument("--min-scene-length", type=float, default=0.5)
+    parser.add_argument("--black-pixel", type=float, default=0.1)
+    parser.add_argument("--black-ratio", type=float, default=0.98)
+    parser.add_argument("--min-black-length", type=float, default=0.5)
+    parser.add_argument("--chunk-frames", type=int, default=1024)
+    options = parser.parse_args()
+
+    result = detect(
+        options.source,
+        stream=options.stream,
+        rate=options.rate,
+        scene_threshold=options.scene_threshold,
+        min_scene_length=options.min_scene_length,
+        black_pixel=options.black_pixel,
+        black_ratio=options.black_ratio,
+        min_black_length=options.min_black_length,
+        chunk_frames=options.chunk_frames,
+    )
+
+    records = [
+        {**scene, "label": "scene", "score": scene["confidence"]}
+        for scene in result["scenes"]
+    ] + [
+        {**segment, "label": "black", "score": segment["confidence"]}
+        for segment in result["black"]
+    ]
+    annotations.write_records(annotations.get_columns_path(options.output), records)
+
+    with open(options.output, "w") as output_file:
+        json.dump(result, output_file)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+import json
+import os
+import tempfile
+import threading
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+
+# tracing records how long each phase of a job takes, as nested spans, and
+# writes them in Chrome's trace event format, which Perfetto
+# (https://ui.perfetto.dev) and chrome://tracing display as a timeline:
+#
+#   with job.span("probe"):
+#       ...
+#
+# Spans opened inside another span (on the same thread) are shown nested in
+# it, and spans on other threads are shown on their own tracks, so phases
+# that overlap are visible. When tracing is disabled, span() returns a shared
+# span that does nothing, so instrumented code costs a method call.
+
+
+class StirlingSpan(object):
+    """A span being timed. Use it as a context manager; the span is recorded
+    when it exits."""
+
+    __slots__ = ("tracer", "name", "category", "args", "start")
+
+    def __init__(self, tracer, name: str, category: str, args: dict):
+        self.tracer = tracer
+        self.name = name
+        self.category = category
+        self.args = args
+        self.start = 0
+
+    def set(self, **args):
+        """Add arguments to the span, e.g. results only known at its end."""
+
+        self.args.update(args)
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        end = time.perf_counter_ns()
+        if exc_type is not None:
+            self.args["error"] = exc_type.__name__
+        self.tracer.events.append(
+            {
+                "name": self.name,
+                "cat": self.category,
+                "ph": "X",
+                "ts": (self.start - self.tracer.origin) / 1000,
+                "dur": (end - self.start) / 1000,
+                "pid": os.getpid(),
+                "tid": threading.get_ident(),
+                "args": self.args,
+            }
+        )
+        return False
+
+
+class StirlingNullSpan(object):
+    """A span that records nothing, used when tracing is disabled."""
+
+    __slots__ = ()
+
+    def set(self, **args):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+null_span = StirlingNullSpan()
+
+
+@dataclass
+class StirlingTracer(object):
+    """Records spans, and writes them as a Chrome trace.
+
+    Attributes:
+        enabled (bool): Record spans. When False, span() does nothing.
+        name (str): The name of the trace's process, shown in the viewer.
+        events (list[dict]): The trace events recorded so far.
+        origin (int): The time the trace started, from
+            time.perf_counter_ns(). Event times are relative to it.
+    """
+
+    # Record spans
+    enabled: bool = False
+    # The name shown for the trace's process
+    name: str = "stirling"
+    # The recorded trace events
+    events: list = field(default_factory=list)
+    # When the trace started, in nanoseconds
+    origin: int = field(default_factory=time.perf_counter_ns)
+
+    def span(self, name: str, category: str = "job", **args):
+        """Time a block of code.
+
+        Args:
+            name (str): The name of the span.
+            category (str): The span's category, which the viewer can filter
+                by.
+            **args: Details shown with the span in the viewer.
+
+        Returns:
+            StirlingSpan: A context manager, which records the span when it
+                exits.
+        """
+
+        if not self.enabled:
+            return null_span
+        return StirlingSpan(self, name, category, args)
+
+    def write(self, path: Path):
+        """Write the trace to a JSON file, replacing it if it exists."""
+
+        if not self.enabled:
+            return
+        pid = os.getpid()
+        metadata = [
+            {
+                "name": "process_name",
+                "ph": "M",
+                "pid": pid,
+                "args": {"name": self.name},
+            }
+        ]
+        for tid in dict.fromkeys(event["tid"] for event in self.events):
+            thread_name = "main" if tid == threading.main_thread().ident else tid
+            metadata.append(
+                {
+                    "name": "thread_name",
+                    "ph": "M",
+                    "pid": pid,
+                    "tid": tid,
+                    "args": {"name": str(thread_name)},
+                }
+            )
+
+        # Written to a temporary file first, so a viewer never reads a
+        # partial trace.
+        handle, temp = tempfile.mkstemp(
+            dir=os.path.dirname(os.path.abspath(path)), suffix=".tmp"
+        )
+        with os.fdopen(handle, "w") as f:
+            json.dump(
+                {
+                    "traceEvents": metadata + list(self.events),
+                    "displayTimeUnit": "ms",
+                },
+                f,
+            )
+        os.replace(temp, path)
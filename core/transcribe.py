@@ -0,0 +1,481 @@
+import argparse
+import importlib
+import inspect
+import json
+import subprocess
+import zlib
+from abc import ABC, abstractmethod
+from concurrent import futures
+from dataclasses import asdict, dataclass, replace
+from functools import lru_cache
+from pathlib import Path
+from typing import List
+
+import numpy
+
+from core import annotations
+from core.cache import StirlingCache
+
+# transcribe holds the chunked transcription pipeline. Rather than sending a
+# whole audio file to a speech recogniser, we detect where speech occurs, cut
+# the audio into speech-only chunks and transcribe the chunks in parallel. The
+# pipeline is run as its own command by the transcript plugin:
+#
+#   python -m core.transcribe --backend fake --output transcript.json source.wav
+
+# The sample rate that audio is decoded to before detecting speech. 16kHz mono
+# is what most speech recognisers expect, and keeps an hour of audio to about
+# 115MB of PCM.
+sample_rate = 16000
+
+
+@dataclass
+class StirlingTranscriptChunk:
+    """A span of speech in the decoded audio, in samples."""
+
+    start: int
+    end: int
+
+
+@dataclass
+class StirlingTranscriptSegment:
+    """A piece of transcribed text. Times are in seconds, relative to the
+    start of whatever audio was passed to the backend."""
+
+    start: float
+    end: float
+    content: str
+    confidence: float = None
+
+
+class StirlingASRBackend(ABC):
+    """StirlingASRBackend is the base class for speech recognition backends.
+
+    A backend receives a chunk of mono 16kHz audio as float32 samples in the
+    range -1.0 to 1.0, and returns a list of segments with times relative to
+    the start of the chunk. Backends are created once per worker, so any
+    expensive setup (loading a model, opening a session) belongs in
+    `__init__`.
+
+    Results are cached by the content of each chunk and the backend's name
+    and version, so bump `version` whenever a change to the backend would
+    change its output.
+    """
+
+    name: str = ""
+    version: str = "1"
+
+    @abstractmethod
+    def transcribe(
+        self, samples: numpy.ndarray, language: str
+    ) -> List[StirlingTranscriptSegment]:
+        pass
+
+
+class StirlingASRBackendFake(StirlingASRBackend):
+    """A deterministic, local backend for testing the pipeline. It returns a
+    single segment per chunk, with text derived from a checksum of the
+    samples, so the same audio always gives the same transcript."""
+
+    name: str = "fake"
+
+    def transcribe(
+        self, samples: numpy.ndarray, language: str
+    ) -> List[StirlingTranscriptSegment]:
+        duration = len(samples) / sample_rate
+        checksum = zlib.crc32(samples.tobytes())
+        return [
+            StirlingTranscriptSegment(
+                start=0.0,
+                end=duration,
+                content="[{}] speech {:.2f}s {:08x}".format(
+                    language, duration, checksum
+                ),
+                confidence=1.0,
+            )
+        ]
+
+
+# The backends available by name. Other backends can be registered with
+# register_backend(), or passed as an import path such as
+# "mypackage.asr:MyBackend".
+backends: dict = {
+    StirlingASRBackendFake.name: StirlingASRBackendFake,
+}
+
+
+def register_backend(backend: type):
+    """Register a backend class by its name.
+
+    Raises:
+        TypeError: If the backend doesn't implement transcribe().
+    """
+
+    if inspect.isabstract(backend):
+        raise TypeError(
+            "Speech recognition backend {} doesn't implement: {}".format(
+                backend.__name__, ", ".join(sorted(backend.__abstractmethods__))
+            )
+        )
+    backends[backend.name] = backend
+
+
+def get_backend_class(name: str) -> type:
+    if name in backends:
+        return backends[name]
+
+    if ":" in name:
+        module_name, class_name = name.split(":", 1)
+        return getattr(importlib.import_module(module_name), class_name)
+
+    raise ValueError("Unknown speech recognition backend: {}".format(name))
+
+
+@lru_cache(maxsize=None)
+def get_backend(name: str) -> StirlingASRBackend:
+    """Get an instance of a backend by name. Instances are cached, so each
+    worker thread or process only sets up a backend once."""
+
+    return get_backend_class(name)()
+
+
+def load_audio(source: str) -> numpy.ndarray:
+    """Decode the first audio stream of a file to mono 16-bit PCM at our
+    sample rate."""
+
+    cmd = [
+        "ffmpeg",
+        "-hide_banner",
+        "-loglevel",
+        "error",
+        "-i",
+        str(source),
+        "-map",
+        "0:a:0",
+        "-ac",
+        "1",
+        "-ar",
+        str(sample_rate),
+        "-f",
+        "s16le",
+        "-",
+    ]
+    output = subprocess.run(cmd, capture_output=True, check=True)
+    return numpy.frombuffer(output.stdout, dtype=numpy.int16)
+
+
+def frame_energy(samples: numpy.ndarray, frame_length: int) -> numpy.ndarray:
+    """Get the energy of each frame of audio, in decibels relative to full
+    scale. Frames are converted in blocks, so we never hold a float copy of
+    the whole file."""
+
+    frame_count = len(samples) // frame_length
+    frames = samples[: frame_count * frame_length].reshape(frame_count, frame_length)
+    energy = numpy.empty(frame_count, dtype=numpy.float32)
+
+    block = 8192
+    for i in range(0, frame_count, block):
+        f = frames[i : i + block].astype(numpy.float32) / 32768.0
+        energy[i : i + block] = numpy.einsum("ij,ij->i", f, f) / frame_length
+
+    return 10 * numpy.log10(energy + 1e-10)
+
+
+def detect_speech(
+    samples: numpy.ndarray,
+    frame_duration: float = 0.03,
+    threshold: float = 12.0,
+    floor: float = -55.0,
+    min_silence: float = 0.5,
+    min_speech: float = 0.25,
+    padding: float = 0.2,
+    max_chunk: float = 30.0,
+) -> List[StirlingTranscriptChunk]:
+    """Find the spans of speech in the audio.
+
+    A frame is voiced when its energy is more than `threshold` decibels over
+    the noise floor (the 10th percentile of frame energy), and above the
+    absolute `floor` (in dBFS). Voiced frames separated by less than
+    `min_silence` seconds are joined, runs shorter than `min_speech` seconds
+    are dropped, and each run is padded by `padding` seconds. Runs longer than `max_chunk`
+    seconds are split at their quietest frame, so no chunk is too long for a
+    backend.
+
+    Args:
+        samples (numpy.ndarray): Mono 16-bit PCM at our sample rate.
+
+    Returns:
+        list[StirlingTranscriptChunk]: The speech chunks, in order.
+    """
+
+    frame_length = int(sample_rate * frame_duration)
+    energy = frame_energy(samples, frame_length)
+    if len(energy) == 0:
+        return []
+
+    # When most of the audio is speech, the 10th percentile is speech rather
+    # than silence, so never ask for more than `threshold` under the loud end.
+    noise, loud = numpy.percentile(energy, [10, 95])
+    voiced = energy > max(min(noise + threshold, loud - threshold), floor)
+
+    # Find where each voiced run starts and ends.
+    edges = numpy.diff(numpy.concatenate(([0], voiced.astype(numpy.int8), [0])))
+    starts = numpy.flatnonzero(edges == 1)
+    ends = numpy.flatnonzero(edges == -1)
+    if len(starts) == 0:
+        return []
+
+    # Join runs separated by short silences.
+    keep = (starts[1:] - ends[:-1]) >= int(min_silence / frame_duration)
+    starts = starts[numpy.concatenate(([True], keep))]
+    ends = ends[numpy.concatenate((keep, [True]))]
+
+    # Drop short runs, and pad the rest.
+    long_enough = (ends - starts) >= int(min_speech / frame_duration)
+    pad = int(padding / frame_duration)
+    starts = numpy.maximum(starts[long_enough] - pad, 0)
+    ends = numpy.minimum(ends[long_enough] + pad, len(energy))
+
+    chunks = []
+    max_frames = int(max_chunk / frame_duration)
+    for start, end in zip(starts.tolist(), ends.tolist()):
+        # Split long runs at the quietest frame in the last quarter of each
+        # window.
+        while end - start > max_frames:
+            window_start = start + max_frames * 3 // 4
+            split = window_start + int(
+                numpy.argmin(energy[window_start : start + max_frames])
+            )
+            chunks.append(StirlingTranscriptChunk(start=start, end=split))
+            start = split
+        chunks.append(StirlingTranscriptChunk(start=start, end=end))
+
+    for chunk in chunks:
+        chunk.start *= frame_length
+        chunk.end = min(chunk.end * frame_length, len(samples))
+
+    return chunks
+
+
+def transcribe_chunk(
+    backend: str, samples: numpy.ndarray, language: str
+) -> List[StirlingTranscriptSegment]:
+    return get_backend(backend).transcribe(
+        samples.astype(numpy.float32) / 32768.0, language
+    )
+
+
+def transcribe(
+    samples: numpy.ndarray,
+    chunks: List[StirlingTranscriptChunk],
+    backend: str,
+    language: str,
+    workers: int = 4,
+    executor: str = "thread",
+    cache: StirlingCache = None,
+) -> tuple:
+    """Transcribe each chunk on a pool of workers, and merge the results into
+    a single transcript with times relative to the start of the audio.
+
+    When a cache is given, each chunk is looked up by a hash of its PCM and
+    the transcription settings first, and only the chunks that miss are sent
+    to the backend. Chunks with the same audio (a repeated jingle) are sent
+    once, and the result is placed at each of them.
+
+    Returns:
+        tuple: (list[StirlingTranscriptSegment], dict) The segments, in
+            order, and counts of the `chunks`, how many were found in the
+            `cached`, and how many were `transcribed` by the backend.
+    """
+
+    settings = {
+        "backend": backend,
+        "version": get_backend_class(backend).version,
+        "language": language,
+        "sample_rate": sample_rate,
+    }
+
+    segments = []
+    # The chunks to transcribe, as {key: [chunks with that audio]}.
+    pending = {}
+    for chunk in chunks:
+        key = id(chunk)
+        if cache is not None:
+            key = cache.key(samples[chunk.start : chunk.end].tobytes(), settings)
+            cached = cache.get(key)
+            if cached is not None:
+                segments.extend(
+                    offset_segments(
+                        [StirlingTranscriptSegment(**s) for s in cached], chunk
+                    )
+                )
+                continue
+        pending.setdefault(key, []).append(chunk)
+
+    counts = {
+        "chunks": len(chunks),
+        "cached": len(chunks) - sum(len(c) for c in pending.values()),
+        "transcribed": len(pending),
+    }
+
+    match executor:
+        case "thread":
+            pool = futures.ThreadPoolExecutor(max_workers=workers)
+        case "process":
+            pool = futures.ProcessPoolExecutor(max_workers=workers)
+        case _:
+            raise ValueError("Invalid executor: {}".format(executor))
+
+    with pool:
+        jobs = {
+            pool.submit(
+                transcribe_chunk,
+                backend,
+                samples[same[0].start : same[0].end],
+                language,
+            ): key
+            for key, same in pending.items()
+        }
+
+        for job in futures.as_completed(jobs):
+            key = jobs[job]
+            result = job.result()
+            if cache is not None:
+                cache.put(key, [asdict(s) for s in result])
+            for chunk in pending[key]:
+                segments.extend(offset_segments([replace(s) for s in result], chunk))
+
+    segments.sort(key=lambda x: x.start)
+    return segments, counts
+
+
+def get_stats_path(output: str) -> Path:
+    """Get the path of the statistics file written next to a transcript,
+    e.g. transcript.stats.json for transcript.json."""
+
+    return Path(output).with_suffix(".stats.json")
+
+
+def offset_segments(
+    segments: List[StirlingTranscriptSegment], chunk: StirlingTranscriptChunk
+) -> List[StirlingTranscriptSegment]:
+    """Move segments from chunk time to the time of the whole audio."""
+
+    offset = chunk.start / sample_rate
+    for segment in segments:
+        segment.start += offset
+        segment.end += offset
+    return segments
+
+
+def format_timestamp(seconds: float, separator: str = ".") -> str:
+    milliseconds = int(round(seconds * 1000))
+    hours, milliseconds = divmod(milliseconds, 3600000)
+    minutes, milliseconds = divmod(milliseconds, 60000)
+    seconds, milliseconds = divmod(milliseconds, 1000)
+    return "{:02d}:{:02d}:{:02d}{}{:03d}".format(
+        hours, minutes, seconds, separator, milliseconds
+    )
+
+
+def write(segments: List[StirlingTranscriptSegment], output: str, format: str):
+    """Write the transcript as JSON (the same shape autosub writes), SRT or
+    WebVTT."""
+
+    with open(output, "w") as output_file:
+        match format:
+            case "json":
+                json.dump([asdict(s) for s in segments], output_file, indent=4)
+            case "srt":
+                for i, s in enumerate(segments, start=1):
+                    output_file.write(
+                        "{}\n{} --> {}\n{}\n\n".format(
+                            i,
+                            format_timestamp(s.start, ","),
+                            format_timestamp(s.end, ","),
+                            s.content,
+                        )
+                    )
+            case "vtt":
+                output_file.write("WEBVTT\n\n")
+                for s in segments:
+                    output_file.write(
+                        "{} --> {}\n{}\n\n".format(
+                            format_timestamp(s.start),
+                            format_timestamp(s.end),
+                            s.content,
+                        )
+                    )
+            case _:
+                raise ValueError("Invalid transcript format: {}".format(format))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Chunked parallel transcription.")
+    parser.add_argument("input")
+    parser.add_argument("--output", required=True)
+    parser.add_argument("--format", default="json")
+    parser.add_argument("--backend", default="fake")
+    parser.add_argument("--language", default="en")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--executor", default="thread")
+    parser.add_argument("--threshold", type=float, default=12.0)
+    parser.add_argument("--min-silence", type=float, default=0.5)
+    parser.add_argument("--max-chunk", type=float, default=30.0)
+    parser.add_argument("--cache-directory")
+    parser.add_argument("--cache-size", type=int, default=1024)
+    options = parser.parse_args()
+
+    samples = load_audio(options.input)
+    chunks = detect_speech(
+        samples,
+        threshold=options.threshold,
+        min_silence=options.min_silence,
+        max_chunk=options.max_chunk,
+    )
+    segments, counts = transcribe(
+        samples,
+        chunks,
+        options.backend,
+        options.language,
+        workers=options.workers,
+        executor=options.executor,
+        cache=(
+            StirlingCache(
+                directory=options.cache_directory,
+                size_max=options.cache_size * 1024 * 1024,
+            )
+            if options.cache_directory
+            else None
+        ),
+    )
+    write(segments, options.output, options.format)
+
+    # The chunk and cache counts, for the transcript plugin to log.
+    speech = sum(chunk.end - chunk.start for chunk in chunks)
+    with open(get_stats_path(options.output), "w") as f:
+        json.dump(
+            counts
+            | {
+                "speech": round(speech / sample_rate, 3),
+                "duration": round(len(samples) / sample_rate, 3),
+            },
+            f,
+            indent=4,
+        )
+    annotations.write_records(
+        annotations.get_columns_path(options.output),
+        [
+            {
+                "start": s.start,
+                "end": s.end,
+                "label": s.content,
+                "score": numpy.nan if s.confidence is None else s.confidence,
+            }
+            for s in segments
+        ],
+    )
+
+
+if __name__ == "__main__":
+    main()
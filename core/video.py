@@ -1,7 +1,7 @@
 from dataclasses import dataclass, field
 from typing import List
 
-from core import args, definitions, encoders, helpers, jobs
+from core import args, capabilities, definitions, encoders, helpers, jobs, probe
 
 required_binaries = ["ffmpeg"]
 
@@ -34,6 +34,51 @@ class StirlingPluginVideo(definitions.StirlingPlugin):
     video_rtp_hints: bool = False
     video_copy_all_streams: bool = False
     video_encoder_options: dict = field(default_factory=dict)
+    # Copy the source's video stream into the archive as-is, rather than
+    # encoding it, when it is already in the archive's codec and its
+    # keyframes are at least as close together as video_keyframe_interval.
+    # Remuxing takes seconds, where an encode takes about as long as the
+    # source. Setting any encoder options also disables copying.
+    video_copy_disable: bool = False
+
+    # The encoder preset for H.264 and other non-AV1 formats (e.g. "medium").
+    # Empty uses the encoder's default.
+    video_preset: str = ""
+
+    # The AV1 encoder to use when video_codec_format is "av1": "svt"
+    # (SVT-AV1, much faster at similar quality) or "aom" (libaom, the
+    # reference encoder). Defaults to the fastest one ffmpeg supports.
+    video_av1_encoder: str = ""
+    # The AV1 preset: SVT-AV1's preset (0-13) or aom's cpu-used (0-8).
+    # Lower numbers are slower, but smaller at the same quality.
+    video_av1_preset: int = 6
+    # The AV1 Constant Rate Factor. Lower numbers are better quality, but
+    # larger files.
+    video_av1_crf: int = 24
+    # The number of AV1 tile rows and columns, as log2 values (e.g. 1 for 2
+    # columns). Tiles are encoded in parallel, at a small cost in quality.
+    video_av1_tile_rows: int = 0
+    video_av1_tile_columns: int = 0
+    # The number of frames the AV1 encoder looks ahead. -1 uses the encoder's
+    # default.
+    video_av1_lookahead: int = -1
+    # The number of threads the encoder may use. 0 uses every core.
+    video_threads: int = 0
+
+    # Pick the archive's CRF for the source (per-title encoding): sample
+    # clips are encoded at several CRF points with the archive's encoder and
+    # measured, and the highest CRF that reaches the target quality is used
+    # (see core.pertitle). Adds the analysis time to planning.
+    video_pertitle: bool = False
+    # The quality metric to target: "ssim" (0.0-1.0) or "psnr" (in dB).
+    video_pertitle_metric: str = "ssim"
+    # The quality the archive should reach.
+    video_pertitle_target: float = 0.985
+    # The CRF points to measure. Defaults to a range suited to the codec.
+    video_pertitle_crfs: list = field(default_factory=list)
+    # The number and length (in seconds) of the sample clips.
+    video_pertitle_clips: int = 3
+    video_pertitle_clip_length: float = 4
 
     # Contains outputs from the plugin for use in other plugins.
     assets: List[definitions.StirlingPluginAssets] = field(default_factory=list)
@@ -45,18 +90,123 @@ class StirlingPluginVideo(definitions.StirlingPlugin):
                 required_binaries
             ), AssertionError("Missing required binaries: {}".format(required_binaries))
 
-    def get_encoder(self, job: jobs.StirlingJob, format: str, encoder: str):
-        match format:
-            case "av1":
-                stream = job.media_info.get_preferred_stream("video")
-                keyframe_interval = stream.frame_rate * self.video_keyframe_interval
-                self.video_encoder_options = (
-                    encoders.StirlingVideoEncoderAV1().get_encoder_options("aom")
-                )
-                self.video_encoder_options["g"] = self.video_encoder_options[
-                    "keyint_min"
-                ] = keyframe_interval
-                return definitions.EncoderOptionsAV1
+    def get_encoder(self, job: jobs.StirlingJob, format: str) -> dict:
+        """Get the encoder options for a format, using the fastest encoder
+        for it that the local ffmpeg supports.
+
+        Raises:
+            ValueError: If ffmpeg has no encoder for the format.
+        """
+
+        stream = job.media_info.get_preferred_stream("video")
+        if format == "av1":
+            return self.get_av1_encoder(stream)
+
+        encoder = capabilities.best_encoder(format)
+        if encoder is None:
+            raise ValueError("ffmpeg has no encoder for {}".format(format))
+
+        keyframe_interval = max(
+            round(stream.frame_rate * self.video_keyframe_interval), 1
+        )
+        options = {
+            "c:v": encoder,
+            "g": keyframe_interval,
+            "keyint_min": keyframe_interval,
+        }
+        if self.video_preset:
+            options["preset"] = self.video_preset
+        if self.video_threads > 0:
+            options["threads"] = self.video_threads
+        return options | self.video_encoder_options
+
+    def get_av1_encoder(self, stream: definitions.StreamVideo) -> dict:
+        """Get the options for an AV1 encode, with the encoder chosen by
+        video_av1_encoder or, by default, the fastest one ffmpeg supports.
+
+        Raises:
+            ValueError: If ffmpeg doesn't support the chosen AV1 encoder.
+        """
+
+        libraries = {"svt": "libsvtav1", "aom": "libaom-av1"}
+        encoder = self.video_av1_encoder
+        if encoder == "":
+            best = capabilities.best_encoder("av1")
+            encoder = next((k for k, v in libraries.items() if v == best), None)
+        if encoder not in libraries or not capabilities.has_encoder(libraries[encoder]):
+            raise ValueError(
+                "ffmpeg has no AV1 encoder for {}".format(encoder or "av1")
+            )
+
+        av1 = encoders.StirlingVideoEncoderAV1(
+            encoder_fps=stream.frame_rate,
+            encoder_keyframe_interval=self.video_keyframe_interval,
+            encoder_quality_level=self.video_av1_crf,
+            encoder_quality_profile=str(self.video_av1_preset),
+            encoder_tile_rows=self.video_av1_tile_rows,
+            encoder_tile_columns=self.video_av1_tile_columns,
+            encoder_lookahead=self.video_av1_lookahead,
+            encoder_threads=self.video_threads,
+        )
+        return av1.get(encoder, self.video_encoder_options)
+
+    def fit_crf(self, job: jobs.StirlingJob, encoder_options: dict) -> int:
+        """Get the highest CRF that reaches the target quality on sample
+        clips of the source, and record the measurements in the job's plugin
+        metadata."""
+
+        from core import pertitle
+
+        stream = job.media_info.get_preferred_stream("video")
+        clips = pertitle.get_clips(
+            str(job.media_info.source),
+            stream.stream,
+            float(stream.duration),
+            self.video_pertitle_clips,
+            self.video_pertitle_clip_length,
+        )
+        crfs = self.video_pertitle_crfs
+        if len(crfs) == 0:
+            crfs = (
+                [20, 26, 32, 38]
+                if self.video_codec_format == "av1"
+                else [16, 20, 24, 28]
+            )
+        # Bitrate options would override the CRF.
+        options = {
+            k: v
+            for k, v in encoder_options.items()
+            if k in ("c:v", "preset", "cpu-used", "svtav1-params", "row-mt", "b:v")
+        }
+        points = pertitle.analyze(
+            clips, options, crfs=crfs, metric=self.video_pertitle_metric
+        )
+        crf = pertitle.pick_crf(points, self.video_pertitle_target)
+
+        job.plugin_metadata.setdefault(self.name, {})["pertitle"] = {
+            "points": points,
+            "crf": crf,
+        }
+        job.log("Per-title archive CRF: {}".format(crf))
+        return crf
+
+    def can_copy(self, job: jobs.StirlingJob) -> bool:
+        """Check whether the source's video can be copied into the archive
+        without encoding it."""
+
+        if self.video_copy_disable or len(self.video_encoder_options) > 0:
+            return False
+
+        stream = job.media_info.get_preferred_stream("video")
+        if not probe.is_video_compatible(stream, [self.video_codec_format]):
+            return False
+        # Only read the keyframes when everything else matches, as it reads
+        # the source. The archive promises a keyframe every
+        # video_keyframe_interval seconds, give or take half a frame of
+        # timestamp rounding.
+        return job.media_info.get_keyframe_interval(
+            stream.stream
+        ) <= self.video_keyframe_interval + 0.5 / float(stream.frame_rate)
 
     def cmd(self, job: jobs.StirlingJob):
         if not self.video_disable:
@@ -69,11 +219,24 @@ class StirlingPluginVideo(definitions.StirlingPlugin):
                 "hide_banner": True,
                 "y": True,
                 "i": job.media_info.source,
-                "map": "0:v:{}".format(job.media_info.preferred["video"]),
-            } | self.get_encoder("av1")
+                "map": "0:{}".format(job.media_info.preferred["video"]),
+            }
+
+            copy = self.can_copy(job)
+            job.plugin_metadata[self.name] = {"copy": copy}
+            if copy:
+                job.log("Copying the source video into the archive as-is.")
+                options["c:v"] = "copy"
+            else:
+                options |= self.get_encoder(job, self.video_codec_format)
+                if self.video_pertitle:
+                    options["crf"] = self.fit_crf(job, options)
 
             output_directory = job.output_directory / self.name
             output_directory.mkdir(parents=True, exist_ok=True)
+            output_file = output_directory / (
+                self.name + "." + self.video_container_format
+            )
 
             self.assets.append(
                 definitions.StirlingPluginAssets(
@@ -87,9 +250,9 @@ class StirlingPluginVideo(definitions.StirlingPlugin):
                     depends_on=self.depends_on,
                     command="ffmpeg {} {}".format(
                         args.ffmpeg_unparser.unparse(**options),
-                        "source.mp4",
+                        output_file,
                     ),
                     priority=0,
-                    expected_output=str(output_directory),
+                    expected_output=str(output_file),
                 )
             )
@@ -1,24 +1,64 @@
-from core import audio, jobs, video
-from plugins import frames, hls, peaks, transcript
+import argparse
+from pathlib import Path
+
+import plugins
 
-# TODO: Add support for multiple audio tracks.
 # TODO: Add support for multiple transcripts/languages
-# TODO: We need to create a separate ffmpeg call with the lowest quality settings
-# at the source files resolution for previewing and fast editor preview.
+
+# The plugins to run when none are given on the command line.
+default_plugins = [
+    "proxy",
+    "video",
+    "audio",
+    "peaks",
+    "frames",
+    "scenes",
+    "transcript",
+    "hls",
+]
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a Stirling job.")
+    parser.add_argument("source", nargs="?", default="source.mp4")
+    parser.add_argument(
+        "--plugins",
+        default=",".join(default_plugins),
+        help="a comma separated list of plugins to run",
+    )
+    parser.add_argument(
+        "--list-plugins", action="store_true", help="list the available plugins"
+    )
+    parser.add_argument(
+        "--trace",
+        action="store_true",
+        help="write a timeline of the job's phases to trace.json",
+    )
+    parser.add_argument(
+        "--metrics-file",
+        help="write the engine's metrics to this file, for node-exporter's "
+        "textfile collector",
+    )
+    options = parser.parse_args()
+
+    if options.list_plugins:
+        print("\n".join(plugins.list_plugins()))
+        raise SystemExit()
+
+    # Imported after parsing the arguments, so --help doesn't wait for it.
+    from core import jobs
+
+    if options.metrics_file:
+        from core import metrics
+
+        metrics.registry.textfile = Path(options.metrics_file)
 
     # Create a new job
-    my_job = jobs.StirlingJob(source="source.mp4", debug=True)
+    my_job = jobs.StirlingJob(source=options.source, debug=True, trace=options.trace)
 
-    # Add plugins to the job
+    # Add plugins to the job. Each plugin's module (and its dependencies) is
+    # only imported here, when it's used.
     my_job.add_plugins(
-        video.StirlingPluginVideo(),
-        audio.StirlingPluginAudio(),
-        peaks.StirlingPluginPeaks(),
-        frames.StirlingPluginFrames(),
-        transcript.StirlingPluginTranscript(),
-        hls.StirlingPluginHLS(),
+        *[plugins.get_plugin(name) for name in options.plugins.split(",") if name]
     )
 
     # Run the job
@@ -0,0 +1,72 @@
+import importlib
+from functools import lru_cache
+from importlib import metadata
+
+# The plugin registry maps plugin names to the class that implements them, as
+# "module:Class" import paths. Plugin modules are only imported when a plugin
+# is asked for by name, so a job never pays for the dependencies (PyTorch,
+# NumPy, ...) of plugins it doesn't use.
+#
+# Other packages can add plugins by declaring an entry point in the
+# `stirling.plugins` group, e.g. in their pyproject.toml:
+#
+#   [project.entry-points."stirling.plugins"]
+#   captions = "my_package.captions:StirlingPluginCaptions"
+
+entry_point_group = "stirling.plugins"
+
+registry = {
+    "proxy": "plugins.proxy:StirlingPluginProxy",
+    "video": "core.video:StirlingPluginVideo",
+    "audio": "core.audio:StirlingPluginAudio",
+    "peaks": "plugins.peaks:StirlingPluginPeaks",
+    "frames": "plugins.frames:StirlingPluginFrames",
+    "scenes": "plugins.scenes:StirlingPluginScenes",
+    "objects": "plugins.objects:StirlingPluginObjects",
+    "transcript": "plugins.transcript:StirlingPluginTranscript",
+    "hls": "plugins.hls:StirlingPluginHLS",
+}
+
+
+@lru_cache(maxsize=None)
+def get_entry_points() -> dict:
+    """Get the plugins installed by other packages, as a name to entry point
+    dict. The entry points aren't loaded until they're used."""
+
+    return {
+        entry_point.name: entry_point
+        for entry_point in metadata.entry_points(group=entry_point_group)
+    }
+
+
+def list_plugins() -> list:
+    """List the names of every available plugin."""
+
+    return sorted(set(registry) | set(get_entry_points()))
+
+
+@lru_cache(maxsize=None)
+def get_plugin_class(name: str):
+    """Import and return the class for a plugin by name.
+
+    Raises:
+        ValueError: If no plugin has that name.
+    """
+
+    if name in registry:
+        module_name, class_name = registry[name].split(":")
+        return getattr(importlib.import_module(module_name), class_name)
+
+    entry_points = get_entry_points()
+    if name in entry_points:
+        return entry_points[name].load()
+
+    raise ValueError(
+        "unknown plugin {}, expected one of: {}".format(name, ", ".join(list_plugins()))
+    )
+
+
+def get_plugin(name: str, **options):
+    """Create a plugin by name, with any options for it."""
+
+    return get_plugin_class(name)(**options)
@@ -43,7 +43,6 @@ class StirlingPluginFrames(definitions.StirlingPlugin):
     def cmd(self, job: jobs.StirlingJob):
         if not self.frames_disable:
             stream = job.media_info.get_preferred_stream("video")
-            fps = stream.frame_rate
 
             # Set the options to extract audio from the source file.
             options = {
@@ -53,9 +52,7 @@ class StirlingPluginFrames(definitions.StirlingPlugin):
                 "i": job.media_info.source,
                 "f": "image2",
                 "map": "0:v:{}".format(stream.stream),
-                "vf": "fps={}".format(
-                    self.__get_frames_interval(self.frames_interval, fps)
-                ),
+                "vf": "fps={}".format(self.get_frames_rate(job)),
                 "vsync": 0,
                 "frame_pts": 1,
             }
@@ -82,6 +79,14 @@ class StirlingPluginFrames(definitions.StirlingPlugin):
                 )
             )
 
+    def get_frames_rate(self, job: jobs.StirlingJob) -> float:
+        """Get the number of frames captured per second of video. Frames are
+        named after their timestamp at this rate, so a frame's time in seconds
+        is its number divided by the rate."""
+
+        stream = job.media_info.get_preferred_stream("video")
+        return self.__get_frames_interval(self.frames_interval, stream.frame_rate)
+
     def __get_frames_interval(self, interval, fps):
         # The Frame Interval is the number of frames to capture for every second
         # of video. To capture one frame for every second of video, provide 1 as
@@ -1,9 +1,17 @@
+import re
 from dataclasses import dataclass, field
 
-from core import args, definitions, helpers, jobs
+from core import args, capabilities, definitions, helpers, jobs, probe
 
 required_binaries = ["ffmpeg"]
 
+# The H.264 profiles that players expecting each profile can decode.
+h264_profiles = {
+    "baseline": ["Constrained Baseline", "Baseline"],
+    "main": ["Constrained Baseline", "Baseline", "Main"],
+    "high": ["Constrained Baseline", "Baseline", "Main", "High"],
+}
+
 
 @dataclass
 class StirlingPluginHLS(definitions.StirlingPlugin):
@@ -40,11 +48,21 @@ class StirlingPluginHLS(definitions.StirlingPlugin):
     hls_audio_codec: str = "aac"
     # Audio sample rate to encode with. Default is the same as the source.
     hls_audio_sample_rate: int = 0
+    # The audio is encoded separately from the video, once for each audio
+    # bitrate in the ladder, and shared by the video renditions. Set a
+    # bitrate (in kilobits) to encode the audio only once, at that bitrate,
+    # for every rendition. 0 uses the bitrates from the encoder profile.
+    hls_audio_bitrate: int = 0
     # Video codec to encode with. H264 is the most common and our preferred
-    # codec for compatibility purposes.
+    # codec for compatibility purposes. The fastest encoder for it that ffmpeg
+    # supports is used (see core.capabilities).
     hls_video_codec: str = "h264"
     # Video encoding profile, set to a legacy setting for compatibility.
     hls_video_profile: str = "main"
+    # The encoder preset (e.g. "medium"). Empty uses the encoder's default.
+    hls_preset: str = ""
+    # The number of threads the encoder may use. 0 uses every core.
+    hls_threads: int = 0
     # Adjusts the sensitivity of the encoder's scene cut detection. When a new
     # scene is detected (e.g. a video frame is very different than the one
     # before it), a new keyframe is created. Rarely needs to be adjusted. 0
@@ -65,6 +83,52 @@ class StirlingPluginHLS(definitions.StirlingPlugin):
     # The encoder profiles to use. Load defaults from the core definitions
     # package.
     hls_encoder_profiles: dict = field(default_factory=dict)
+    # Encode every rendition in the profile as-is. By default, renditions are
+    # fitted to the source: they are never larger than the source, follow its
+    # aspect ratio, never use more bitrate than it has, and renditions that
+    # would look the same are collapsed into one.
+    hls_ladder_prune_disable: bool = False
+    # How much more bitrate (as a ratio) a rendition needs over the one below
+    # it, at about the same resolution, to be worth encoding separately.
+    hls_ladder_min_step: float = 1.2
+    # The segment format: "mpegts" (.ts segments) or "fmp4" (CMAF .m4s
+    # segments, each rendition with an init segment). fMP4 segments can be
+    # played with both HLS and DASH, so one encode serves both.
+    hls_segment_type: str = "mpegts"
+    # Disable writing a DASH manifest next to the HLS playlists. It is only
+    # written for fMP4 segments, and refers to the same segment files.
+    hls_dash_disable: bool = False
+    # Write each rendition as a single file, with its playlist addressing
+    # the segments by byte range (EXT-X-BYTERANGE), rather than one file per
+    # segment. A long source otherwise writes thousands of small files per
+    # rendition, which are slow to write, list and upload.
+    hls_single_file: bool = False
+    # Disable writing I-frame only playlists for trick play (fast scrubbing).
+    # They address the keyframes in the existing segments by byte range, so a
+    # seek preview costs a few kilobytes rather than a whole segment.
+    hls_iframes_disable: bool = False
+    # Copy the source's streams into renditions as-is, rather than encoding
+    # them, where the source already matches: H.264 video in a compatible
+    # profile at the rendition's exact size and within its bitrate, with
+    # keyframes at least every segment, or AAC audio within an audio
+    # rendition's bitrate. Copying isn't used for fMP4 segments, as their
+    # keyframes are forced onto the segment boundaries.
+    hls_copy_disable: bool = False
+    # Fit each rendition's bitrate to the source (per-title encoding): sample
+    # clips are encoded at several CRF points and measured, and each
+    # rendition gets the lowest bitrate that reaches the target quality (see
+    # core.pertitle). Adds the analysis time to planning.
+    hls_pertitle: bool = False
+    # The quality metric to target: "ssim" (0.0-1.0) or "psnr" (in dB).
+    hls_pertitle_metric: str = "ssim"
+    # The quality each rendition should reach.
+    hls_pertitle_target: float = 0.96
+    # The number and length (in seconds) of the sample clips.
+    hls_pertitle_clips: int = 3
+    hls_pertitle_clip_length: float = 4
+    # How far (as a ratio) a rendition's bitrate may move from the encoder
+    # profile's, in either direction.
+    hls_pertitle_max_ratio: float = 2.0
 
     def __post_init__(self):
         if self.hls_profile not in self.hls_encoder_profiles:
@@ -95,7 +159,7 @@ class StirlingPluginHLS(definitions.StirlingPlugin):
             output_directory = job.output_directory / self.name
             output_directory.mkdir(parents=True, exist_ok=True)
 
-            outputs = []
+            ladder = self.get_ladder(job)
 
             # Set the options to encode an HLS package.
             options = {
@@ -105,78 +169,139 @@ class StirlingPluginHLS(definitions.StirlingPlugin):
             }
 
             video_options = {
-                "map": "0:v:{}".format(self.video_source_stream),
-                "vcodec": self.hls_video_codec,
+                "map": "0:{}".format(self.video_source_stream),
+                "vcodec": capabilities.best_encoder(self.hls_video_codec)
+                or self.hls_video_codec,
                 "profile:v": self.hls_video_profile,
                 "crf": self.hls_crf,
-                "hls_time": self.hls_target_segment_duration,
-                "hls_playlist_type": self.hls_playlist_type,
                 "sc_threshold": self.hls_sc_threshold,
                 "g": self.hls_gop_size,
                 "keyint_min": self.hls_keyint_min,
                 "movflags": self.hls_movflags,
             }
+            if self.hls_preset:
+                video_options["preset"] = self.hls_preset
+            if self.hls_threads > 0:
+                video_options["threads"] = self.hls_threads
 
             audio_options = {
-                "map": "0:a:{}".format(
-                    self.audio_source_stream - len(job.media_info.video_streams)
-                ),
-                "acodec": self.hls_audio_codec,
+                "map": "0:{}".format(self.audio_source_stream),
+                "acodec": capabilities.best_encoder(self.hls_audio_codec)
+                or self.hls_audio_codec,
                 "ar": self.hls_audio_sample_rate,
             }
 
+            segment_options = {
+                "hls_time": self.hls_target_segment_duration,
+                "hls_playlist_type": self.hls_playlist_type,
+                # Ensure the m3u8 contains the entire stream, as ffmpeg will
+                # default and limit this to only 5 entries.
+                "hls_list_size": 0,
+            }
+            if self.hls_single_file:
+                segment_options["hls_flags"] = "single_file"
+            if self.hls_segment_type == "fmp4":
+                segment_options["hls_segment_type"] = "fmp4"
+                # Every rendition must switch segments on the same frames for
+                # DASH, so keyframes are forced at each segment boundary
+                # rather than left to each rendition's scene cut detection.
+                video_options["force_key_frames"] = "'expr:gte(t,n_forced*{})'".format(
+                    self.hls_target_segment_duration
+                )
+
+            # Audio is encoded once per distinct audio bitrate in the ladder,
+            # as its own audio-only rendition, and shared by every video
+            # rendition with that bitrate through an audio group.
+            audio_stream = job.media_info.get_stream("audio", self.audio_source_stream)
+            if self.hls_audio_bitrate > 0:
+                for rendition in ladder:
+                    rendition["audio-bitrate"] = self.hls_audio_bitrate
+            audio_groups = {}
+            for rendition in ladder:
+                audio_groups.setdefault(
+                    rendition["audio-bitrate"],
+                    "audio_{}k".format(rendition["audio-bitrate"]),
+                )
+
+            copied = self.get_copied(job, ladder, audio_groups)
+            job.plugin_metadata[self.name]["copied"] = sorted(copied)
+
             renditions = ""
-            master_playlist_contents = "#EXTM3U\n#EXT-X-VERSION:3\n"
-            for rendition in self.hls_encoder_profiles:
-                rendition_command = {
-                    # Scale the video to the appropriate resolution (width and height)
-                    "vf": "scale=w={}:h={}:force_original_aspect_ratio=decrease".format(
-                        rendition["width"], rendition["height"]
-                    ),
-                    # Control the bitrate.
-                    "b:v": "{}k".format(rendition["bitrate"]),
-                    # Set the maximum video bitrate.
-                    "maxrate": "{}k".format(
-                        int(rendition["bitrate"]) * self.hls_bitrate_ratio
-                    ),
-                    # Set the size of the buffer before ffmpeg recalculates the
-                    # bitrate.
-                    "bufsize": "{0}k".format(
-                        int(rendition["bitrate"]) * self.hls_buffer_ratio
-                    ),
-                    # Set the audio output bitrate.
-                    "b:a": "{0}k".format(rendition["audio-bitrate"]),
-                    # Ensure the m3u8 contains the entire stream, as ffmpeg
-                    # will default and limit this to only 5 entries.
-                    "hls_list_size": 0,
-                    # Set the output filename for the HLS segment.
-                    "hls_segment_filename": "'{0}/{1}_%09d.ts'".format(
-                        str(output_directory), rendition["name"]
-                    ),
-                }
+            # fMP4 segments need EXT-X-MAP, from version 6 of the protocol,
+            # and byte ranges need version 4.
+            version = 3
+            if self.hls_segment_type == "fmp4":
+                version = 7
+            elif self.hls_single_file:
+                version = 4
+            master_playlist_contents = "#EXTM3U\n#EXT-X-VERSION:{}\n".format(version)
+            for bitrate, group in audio_groups.items():
+                if group in copied:
+                    audio_command = {"map": audio_options["map"], "c:a": "copy"}
+                else:
+                    audio_command = audio_options | {"b:a": "{}k".format(bitrate)}
+                renditions += " ".join(
+                    [
+                        args.ffmpeg_unparser.unparse(**audio_command),
+                        args.ffmpeg_unparser.unparse(**segment_options),
+                        args.ffmpeg_unparser.unparse(
+                            **self.__get_segment_names(output_directory, group)
+                        ),
+                        "{0}/{1}.m3u8".format(str(output_directory), group),
+                        "",
+                    ]
+                )
+
+                media = (
+                    'TYPE=AUDIO,GROUP-ID="{0}",NAME="{1}",DEFAULT=YES,'
+                    'AUTOSELECT=YES,URI="{0}.m3u8"'
+                ).format(group, audio_stream.language)
+                if audio_stream.language != "und":
+                    media += ',LANGUAGE="{}"'.format(audio_stream.language)
+                master_playlist_contents += "#EXT-X-MEDIA:{}\n".format(media)
+
+            for rendition in ladder:
+                if rendition["name"] in copied:
+                    rendition_video_options = {
+                        "map": video_options["map"],
+                        "c:v": "copy",
+                    }
+                    rendition_command = {}
+                else:
+                    rendition_video_options = video_options
+                    rendition_command = self.__get_rendition_options(rendition)
+                rendition_command |= {
+                    # The audio is in its own rendition.
+                    "an": True,
+                } | self.__get_segment_names(output_directory, rendition["name"])
                 master_playlist_contents += (
-                    "#EXT-X-STREAM-INF:BANDWIDTH={},RESOLUTION={}x{}\n{}.m3u8\n".format(
-                        int(rendition["bitrate"]) * 1000,
-                        rendition["width"],
-                        rendition["height"],
-                        rendition["name"],
-                    )
+                    '#EXT-X-STREAM-INF:BANDWIDTH={},RESOLUTION={}x{},AUDIO="{}"\n'
+                    "{}.m3u8\n"
+                ).format(
+                    (rendition["bitrate"] + rendition["audio-bitrate"]) * 1000,
+                    rendition["width"],
+                    rendition["height"],
+                    audio_groups[rendition["audio-bitrate"]],
+                    rendition["name"],
                 )
 
                 rendition_playlist = "{0}/{1}.m3u8".format(
                     str(output_directory), rendition["name"]
                 )
-                outputs.append(output_directory / rendition_playlist)
 
-                renditions += (
-                    args.ffmpeg_unparser.unparse(**rendition_command)
-                    + " "
-                    + rendition_playlist
-                    + " "
+                # Options only apply to the output that follows them, so each
+                # rendition needs its own copy of the stream and codec options.
+                renditions += " ".join(
+                    [
+                        args.ffmpeg_unparser.unparse(**rendition_video_options),
+                        args.ffmpeg_unparser.unparse(**segment_options),
+                        args.ffmpeg_unparser.unparse(**rendition_command),
+                        rendition_playlist,
+                        "",
+                    ]
                 )
 
             master_playlist = "playlist.m3u8"
-            outputs.append(output_directory / master_playlist)
 
             job.commands.append(
                 definitions.StirlingCmd(
@@ -188,16 +313,18 @@ class StirlingPluginHLS(definitions.StirlingPlugin):
                     priority=self.priority,
                     expected_output=str(output_directory / master_playlist),
                     depends_on=self.depends_on,
+                    # The renditions it lists are encoded, and their I-frame
+                    # playlists added to it, by later commands.
+                    ready_after=[self.name]
+                    + ([] if self.hls_iframes_disable else [self.name + "_iframes"]),
                 )
             )
 
             job.commands.append(
                 definitions.StirlingCmd(
                     name=self.name,
-                    command="ffmpeg {} {} {} {}".format(
+                    command="ffmpeg {} {}".format(
                         args.ffmpeg_unparser.unparse(**options),
-                        args.ffmpeg_unparser.unparse(**video_options),
-                        args.ffmpeg_unparser.unparse(**audio_options),
                         renditions,
                     ),
                     priority=self.priority,
@@ -206,6 +333,350 @@ class StirlingPluginHLS(definitions.StirlingPlugin):
                 )
             )
 
+            if not self.hls_iframes_disable:
+                job.commands.append(
+                    definitions.StirlingCmd(
+                        name=self.name + "_iframes",
+                        command=helpers.python_module_command(
+                            "core.packaging",
+                            str(output_directory),
+                            master=master_playlist,
+                            iframes=True,
+                        ),
+                        priority=self.priority,
+                        # One I-frame playlist is written for each rendition.
+                        expected_output=str(output_directory / "*_iframes.m3u8"),
+                        depends_on=[self.name, self.name + "_master_playlist"],
+                    )
+                )
+
+            if self.hls_segment_type == "fmp4" and not self.hls_dash_disable:
+                dash_manifest = "manifest.mpd"
+                job.commands.append(
+                    definitions.StirlingCmd(
+                        name=self.name + "_dash",
+                        command=helpers.python_module_command(
+                            "core.packaging",
+                            str(output_directory),
+                            master=master_playlist,
+                            dash=dash_manifest,
+                        ),
+                        priority=self.priority,
+                        expected_output=str(output_directory / dash_manifest),
+                        depends_on=[self.name, self.name + "_master_playlist"],
+                    )
+                )
+
+    def __get_segment_names(self, output_directory, name: str) -> dict:
+        """Get the options that name a rendition's segment files."""
+
+        if self.hls_single_file:
+            # Segments (and the fMP4 init segment) are byte ranges of one
+            # file.
+            return {
+                "hls_segment_filename": "{0}/{1}.{2}".format(
+                    str(output_directory),
+                    name,
+                    "m4s" if self.hls_segment_type == "fmp4" else "ts",
+                )
+            }
+        if self.hls_segment_type == "fmp4":
+            return {
+                "hls_segment_filename": "{0}/{1}_%09d.m4s".format(
+                    str(output_directory), name
+                ),
+                # Written next to the segments.
+                "hls_fmp4_init_filename": "{}_init.mp4".format(name),
+            }
+        return {
+            "hls_segment_filename": "{0}/{1}_%09d.ts".format(
+                str(output_directory), name
+            )
+        }
+
+    def __get_rendition_options(self, rendition: dict) -> dict:
+        """Get the options that encode the video for a rendition."""
+
+        return {
+            # Scale the video to the rendition's resolution, which already
+            # matches the source's aspect ratio.
+            "vf": "scale=w={}:h={},setsar=1".format(
+                rendition["width"], rendition["height"]
+            ),
+            # Control the bitrate.
+            "b:v": "{}k".format(rendition["bitrate"]),
+            # Set the maximum video bitrate.
+            "maxrate": "{}k".format(int(rendition["bitrate"] * self.hls_bitrate_ratio)),
+            # Set the size of the buffer before ffmpeg recalculates the
+            # bitrate.
+            "bufsize": "{0}k".format(int(rendition["bitrate"] * self.hls_buffer_ratio)),
+        }
+
+    def get_copied(
+        self, job: jobs.StirlingJob, ladder: list, audio_groups: dict
+    ) -> set:
+        """Get the names of the renditions and audio groups that can be
+        copied from the source rather than encoded."""
+
+        copied = set()
+        if self.hls_copy_disable or self.hls_segment_type == "fmp4":
+            return copied
+
+        video_stream = job.media_info.get_stream("video", self.video_source_stream)
+        audio_stream = job.media_info.get_stream("audio", self.audio_source_stream)
+        source_bitrate = get_bitrate(video_stream.bitrate)
+
+        candidates = []
+        if self.hls_video_codec == "h264" and source_bitrate > 0:
+            candidates = [
+                rendition["name"]
+                for rendition in ladder
+                if probe.is_video_compatible(
+                    video_stream,
+                    ["h264"],
+                    profiles=h264_profiles.get(self.hls_video_profile),
+                    pixel_formats=["yuv420p"],
+                    width=rendition["width"],
+                    height=rendition["height"],
+                )
+                and source_bitrate <= rendition["bitrate"] * self.hls_bitrate_ratio
+            ]
+        # Segments can only start on a keyframe, so the source's keyframes
+        # must be at least a segment apart. Only read when needed, as it
+        # reads the source.
+        if len(candidates) > 0 and (
+            job.media_info.get_keyframe_interval(video_stream.stream)
+            <= self.hls_target_segment_duration
+        ):
+            copied.update(candidates)
+
+        if int(audio_stream.sample_rate or 0) == int(self.hls_audio_sample_rate):
+            for bitrate, group in audio_groups.items():
+                if probe.is_audio_compatible(
+                    audio_stream, ["aac"], max_bitrate=bitrate * 1000
+                ):
+                    copied.add(group)
+
+        if len(copied) > 0:
+            job.log("Copying HLS renditions from the source: " + ", ".join(copied))
+        return copied
+
+    def fit_bitrates(self, job: jobs.StirlingJob, ladder: list) -> dict:
+        """Set each rendition's bitrate to the lowest that reaches the target
+        quality on sample clips of the source.
+
+        Returns:
+            dict: The measured points and chosen bitrate for each rendition,
+                by name.
+        """
+
+        from core import pertitle
+
+        video_stream = job.media_info.get_stream("video", self.video_source_stream)
+        clips = pertitle.get_clips(
+            str(job.media_info.source),
+            video_stream.stream,
+            float(video_stream.duration),
+            self.hls_pertitle_clips,
+            self.hls_pertitle_clip_length,
+        )
+        encoder_options = {
+            "c:v": capabilities.best_encoder(self.hls_video_codec)
+            or self.hls_video_codec,
+            "profile:v": self.hls_video_profile,
+        }
+
+        fitted = {}
+        for rendition in ladder:
+            points = pertitle.analyze(
+                clips,
+                encoder_options,
+                crfs=[18, 22, 26, 30, 34],
+                width=rendition["width"],
+                height=rendition["height"],
+                metric=self.hls_pertitle_metric,
+            )
+            bitrate = pertitle.pick_bitrate(points, self.hls_pertitle_target)
+            bitrate = min(
+                max(bitrate, int(rendition["bitrate"] / self.hls_pertitle_max_ratio)),
+                int(rendition["bitrate"] * self.hls_pertitle_max_ratio),
+            )
+            # Never more than the source has.
+            source_bitrate = get_bitrate(video_stream.bitrate)
+            if source_bitrate > 0:
+                bitrate = min(bitrate, source_bitrate)
+            fitted[rendition["name"]] = {"points": points, "bitrate": bitrate}
+            rendition["bitrate"] = bitrate
+
+        job.log(
+            "Per-title HLS bitrates: "
+            + ", ".join("{} {}k".format(k, v["bitrate"]) for k, v in fitted.items())
+        )
+        return fitted
+
+    def get_ladder(self, job: jobs.StirlingJob) -> list:
+        """Get the renditions to encode for the job's source, and record them
+        in the job's plugin metadata.
+
+        Unless pruning is disabled, the profile's renditions are fitted to the
+        source (see resolve_ladder), so a small source is never upscaled or
+        encoded at bitrates it can't use.
+        """
+
+        video_stream = job.media_info.get_stream("video", self.video_source_stream)
+        audio_stream = job.media_info.get_stream("audio", self.audio_source_stream)
+
+        if self.hls_ladder_prune_disable:
+            ladder = [
+                {
+                    "name": rendition.get("name", rendition["height"] + "p"),
+                    "width": int(rendition["width"]),
+                    "height": int(rendition["height"]),
+                    "bitrate": int(rendition["bitrate"]),
+                    "audio-bitrate": int(rendition["audio-bitrate"]),
+                }
+                for rendition in self.hls_encoder_profiles
+            ]
+            pruned = []
+        else:
+            ladder, pruned = resolve_ladder(
+                self.hls_encoder_profiles,
+                video_stream,
+                audio_bitrate=get_bitrate(audio_stream.bitrate),
+                min_step=self.hls_ladder_min_step,
+            )
+
+        job.plugin_metadata[self.name] = {
+            "profile": self.hls_profile,
+            "ladder": ladder,
+            "pruned": pruned,
+        }
+        if self.hls_pertitle:
+            job.plugin_metadata[self.name]["pertitle"] = self.fit_bitrates(job, ladder)
+        job.log(
+            "HLS ladder for profile {}: {}".format(
+                self.hls_profile, ", ".join(r["name"] for r in ladder)
+            )
+        )
+        return ladder
+
+
+def get_bitrate(bitrate) -> int:
+    """Get a stream bitrate from ffprobe, in bits per second, as kilobits per
+    second. Returns 0 when the bitrate isn't known."""
+
+    try:
+        return int(float(bitrate) / 1000)
+    except (TypeError, ValueError):
+        return 0
+
+
+def even(value: float) -> int:
+    # Most encoders need even dimensions for 4:2:0 video.
+    return max(int(round(value / 2)) * 2, 2)
+
+
+def resolve_ladder(
+    renditions: list,
+    stream: definitions.StreamVideo,
+    audio_bitrate: int = 0,
+    min_step: float = 1.2,
+) -> tuple:
+    """Fit a profile's renditions to a source video stream.
+
+    Each rendition is scaled to fit inside its width and height at the
+    source's display aspect ratio. Renditions larger than the source are
+    shrunk to the source's size rather than upscaled, and no rendition's
+    bitrate is higher than the source's. Renditions that end up at (nearly)
+    the same size with less than `min_step` times the bitrate of a smaller
+    one are collapsed into the larger one.
+
+    Args:
+        renditions (list[dict]): Renditions from VideoEncoderRenditions.
+        stream (definitions.StreamVideo): The source video stream.
+        audio_bitrate (int): The source audio bitrate, in kilobits. 0 if
+            unknown.
+        min_step (float): How much more bitrate (as a ratio) a rendition
+            needs over the one below it to be kept.
+
+    Returns:
+        tuple: (ladder, pruned). The ladder is a list of renditions, from
+            smallest to largest, with integer dimensions and bitrates. pruned
+            lists the names of the profile's renditions that were dropped.
+    """
+
+    source_width, source_height = int(stream.width), int(stream.height)
+    try:
+        aspect = float(stream.aspect[0]) / float(stream.aspect[1])
+    except (TypeError, ValueError, IndexError, ZeroDivisionError):
+        aspect = source_width / source_height
+    # The source's height at its display aspect ratio, as non-square pixels
+    # are stretched when played.
+    source_width = even(source_height * aspect)
+    source_bitrate = get_bitrate(stream.bitrate)
+
+    fitted = []
+    for rendition in renditions:
+        width, height = int(rendition["width"]), int(rendition["height"])
+        profile = rendition.get("name", "{}p".format(height))
+
+        # Fit inside the rendition's box, then inside the source.
+        if width / height > aspect:
+            width = height * aspect
+        else:
+            height = width / aspect
+        if height > source_height:
+            width, height = source_width, source_height
+        width, height = even(width), even(height)
+
+        # Name the rendition for the height it ended up at (a "480p" box
+        # holds a 640x360 picture from a 16:9 source), keeping any suffix of
+        # the profile's name, e.g. "-high".
+        match = re.match(r"\d+p(.*)", profile)
+        name = "{}p{}".format(height, match.group(1) if match else "")
+
+        bitrate = int(rendition["bitrate"])
+        if source_bitrate > 0:
+            bitrate = min(bitrate, source_bitrate)
+        rendition_audio_bitrate = int(rendition["audio-bitrate"])
+        if audio_bitrate > 0:
+            rendition_audio_bitrate = min(rendition_audio_bitrate, audio_bitrate)
+
+        fitted.append(
+            {
+                "name": name,
+                "profile": profile,
+                "width": width,
+                "height": height,
+                "bitrate": bitrate,
+                "audio-bitrate": rendition_audio_bitrate,
+            }
+        )
+
+    ladder = []
+    for rendition in sorted(fitted, key=lambda r: (r["height"], r["bitrate"])):
+        if (
+            len(ladder) > 0
+            and rendition["height"] <= ladder[-1]["height"] * 1.1
+            and rendition["bitrate"] < ladder[-1]["bitrate"] * min_step
+        ):
+            # Visually the same as the rendition below it; keep the larger.
+            ladder[-1] = rendition
+            continue
+        ladder.append(rendition)
+
+    # Names must be unique, as they name the playlists and segments.
+    names = {}
+    for rendition in ladder:
+        count = names.get(rendition["name"], 0)
+        names[rendition["name"]] = count + 1
+        if count > 0:
+            rendition["name"] = "{}-{}".format(rendition["name"], count + 1)
+
+    kept = {rendition["profile"] for rendition in ladder}
+    pruned = [r["profile"] for r in fitted if r["profile"] not in kept]
+    return ladder, pruned
+
 
 # ## PLUGIN FUNCTIONS
 # ## Generate an HLS Package from file
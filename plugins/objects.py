@@ -1,166 +1,122 @@
-# import json
-# import os
-
-# import cv2
-# from mtcnn import MTCNN
-
-# from core import args, helpers
-
-# # from core import pytorch
-# from plugins import plugins
-
-
-# ## PLUGIN FUNCTIONS
-# ## Generate an HLS Package from file
-# def generate_face_detection(job):
-#     if not job["arguments"]["disable_object_detection"]:
-#         # Create the directory for the faces.
-#         frames_input_directory = job["output"]["directory"] / "img" / "frames"
-
-#         # device = pytorch.pytorch_get_device()
-
-#         detector = MTCNN()
-#         output_filename = str(job["output"]["directory"]) + "/annotations/faces.json"
-
-#         output_file = open(output_filename, "w")
-#         scan: list[dict] = []
-
-#         # iterate over files in
-#         # that directory
-#         for filename in os.listdir(frames_input_directory):
-#             if filename.endswith((".jpg", ".png")):
-#                 #f = os.path.join(directory, filename)
-#                 f = ""
-#                 holder: dict = {"filename": filename, "faces": []}
-#                 if os.path.isfile(f):
-#                     img = cv2.cvtColor(cv2.imread(f), cv2.COLOR_BGRA2BGR)
-#                     faces = detector.detect_faces(img)
-#                     holder["faces"] = faces
-#                     for i, face in enumerate(holder["faces"]):
-#                         cropped_face = img[
-#                             face["box"][1] : face["box"][1] + face["box"][3],
-#                             face["box"][0] : face["box"][0] + face["box"][2],
-#                         ]
-#                         cv2.imwrite(f + "_" + str(i) + "_face.jpg", cropped_face)
-#                     scan.append(holder)
-
-#         output_file.writelines(json.dumps(scan) + "\n")
-#         output_file.close()
-
-#         # Create the directory for the hls package.
-#         hls_output_directory = job["output"]["directory"] / "video" / "hls"
-#         hls_output_directory.mkdir(parents=True, exist_ok=True)
-
-#         # Video encoding options
-#         # Set the output folder for the HLS segments and playlists. Currently
-#         # this is the same as the full package output folder, but we're making it a
-#         # variable here in case we want to change it later.
-#         # Update our templates with calculated values
-#         # Calculate the appropriate interval for inserting keyframes.
-#         try:
-#             kf_interval = (
-#                 eval(
-#                     job["source"]["info"]["streams"][
-#                         job["source"]["input"]["video_stream"]
-#                     ]["avg_frame_rate"]
-#                 )
-#                 * 2
-#             )
-#         except (ValueError, TypeError):
-#             kf_interval = 60
-
-#         # Where to save the HLS output package files.
-#         job["commands"]["hls"]["output_options"]["directory"] = str(
-#             hls_output_directory
-#         )
-
-#         # Set the minimum distance between keyframes.
-#         job["commands"]["hls"]["options"]["keyint_min"] = str(kf_interval)
-
-#         # Set the maximum distance between keyframes. Currently, we"re setting this the same as kf_interval.
-#         job["commands"]["hls"]["options"]["g"] = str(
-#             kf_interval * job["arguments"]["hls_keyframe_multiplier"]
-#         )
-
-#         # Set the Constant Rate Factor to normalize the bitrate throughout for easier streaming.
-#         job["commands"]["hls"]["options"]["crf"] = str(job["arguments"]["hls_crf"])
-
-#         # Set the length of each h.264 TS segment file.
-#         job["commands"]["hls"]["options"]["hls_time"] == str(
-#             job["arguments"]["hls_segment_duration"]
-#         )
-
-#         # The main input file
-#         job["commands"]["hls"]["input_options"]["i"] = job["source"]["input"][
-#             "filename"
-#         ]
-#         job["commands"]["hls"]["input_options"]["map"] = "0:{}".format(
-#             str(job["source"]["input"]["video_stream"])
-#         )
-
-#         # The HLS profile to use. See encoder_profiles for more information.
-#         job["commands"]["hls"]["args"]["hls_profile"] == str(
-#             job["arguments"]["hls_profile"]
-#         )
-
-#         # These two values help us fine-tune the HLS encoding.
-#         job["commands"]["hls"]["args"]["hls_bitrate_ratio"] == str(
-#             job["arguments"]["hls_bitrate_ratio"]
-#         )
-#         job["commands"]["hls"]["args"]["hls_buffer_ratio"] == str(
-#             job["arguments"]["hls_buffer_ratio"]
-#         )
-
-#         # Create template entries for each of the encoder renditions specified in the profile.
-#         job, renditions_options, encoder_renditions, output_playlist = create_rendition(
-#             job
-#         )
-
-#         for rendition_option in renditions_options:
-#             encoder_renditions += " " + args.default_unparser.unparse(
-#                 **(job["commands"]["hls"]["options"] | rendition_option)
-#             )
-
-#         # Fix unargparsers insistence on "deciding" which types of quotes to use.
-#         encoder_renditions = encoder_renditions.replace("'", '"')
-
-#         job["commands"]["hls"]["command"] = "ffmpeg " + (
-#             args.ffmpeg_unparser.unparse(
-#                 **(
-#                     job["commands"]["hls"]["cli_options"]
-#                     | job["commands"]["hls"]["input_options"]
-#                 )
-#             )
-#             + " "
-#             + encoder_renditions
-#         )
-
-#         helpers.log(job, "HLS Encoding Command: " + job["commands"]["hls"]["command"])
-
-#         # Convert the video file to packaged HLS.
-#         helpers.log(
-#             job,
-#             "Generating HLS package from source file '{}' to directory '{}'".format(
-#                 job["commands"]["hls"]["input_options"]["i"],
-#                 str(job["commands"]["hls"]["output_options"]["directory"]),
-#             ),
-#         )
-
-#         # Create an m3u8 file to hold all the renditions.
-#         job = create_master_playlist(job, output_playlist)
-
-#         job["output"]["video_hls_generation"] = plugins.do(
-#             job["commands"]["hls"]["command"], job["arguments"]["simulate"]
-#         )
-#         helpers.log(
-#             job,
-#             "Created HLS video package in {0}".format(
-#                 str(job["commands"]["hls"]["output_options"]["directory"])
-#             ),
-#         )
-
-#         job["output"]["outputs"].append(
-#             job["commands"]["hls"]["output_options"]["directory"]
-#         )
-
-#     return job
+from dataclasses import dataclass, field
+from typing import List
+
+from core import annotations, definitions, helpers, jobs
+
+
+@dataclass
+class StirlingPluginObjects(definitions.StirlingPlugin):
+    """StirlingPluginObjects detects faces in the stills created by the frames
+    plugin. Detection runs in fixed-size batches on the best available
+    device (see core.pytorch), with frames decoded ahead of the detector and
+    face crops written on a separate thread."""
+
+    name: str = "objects"
+    depends_on: list = field(default_factory=lambda: ["frames"])
+    priority: int = 20
+
+    # Disable object detection.
+    objects_disable: bool = False
+    # The number of frames to run the detector on at once. Larger batches are
+    # more efficient, but use more memory.
+    objects_batch_size: int = 32
+    # The number of batches to decode ahead of the detector.
+    objects_prefetch: int = 4
+    # The number of threads decoding frames.
+    objects_decode_threads: int = 4
+    # Detections below this confidence (0.0-1.0) are discarded.
+    objects_min_confidence: float = 0.9
+    # Disable writing an image of each detected face.
+    objects_crops_disable: bool = False
+    # Only run the detector on every Nth frame (and on scene cuts), and track
+    # faces between those frames with optical flow. The annotations are then
+    # per-track time ranges rather than per-frame detections. 0 runs the
+    # detector on every frame.
+    objects_keyframe_interval: int = 0
+    # How different (0.0-1.0) a frame must be from the one before it to be
+    # treated as a scene cut, and always run the detector.
+    objects_scene_threshold: float = 0.4
+    # How much (0.0-1.0) a detection must overlap a tracked face to continue
+    # that track.
+    objects_iou_threshold: float = 0.3
+    # The unix socket of a shared inference worker (see core.inference). When
+    # set, frames are sent to the worker, which keeps the model loaded between
+    # jobs, instead of loading the model for every job. If no worker is
+    # running, the model is loaded locally.
+    objects_inference_socket: str = None
+    # An embedding index (see core.embeddings) to add every detected face
+    # to, so faces can be searched for across jobs. Shared between jobs, so
+    # it is not inside the job's output directory.
+    objects_embeddings_index: str = None
+    # An embedding index of known faces, each with a name. Faces that match
+    # a known face are labelled with its name. Add faces to it with:
+    #   python -m core.detection --known-faces <index> --enroll <name> \
+    #       --output /dev/null <folder of photos>
+    objects_known_faces: str = None
+    # How similar (cosine similarity, -1.0-1.0) a face must be to a known
+    # face to be labelled with its name.
+    objects_known_threshold: float = 0.7
+
+    # Contains outputs from the plugin for use in other plugins.
+    assets: List[definitions.StirlingPluginAssets] = field(default_factory=list)
+
+    def cmd(self, job: jobs.StirlingJob):
+        if not self.objects_disable:
+            output_file = (
+                job.output_directory
+                / job.output_annotations_directory
+                / (self.name + ".json")
+            )
+
+            frames = job.get_plugin("frames")
+            input_directory = job.get_plugin_asset("frames", "frames_directory")
+
+            options = {
+                "output": str(output_file),
+                "interval": frames.get_frames_rate(job),
+                "batch-size": self.objects_batch_size,
+                "prefetch": self.objects_prefetch,
+                "decode-threads": self.objects_decode_threads,
+                "min-confidence": self.objects_min_confidence,
+                "keyframe-interval": self.objects_keyframe_interval,
+                "scene-threshold": self.objects_scene_threshold,
+                "iou-threshold": self.objects_iou_threshold,
+                "inference-socket": self.objects_inference_socket,
+                "embeddings-index": self.objects_embeddings_index,
+                "known-faces": self.objects_known_faces,
+                "known-threshold": self.objects_known_threshold,
+                "job": job.id,
+            }
+
+            self.assets.append(
+                definitions.StirlingPluginAssets(
+                    name="objects_annotations", path=output_file
+                )
+            )
+            self.assets.append(
+                definitions.StirlingPluginAssets(
+                    name="objects_columns",
+                    path=annotations.get_columns_path(output_file),
+                )
+            )
+
+            if not self.objects_crops_disable:
+                crops_directory = job.output_directory / self.name / "crops"
+                options["crops-directory"] = str(crops_directory)
+                self.assets.append(
+                    definitions.StirlingPluginAssets(
+                        name="objects_crops", path=crops_directory
+                    )
+                )
+
+            job.commands.append(
+                definitions.StirlingCmd(
+                    name=self.name,
+                    command=helpers.python_module_command(
+                        "core.detection", str(input_directory), **options
+                    ),
+                    priority=self.priority,
+                    expected_output=str(output_file),
+                    depends_on=self.depends_on,
+                )
+            )
@@ -0,0 +1,101 @@
+from dataclasses import dataclass, field
+from typing import List
+
+from core import args, capabilities, definitions, helpers, jobs
+
+required_binaries = ["ffmpeg"]
+
+
+@dataclass
+class StirlingPluginProxy(definitions.StirlingPlugin):
+    """StirlingPluginProxy creates a low quality copy of the source video, at
+    the source's resolution, for previewing and editing. It is encoded as
+    fast as possible with a keyframe every second, so editors can scrub it
+    smoothly, and is scheduled ahead of every other command so it is ready
+    in seconds rather than after the archive and streaming encodes."""
+
+    name: str = "proxy"
+    depends_on: list = field(default_factory=list)
+    # Negative, so the proxy runs before every other plugin's commands.
+    priority: int = -10
+
+    # Disable creating the editor proxy.
+    proxy_disable: bool = False
+    # The x264 preset. Faster presets make larger files at the same quality.
+    proxy_preset: str = "ultrafast"
+    # The Constant Rate Factor. Higher numbers are lower quality and smaller
+    # files.
+    proxy_crf: int = 32
+    # The time between keyframes, in seconds. Frequent keyframes make seeking
+    # fast, at the cost of a larger file.
+    proxy_keyframe_interval: float = 1.0
+    # The audio bitrate, in kilobits.
+    proxy_audio_bitrate: int = 96
+
+    # Contains outputs from the plugin for use in other plugins.
+    assets: List[definitions.StirlingPluginAssets] = field(default_factory=list)
+
+    def __post_init__(self):
+        if not self.proxy_disable:
+            # Check to make sure the appropriate binary files we need are installed.
+            assert helpers.check_dependencies_binaries(
+                required_binaries
+            ), AssertionError("Missing required binaries: {}".format(required_binaries))
+
+    def cmd(self, job: jobs.StirlingJob):
+        if not self.proxy_disable:
+            output_directory = job.output_directory / self.name
+            output_directory.mkdir(parents=True, exist_ok=True)
+            output_file = output_directory / (self.name + ".mp4")
+
+            stream = job.media_info.get_preferred_stream("video")
+            keyframe_interval = max(
+                round(stream.frame_rate * self.proxy_keyframe_interval), 1
+            )
+
+            options = {
+                "hide_banner": True,
+                "y": True,
+                "i": job.media_info.source,
+            }
+
+            video_options = {
+                "map": "0:{}".format(stream.stream),
+                "c:v": capabilities.best_encoder("h264") or "h264",
+                "preset": self.proxy_preset,
+                # Frames that are quick to decode, for smooth scrubbing.
+                "tune": "fastdecode",
+                "crf": self.proxy_crf,
+                "g": keyframe_interval,
+                "keyint_min": keyframe_interval,
+                "pix_fmt": "yuv420p",
+            }
+
+            # The audio is optional (the trailing ?), so sources without any
+            # still get a proxy. Quoted, as the unparser doesn't quote values.
+            audio_options = {
+                "map": "'0:a:0?'",
+                "c:a": capabilities.best_encoder("aac") or "aac",
+                "b:a": "{}k".format(self.proxy_audio_bitrate),
+                # Put the index at the start of the file, so it can be played
+                # before it is fully downloaded.
+                "movflags": "+faststart",
+            }
+
+            self.assets.append(
+                definitions.StirlingPluginAssets(name="proxy", path=output_file)
+            )
+
+            job.commands.append(
+                definitions.StirlingCmd(
+                    name=self.name,
+                    command="ffmpeg {} {} {}".format(
+                        args.ffmpeg_unparser.unparse(**options),
+                        args.ffmpeg_unparser.unparse(**video_options),
+                        args.ffmpeg_unparser.unparse(str(output_file), **audio_options),
+                    ),
+                    priority=self.priority,
+                    expected_output=str(output_file),
+                    depends_on=self.depends_on,
+                )
+            )
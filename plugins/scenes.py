@@ -0,0 +1,90 @@
+from dataclasses import dataclass, field
+from typing import List
+
+from core import annotations, definitions, helpers, jobs
+
+required_binaries = ["ffmpeg"]
+
+
+@dataclass
+class StirlingPluginScenes(definitions.StirlingPlugin):
+    """StirlingPluginScenes finds the scene cuts and black segments in the
+    source video. Frames are decoded at a tiny size in grayscale, and
+    analyzed a chunk at a time with NumPy (see core.scenes)."""
+
+    name: str = "scenes"
+    depends_on: list = field(default_factory=list)
+    priority: int = 10
+
+    # Disable scene cut and black detection.
+    scenes_disable: bool = False
+    # The number of frames per second to analyze. Lower rates are faster, but
+    # place the cuts less precisely. 0 analyzes every frame of the source.
+    scenes_rate: float = 0
+    # How different (0.0-1.0) a frame must be from the one before it to be
+    # treated as a scene cut.
+    scenes_threshold: float = 0.4
+    # Cuts closer together than this (in seconds) are merged.
+    scenes_min_length: float = 0.5
+    # Pixels darker than this (0.0-1.0) are treated as black.
+    scenes_black_pixel: float = 0.1
+    # The share (0.0-1.0) of a frame's pixels that must be black for the
+    # frame to be treated as black.
+    scenes_black_ratio: float = 0.98
+    # The shortest black segment to report, in seconds.
+    scenes_black_min_length: float = 0.5
+
+    # Contains outputs from the plugin for use in other plugins.
+    assets: List[definitions.StirlingPluginAssets] = field(default_factory=list)
+
+    def __post_init__(self):
+        if not self.scenes_disable:
+            # Check to make sure the appropriate binary files we need are installed.
+            assert helpers.check_dependencies_binaries(
+                required_binaries
+            ), AssertionError("Missing required binaries: {}".format(required_binaries))
+
+    def cmd(self, job: jobs.StirlingJob):
+        if not self.scenes_disable:
+            output_file = (
+                job.output_directory
+                / job.output_annotations_directory
+                / (self.name + ".json")
+            )
+
+            stream = job.media_info.get_preferred_stream("video")
+
+            options = {
+                "output": str(output_file),
+                "stream": stream.stream,
+                "rate": self.scenes_rate or stream.frame_rate,
+                "scene-threshold": self.scenes_threshold,
+                "min-scene-length": self.scenes_min_length,
+                "black-pixel": self.scenes_black_pixel,
+                "black-ratio": self.scenes_black_ratio,
+                "min-black-length": self.scenes_black_min_length,
+            }
+
+            self.assets.append(
+                definitions.StirlingPluginAssets(
+                    name="scenes_annotations", path=output_file
+                )
+            )
+            self.assets.append(
+                definitions.StirlingPluginAssets(
+                    name="scenes_columns",
+                    path=annotations.get_columns_path(output_file),
+                )
+            )
+
+            job.commands.append(
+                definitions.StirlingCmd(
+                    name=self.name,
+                    command=helpers.python_module_command(
+                        "core.scenes", str(job.media_info.source), **options
+                    ),
+                    priority=self.priority,
+                    expected_output=str(output_file),
+                    depends_on=self.depends_on,
+                )
+            )
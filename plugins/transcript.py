@@ -1,9 +1,14 @@
+import json
 from dataclasses import dataclass, field
+from pathlib import Path
+from typing import List
 
-from core import args, definitions, helpers, jobs
+from core import annotations, args, cache, definitions, helpers, jobs
 
-# Specify the required binaries in a list.
+# Specify the required binaries in a list. The chunked pipeline only needs
+# ffmpeg to decode the audio; autosub is only needed for the autosub backend.
 required_binaries = ["autosub"]
+required_binaries_pipeline = ["ffmpeg"]
 
 
 @dataclass
@@ -26,14 +31,50 @@ class StirlingPluginTranscript(definitions.StirlingPlugin):
     transcript_concurrency: int = 10
     # The format to output the transcript to.
     transcript_format: str = "json"
+    # The speech recognition backend to use. "autosub" sends the whole audio
+    # file to autosub. Any other value uses the chunked pipeline in
+    # core.transcribe, which detects speech, drops silence and transcribes the
+    # speech chunks in parallel with the named backend ("fake", or an import
+    # path such as "mypackage.asr:MyBackend").
+    transcript_backend: str = "autosub"
+    # Run the chunked pipeline's workers as threads or processes. Threads suit
+    # backends that call out to a remote API, processes suit local models.
+    # The number of workers is set by transcript_concurrency.
+    transcript_executor: str = "thread"
+    # How far over the noise floor (in decibels) audio must be to be treated
+    # as speech.
+    transcript_vad_threshold: float = 12.0
+    # Silences shorter than this (in seconds) don't split a speech chunk.
+    transcript_min_silence: float = 0.5
+    # The longest speech chunk to send to the backend, in seconds.
+    transcript_max_chunk: float = 30.0
+    # Disable the chunk cache. When enabled, the chunked pipeline stores the
+    # transcript of each speech chunk keyed by a hash of its audio and the
+    # backend and language settings, so re-running a job (or transcribing the
+    # same audio in another upload) never sends unchanged chunks to the
+    # backend again.
+    transcript_cache_disable: bool = False
+    # The folder for the chunk cache. It is shared by all jobs by default.
+    transcript_cache_directory: Path = cache.cache_root / "transcripts"
+    # The maximum size of the chunk cache, in megabytes. The least recently
+    # used chunks are evicted when it is full.
+    transcript_cache_size: int = 1024
+
+    # Contains outputs from the plugin for use in other plugins.
+    assets: List[definitions.StirlingPluginAssets] = field(default_factory=list)
 
     ## Extract Audio from file
     def __post_init__(self):
         if not self.transcript_disable:
             # Check to make sure the appropriate binary files we need are installed.
-            assert helpers.check_dependencies_binaries(
+            binaries = (
                 required_binaries
-            ), AssertionError("Missing required binaries: {}".format(required_binaries))
+                if self.transcript_backend == "autosub"
+                else required_binaries_pipeline
+            )
+            assert helpers.check_dependencies_binaries(binaries), AssertionError(
+                "Missing required binaries: {}".format(binaries)
+            )
 
     ## Extract Audio from file
     def cmd(self, job: jobs.StirlingJob):
@@ -46,23 +87,91 @@ class StirlingPluginTranscript(definitions.StirlingPlugin):
 
             input_file = job.get_plugin_asset("audio", "normalized_audio")
 
-            # Set the options to extract audio from the source file.
-            options = {
-                "o": str(output_file),
-                "D": self.transcript_lang_output,
-                "S": self.transcript_lang_input,
-                "C": self.transcript_concurrency,
-                "F": self.transcript_format,
-            }
+            self.assets.append(
+                definitions.StirlingPluginAssets(
+                    name="transcript_annotations", path=output_file
+                )
+            )
+
+            if self.transcript_backend == "autosub":
+                command = self.__autosub_command(input_file, output_file)
+            else:
+                command = self.__pipeline_command(input_file, output_file)
+                # The pipeline's chunk and cache counts.
+                self.assets.append(
+                    definitions.StirlingPluginAssets(
+                        name="transcript_stats",
+                        path=output_file.with_suffix(".stats.json"),
+                    )
+                )
+                # The pipeline also writes a columnar, time-indexed copy.
+                self.assets.append(
+                    definitions.StirlingPluginAssets(
+                        name="transcript_columns",
+                        path=annotations.get_columns_path(output_file),
+                    )
+                )
 
             job.commands.append(
                 definitions.StirlingCmd(
                     name=self.name,
-                    command="autosub {} {}".format(
-                        args.default_unparser.unparse(**options), str(input_file)
-                    ),
+                    command=command,
                     priority=self.priority,
                     expected_output=str(output_file),
                     depends_on=self.depends_on,
                 )
             )
+
+    def done(self, job: jobs.StirlingJob, cmd: definitions.StirlingCmd):
+        if self.transcript_backend == "autosub":
+            return
+        try:
+            with open(job.get_plugin_asset(self.name, "transcript_stats")) as f:
+                stats = json.load(f)
+        except (OSError, ValueError):
+            return
+        job.log(
+            "Transcribed {} speech chunks ({:.1f}s of speech in {:.1f}s of "
+            "audio): {} found in the cache, {} sent to the backend.".format(
+                stats["chunks"],
+                stats["speech"],
+                stats["duration"],
+                stats["cached"],
+                stats["transcribed"],
+            )
+        )
+
+    def __autosub_command(self, input_file, output_file) -> str:
+        # Set the options to extract audio from the source file.
+        options = {
+            "o": str(output_file),
+            "D": self.transcript_lang_output,
+            "S": self.transcript_lang_input,
+            "C": self.transcript_concurrency,
+            "F": self.transcript_format,
+        }
+
+        return "autosub {} {}".format(
+            args.default_unparser.unparse(**options), str(input_file)
+        )
+
+    def __pipeline_command(self, input_file, output_file) -> str:
+        options = {
+            "output": str(output_file),
+            "format": self.transcript_format,
+            "backend": self.transcript_backend,
+            "language": self.transcript_lang_input,
+            "workers": self.transcript_concurrency,
+            "executor": self.transcript_executor,
+            "threshold": self.transcript_vad_threshold,
+            "min-silence": self.transcript_min_silence,
+            "max-chunk": self.transcript_max_chunk,
+        }
+
+        if not self.transcript_cache_disable:
+            options["cache-directory"] = str(self.transcript_cache_directory)
+            options["cache-size"] = self.transcript_cache_size
+
+        return helpers.python_module_command(
+            "core.transcribe", str(input_file), **options
+        )
@@ -0,0 +1,99 @@
+import shutil
+import sys
+from pathlib import Path
+
+import pytest
+
+root = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(root))
+sys.path.insert(0, str(root / "benchmarks"))
+
+import synthetic  # noqa: E402
+
+from core import definitions, jobs, probe  # noqa: E402
+
+# The tests run real jobs, with real ffmpeg commands, on small synthetic
+# sources (see benchmarks/synthetic). On hosts without ffprobe, the probe
+# result is filled in from the synthetic source's known parameters instead.
+
+StirlingMediaInfo = probe.StirlingMediaInfo
+
+
+def get_media_info(
+    source: str, duration: float, width: int, height: int, rate: float, channels: int
+) -> StirlingMediaInfo:
+    """Get what ffprobe reports for a synthetic source."""
+
+    info = StirlingMediaInfo.__new__(StirlingMediaInfo)
+    info.__dict__.update(
+        source=source,
+        video_streams=[
+            definitions.StreamVideo(
+                stream=0,
+                duration=duration,
+                codec="h264",
+                profile="High",
+                bitrate=1000000,
+                width=width,
+                height=height,
+                frame_rate=rate,
+                aspect=[str(width), str(height)],
+            )
+        ],
+        audio_streams=[],
+        text_streams=[],
+        preferred={"video": 0, "audio": None},
+    )
+    if channels > 0:
+        info.audio_streams.append(
+            definitions.StreamAudio(
+                stream=1,
+                duration=duration,
+                codec="aac",
+                profile="LC",
+                bitrate=64000 * channels,
+                sample_rate=48000,
+                channels=channels,
+                channel_layout="stereo" if channels == 2 else "",
+            )
+        )
+        info.preferred["audio"] = 1
+    return info
+
+
+@pytest.fixture(scope="session")
+def sources(tmp_path_factory):
+    directory = tmp_path_factory.mktemp("sources")
+
+    def get(duration=2, width=320, height=180, rate=25, channels=2):
+        path = directory / "{}x{}_{}fps_{}s_{}ch.mp4".format(
+            width, height, rate, duration, channels
+        )
+        synthetic.generate(path, duration, width, height, rate, channels)
+        return path, (duration, width, height, rate, channels)
+
+    return get
+
+
+@pytest.fixture
+def make_job(sources, tmp_path, monkeypatch):
+    """Create a job on a synthetic source, in a temporary folder."""
+
+    monkeypatch.chdir(tmp_path)
+
+    def make(source_options: dict = None, **options):
+        source, parameters = sources(**(source_options or {}))
+        if shutil.which("ffprobe") is None:
+            monkeypatch.setattr(
+                probe,
+                "StirlingMediaInfo",
+                lambda source: get_media_info(str(source), *parameters),
+            )
+        return jobs.StirlingJob(
+            source=str(source),
+            output_directory=tmp_path / "output",
+            debug=False,
+            **options,
+        )
+
+    return make
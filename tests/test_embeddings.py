@@ -0,0 +1,33 @@
+import numpy
+
+from core import embeddings
+
+
+def test_partitions_are_retrained_as_the_index_grows(tmp_path):
+    rng = numpy.random.default_rng(1)
+    gallery = embeddings.normalize(rng.standard_normal((200, 16)))
+    index = embeddings.StirlingEmbeddingIndex(
+        tmp_path / "index", dim=16, partition_threshold=100, nprobe=100
+    )
+
+    index.add(gallery[:100])
+    assert (index.settings["partitions"], index.settings["partitioned_count"]) == (
+        10,
+        100,
+    )
+
+    index.add(gallery[100:199])
+    assert index.settings["partitioned_count"] == 100
+
+    index.add(gallery[199:])
+    assert (index.settings["partitions"], index.settings["partitioned_count"]) == (
+        14,
+        200,
+    )
+    assignment = numpy.fromfile(tmp_path / "index" / "partitions.i32", numpy.int32)
+    assert len(assignment) == len(index) == 200
+
+    # Reopened, the index has the same settings.
+    index = embeddings.StirlingEmbeddingIndex(tmp_path / "index")
+    _, indices = index.query(gallery, k=1)
+    assert (indices[:, 0] == numpy.arange(200)).all()
@@ -0,0 +1,33 @@
+from core import definitions
+from plugins import hls
+
+
+def get_stream(width: int, height: int) -> definitions.StreamVideo:
+    return definitions.StreamVideo(
+        stream=0,
+        duration=10,
+        codec="h264",
+        profile="High",
+        bitrate=8000000,
+        width=width,
+        height=height,
+        frame_rate=25,
+        aspect=[str(width), str(height)],
+    )
+
+
+def test_ladder_is_named_for_fitted_heights():
+    # A 2.39:1 source fills each rendition's width, and is shorter than its
+    # box.
+    ladder, _ = hls.resolve_ladder(
+        hls.StirlingPluginHLS().hls_encoder_profiles, get_stream(1920, 804)
+    )
+
+    names = [rendition["name"] for rendition in ladder]
+    assert len(names) == len(set(names))
+    for rendition in ladder:
+        assert rendition["name"].startswith("{}p".format(rendition["height"]))
+
+    [rendition] = [r for r in ladder if r["profile"] == "480p"]
+    assert (rendition["width"], rendition["height"]) == (640, 268)
+    assert rendition["name"] == "268p"
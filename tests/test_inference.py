@@ -0,0 +1,63 @@
+import os
+import threading
+from multiprocessing.connection import Listener
+
+import pytest
+
+inference = pytest.importorskip("core.inference")
+
+
+@pytest.fixture
+def socket_path(tmp_path):
+    directory = tmp_path / "inference"
+    inference.make_private_directory(directory)
+    return str(directory / "inference.sock")
+
+
+def get_server(socket_path: str):
+    # The model isn't needed to serve connections.
+    server = inference.StirlingInferenceServer.__new__(
+        inference.StirlingInferenceServer
+    )
+    server.socket_path = socket_path
+    server.batch_size = 1
+    server.device = "cpu"
+    return server
+
+
+def test_private_directory_is_checked(tmp_path):
+    directory = tmp_path / "inference"
+    inference.make_private_directory(directory)
+    assert os.stat(directory).st_mode & 0o777 == 0o700
+
+    os.chmod(directory, 0o755)
+    with pytest.raises(PermissionError):
+        inference.make_private_directory(directory)
+
+
+def test_clients_need_the_key(socket_path):
+    authkey = b"key"
+    inference.get_authkey_file(socket_path).write_bytes(authkey)
+    listener = Listener(socket_path, family="AF_UNIX", authkey=authkey)
+    accepted = threading.Thread(target=lambda: listener.accept().close())
+    accepted.start()
+    inference.StirlingInferenceClient(socket_path).close()
+    accepted.join()
+
+    inference.get_authkey_file(socket_path).write_bytes(b"wrong key")
+    rejected = threading.Thread(
+        target=lambda: pytest.raises(inference.AuthenticationError, listener.accept)
+    )
+    rejected.start()
+    with pytest.raises(inference.AuthenticationError):
+        inference.StirlingInferenceClient(socket_path)
+    rejected.join()
+    listener.close()
+
+
+def test_refuses_to_replace_a_running_worker(socket_path):
+    listener = Listener(socket_path, family="AF_UNIX")
+    with pytest.raises(RuntimeError):
+        get_server(socket_path).serve()
+    assert os.path.exists(socket_path)
+    listener.close()
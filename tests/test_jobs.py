@@ -0,0 +1,94 @@
+import dataclasses
+import json
+import shutil
+from pathlib import Path
+
+import pytest
+
+import plugins
+from core import definitions, helpers
+
+
+def test_audio_plugin_runs(make_job):
+    job = make_job()
+    job.add_plugins(plugins.get_plugin("audio"))
+    job.run()
+    job.close()
+
+    [cmd] = job.commands
+    assert cmd.status == definitions.StirlingCmdStatus.SUCCESS
+    assert job.get_plugin_asset("audio", "normalized_audio").is_file()
+
+
+def test_missed_deadline_is_recorded(make_job):
+    job = make_job(deadline=0.001)
+    job.add_plugins(plugins.get_plugin("audio"))
+    job.run()
+    job.close()
+
+    with open(job.job_file) as f:
+        record = json.load(f)["plugin_metadata"]["deadline"]
+    assert record["met"] is False
+
+
+def test_usage_keeps_zero_counters(make_job):
+    job = make_job()
+    job.add_plugins(plugins.get_plugin("audio"))
+    job.run()
+    job.close()
+
+    fields = [f.name for f in dataclasses.fields(definitions.StirlingCmdUsage)]
+    with open(job.job_file) as f:
+        usage = json.load(f)["usage"]
+    for record in usage["commands"] + list(usage["plugins"].values()):
+        assert all(name in record for name in fields)
+
+    usage = definitions.StirlingCmdUsage(time=1.0)
+    assert json.loads(json.dumps(usage, cls=helpers.StirlingJSONEncoder)) == {
+        name: 0 for name in fields
+    } | {"time": 1.0}
+
+
+def test_long_gop_source_is_encoded_not_copied(make_job):
+    # The synthetic source has a single keyframe, where the archive promises
+    # one every second.
+    job = make_job()
+    job.add_plugins(plugins.get_plugin("video"))
+    job.run()
+    job.close()
+
+    assert "-c:v copy" not in job.commands[0].command
+    with open(job.job_file) as f:
+        assert json.load(f)["plugin_metadata"]["video"]["copy"] is False
+
+
+@pytest.mark.skipif(shutil.which("ffprobe") is None, reason="needs ffprobe")
+def test_keyframe_interval_is_sampled_across_the_source(make_job):
+    job = make_job({"duration": 12})
+    stream = job.media_info.get_preferred_stream("video")
+    # Keyframes 10 seconds apart (libx264's default GOP of 250 frames). Read
+    # whole, the gap is measured; sampled in windows shorter than the gap,
+    # each window counts as one whole gap.
+    assert job.media_info.get_keyframe_interval(stream.stream) == pytest.approx(10)
+    assert job.media_info.get_keyframe_interval(
+        stream.stream, windows=3, window=2
+    ) == pytest.approx(2)
+
+
+def test_master_playlist_is_ready_after_its_renditions(make_job):
+    job = make_job()
+    job.add_plugins(plugins.get_plugin("hls"))
+    job.run()
+    job.close()
+
+    assert all(
+        cmd.status == definitions.StirlingCmdStatus.SUCCESS for cmd in job.commands
+    )
+    [encode] = [cmd for cmd in job.commands if cmd.name == "hls"]
+    output_directory = Path(encode.expected_output)
+    master = str(output_directory / "playlist.m3u8")
+    iframes = str(output_directory / "*_iframes.m3u8")
+    assert len(job.outputs_ready) == len(set(job.outputs_ready))
+    # The master playlist is ready together with the I-frame playlists
+    # added to it, after the renditions it lists.
+    assert job.outputs_ready == [str(output_directory), master, iframes]